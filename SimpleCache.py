@@ -7,6 +7,9 @@ class SimpleCache:
     def __init__(self):
         self.cache = {}
         self.ttl = 300  # 5分钟
+        # 命中/未命中次数，由 /metrics 导出
+        self.hits = 0
+        self.misses = 0
     
     def set(self, key, value):
         self.cache[key] = {
@@ -18,9 +21,11 @@ class SimpleCache:
         if key in self.cache:
             item = self.cache[key]
             if (datetime.now() - item['timestamp']).total_seconds() < self.ttl:
+                self.hits += 1
                 return item['value']
             else:
                 del self.cache[key]
+        self.misses += 1
         return None
     
     def delete(self, key):
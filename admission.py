@@ -0,0 +1,251 @@
+"""
+自适应准入控制（负载削减）模块
+
+数据库或 DeepSeek 上游变慢时，请求会在 anyio 线程池和事件循环中越积越多，内存和延迟随之失控。
+AdmissionMiddleware 按路由类别限制同时处理的请求数：
+
+    auth    /login、/register、/api/token*（bcrypt 计算）
+    ai      /api/ai/*、/api/proxy/*（等待上游）
+    write   /api/* 与 /users/* 上的增删改请求
+    read    /api/* 与 /users/* 上的读请求
+    static  其他路径（静态文件、页面）
+
+每个类别的并发上限按 AIMD 自动调整：请求的首字节延迟低于该类别的目标延迟时上限加 1/上限
+（每轮约加1），超过目标延迟或返回5xx时上限乘以 ADMISSION_DECREASE_FACTOR（每个延迟周期最多减一次）。
+达到上限的请求最多排队 ADMISSION_MAX_WAIT_MS 毫秒（排队数不超过当前上限），
+仍未获得名额时立即返回 503 和 Retry-After，不再占用线程池和数据库连接。
+
+/health、/metrics 和 /api/admin/* 不受限制，过载时仍可用于探测、监控和处置；/api/batch 本身不计数，
+其中的子请求按各自的类别准入。
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_WAIT_MS = float(os.getenv("ADMISSION_MAX_WAIT_MS", 50))
+ADMISSION_DECREASE_FACTOR = float(os.getenv("ADMISSION_DECREASE_FACTOR", 0.9))
+
+# 类别 -> (初始上限, 最大上限, 目标首字节延迟毫秒)
+DEFAULT_CLASSES = {
+    "auth": (8, 32, 1000),
+    "ai": (32, 256, 30000),
+    "write": (16, 64, 500),
+    "read": (32, 256, 250),
+    "static": (64, 512, 100),
+}
+MIN_LIMIT = 1.0
+# 首字节延迟的平滑系数
+EWMA_ALPHA = 0.2
+
+PRIORITY_PATHS = ("/health", "/metrics")
+PRIORITY_PREFIXES = ("/api/admin/",)
+UNCOUNTED_PATHS = ("/api/batch",)
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """
+    请求所属的类别；不受限制的路径返回None
+    """
+    if path in PRIORITY_PATHS or path.startswith(PRIORITY_PREFIXES) or path in UNCOUNTED_PATHS:
+        return None
+    if path in ("/login", "/register") or path.startswith("/api/token"):
+        return "auth"
+    if path.startswith(("/api/ai/", "/api/proxy/")):
+        return "ai"
+    if path.startswith(("/api/", "/users")):
+        return "read" if method in READ_METHODS else "write"
+    return "static"
+
+
+class AdaptiveLimit:
+    """
+    单个类别的 AIMD 并发上限
+
+    Args:
+        initial (float): 初始上限
+        maximum (float): 上限的最大值
+        target_ms (float): 目标首字节延迟（毫秒）
+    """
+
+    def __init__(self, initial: float, maximum: float, target_ms: float):
+        self.limit = float(initial)
+        self.maximum = float(maximum)
+        self.target = target_ms / 1000
+        self.in_flight = 0
+        self.latency = 0.0  # 首字节延迟的EWMA（秒）
+        self._last_decrease = 0.0
+        self._waiters: deque = deque()
+        self.stats = {"admitted": 0, "rejected": 0, "queued": 0, "queue_seconds": 0.0, "decreases": 0}
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self, max_wait: float) -> bool:
+        """
+        获取一个名额；排队超过 max_wait 秒或队列已满时返回False
+        """
+        if self._has_capacity() and not self._waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return True
+        if max_wait <= 0 or len(self._waiters) >= int(self.limit):
+            self.stats["rejected"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 客户端断开：已转交的名额归还，否则退出队列
+            if waiter.done():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        self.stats["queue_seconds"] += time.monotonic() - started
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            self.stats["rejected"] += 1
+            return False
+        self.stats["admitted"] += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # 名额直接转交给排队的请求，in_flight 不变
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def record(self, latency: float, failed: bool):
+        """
+        按一次请求的首字节延迟和结果调整上限
+        """
+        self.latency = latency if self.latency == 0 else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+        now = time.monotonic()
+        if failed or latency > self.target:
+            # 一个延迟周期内只减一次，避免同一批慢请求把上限连续压到最低
+            if now - self._last_decrease >= max(self.latency, self.target):
+                self.limit = max(MIN_LIMIT, self.limit * ADMISSION_DECREASE_FACTOR)
+                self._last_decrease = now
+                self.stats["decreases"] += 1
+        elif self.in_flight >= int(self.limit) - 1:
+            # 只在上限实际被用到时增加，空闲时上限不会无限增长
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._wake()
+
+    def retry_after(self) -> int:
+        """
+        建议客户端重试前等待的秒数
+        """
+        return max(1, math.ceil(self.latency))
+
+    def snapshot(self) -> dict:
+        return dict(
+            self.stats,
+            limit=round(self.limit, 2),
+            in_flight=self.in_flight,
+            waiting=len(self._waiters),
+            latency_ms=round(self.latency * 1000, 1),
+            target_ms=self.target * 1000,
+        )
+
+
+class AdmissionController:
+    """
+    各路由类别的自适应并发上限
+    """
+
+    def __init__(self, classes: Dict[str, tuple] = None, max_wait_ms: float = ADMISSION_MAX_WAIT_MS):
+        self.max_wait = max_wait_ms / 1000
+        self.limits: Dict[str, AdaptiveLimit] = {}
+        for name, (initial, maximum, target_ms) in (classes or DEFAULT_CLASSES).items():
+            prefix = f"ADMISSION_{name.upper()}"
+            self.limits[name] = AdaptiveLimit(
+                int(os.getenv(f"{prefix}_LIMIT", initial)),
+                int(os.getenv(f"{prefix}_MAX_LIMIT", maximum)),
+                float(os.getenv(f"{prefix}_TARGET_MS", target_ms)),
+            )
+
+    def snapshot(self) -> dict:
+        return {"enabled": ADMISSION_ENABLED, "classes": {name: limit.snapshot() for name, limit in self.limits.items()}}
+
+
+class AdmissionMiddleware:
+    """
+    按路由类别准入请求的ASGI中间件，超出上限时返回503
+    """
+
+    def __init__(self, app: ASGIApp, controller: "AdmissionController" = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.controller.limits[name]
+        if not await limit.acquire(self.controller.max_wait):
+            await self._reject(send, limit, name)
+            return
+
+        started = time.monotonic()
+        recorded = False
+
+        async def send_wrapper(message):
+            nonlocal recorded
+            if message["type"] == "http.response.start" and not recorded:
+                recorded = True
+                limit.record(time.monotonic() - started, message["status"] >= 500)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not recorded:
+                limit.record(time.monotonic() - started, True)
+            raise
+        finally:
+            limit.release()
+
+    async def _reject(self, send: Send, limit: AdaptiveLimit, name: str):
+        body = b'{"detail":"Server is busy, please retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limit.retry_after()).encode()),
+                (b"x-admission-class", name.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# 创建全局实例
+admission_controller = AdmissionController()
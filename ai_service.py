@@ -0,0 +1,251 @@
+"""
+AI对话服务模块
+
+封装对话补全接口（DeepSeek 等兼容 OpenAI chat/completions 协议的上游）的调用：
+选择API配置、解密密钥、构造请求，以及普通模式和流式(SSE)模式的响应处理。
+相同的提问会命中补全缓存（见 completion_cache.py），不再调用上游；
+默认配置接近每小时配额时，切换到同类别中优先级最高的可用配置（见 quota.py）。
+"""
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, Request
+from sqlalchemy.orm import Session
+
+from completion_cache import completion_cache, make_cache_key
+from crude import get_decrypted_api_key
+from http_clients import outbound_clients
+from models import ApiConfig
+from quota import get_failover_candidates, request_quota, select_available_config
+
+# 默认使用的对话API配置名称和模型
+AI_CHAT_CONFIG_NAME = os.getenv("AI_CHAT_CONFIG_NAME", "DeepSeek")
+AI_CHAT_MODEL = os.getenv("AI_CHAT_MODEL", "deepseek-chat")
+
+
+def get_chat_config(db: Session) -> ApiConfig:
+    """
+    获取默认的AI API配置（例如 DeepSeek 或 OpenAI）
+
+    Raises:
+        HTTPException: 配置不存在时抛出404错误
+    """
+    api_config = db.query(ApiConfig).filter(
+        ApiConfig.name == AI_CHAT_CONFIG_NAME,
+        ApiConfig.is_active == True
+    ).first()
+    if not api_config:
+        raise HTTPException(status_code=404, detail="AI API配置未找到")
+    return api_config
+
+
+def select_chat_config(db: Session) -> ApiConfig:
+    """
+    选择本次对话使用的API配置
+
+    默认配置仍有配额余量时直接使用，否则按优先级切换到同类别的其他激活配置。
+    只有在需要切换时才查询候选配置。
+    """
+    primary = get_chat_config(db)
+    if request_quota.is_available(primary):
+        return primary
+    return select_available_config(get_failover_candidates(db, primary))
+
+
+def _record_upstream_status(api_config: ApiConfig, response: httpx.Response):
+    # 上游仍返回429时，按 Retry-After 暂停使用该配置
+    if response.status_code == 429:
+        retry_after = response.headers.get("retry-after", "")
+        request_quota.block(api_config.id, float(retry_after) if retry_after.isdigit() else 60)
+
+
+def release_db(db: Session):
+    """
+    在等待上游之前归还数据库连接
+
+    会话关闭后已加载的对象仍可读取。若在等待上游期间一直占用连接，
+    并发超过连接池大小时，后续请求会在事件循环中阻塞等待连接，整个进程随之停顿。
+    """
+    db.close()
+
+
+def chat_messages(message: str) -> list:
+    return [{"role": "user", "content": message}]
+
+
+def build_chat_request(db: Session, api_config: ApiConfig, message: str, stream: bool = False) -> Tuple[dict, dict]:
+    """
+    构造对话请求的请求头和请求体
+
+    Args:
+        db (Session): 数据库会话
+        api_config (ApiConfig): 使用的API配置
+        message (str): 用户消息
+        stream (bool): 是否请求流式响应
+
+    Returns:
+        Tuple[dict, dict]: (请求头, 请求体)
+
+    Raises:
+        HTTPException: 无法解密API密钥时抛出500错误
+    """
+    api_key = get_decrypted_api_key(db, api_config.id)
+    if not api_key:
+        raise HTTPException(status_code=500, detail="无法解密API密钥")
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "messages": chat_messages(message),
+        "model": AI_CHAT_MODEL
+    }
+    if stream:
+        payload["stream"] = True
+    return headers, payload
+
+
+def chat_cache_slot(api_config: ApiConfig, message: str) -> Tuple[str, int]:
+    """
+    返回对话请求的缓存键和该API配置的缓存有效期（秒）
+    """
+    return make_cache_key(api_config.id, AI_CHAT_MODEL, chat_messages(message)), api_config.cache_ttl or 0
+
+
+def get_cached_chat(api_config: ApiConfig, message: str, use_cache: bool = True) -> Tuple[Optional[str], str]:
+    """
+    查询补全缓存
+
+    Returns:
+        Tuple[Optional[str], str]: (缓存的回复，未命中为None; 缓存状态 HIT/MISS/BYPASS)
+    """
+    if not use_cache:
+        completion_cache.record_bypass()
+        return None, "BYPASS"
+    cache_key, ttl = chat_cache_slot(api_config, message)
+    if ttl <= 0:
+        return None, "MISS"
+    cached = completion_cache.get(cache_key)
+    return cached, "HIT" if cached is not None else "MISS"
+
+
+async def complete_chat(db: Session, api_config: ApiConfig, message: str, use_cache: bool = True) -> Tuple[str, str]:
+    """
+    调用上游对话接口并返回完整回复，优先使用补全缓存
+
+    Args:
+        db (Session): 数据库会话
+        api_config (ApiConfig): 使用的API配置
+        message (str): 用户消息
+        use_cache (bool): 为False时跳过缓存查询（结果仍会写入缓存）
+
+    Returns:
+        Tuple[str, str]: (AI回复内容, 缓存状态 HIT/MISS/BYPASS)
+    """
+    cached, cache_status = get_cached_chat(api_config, message, use_cache)
+    if cached is not None:
+        return cached, cache_status
+
+    # 解密密钥需要查询数据库，放到线程池中执行，不阻塞事件循环
+    headers, payload = await asyncio.to_thread(build_chat_request, db, api_config, message)
+    release_db(db)
+
+    # 使用共享连接池，复用到上游的TCP/TLS连接
+    request_quota.record(api_config.id)
+    response = await outbound_clients.request("POST", api_config.endpoint, api_config=api_config,
+                                            headers=headers, json=payload)
+    _record_upstream_status(api_config, response)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+
+    result = response.json()
+    content = result["choices"][0]["message"]["content"]
+    cache_key, ttl = chat_cache_slot(api_config, message)
+    completion_cache.set(cache_key, content, ttl)
+    return content, cache_status
+
+
+async def open_chat_stream(db: Session, api_config: ApiConfig, message: str) -> httpx.Response:
+    """
+    以流式模式调用上游对话接口
+
+    在开始向客户端输出之前先检查上游状态码，出错时仍可返回正常的错误响应。
+    调用方负责在结束后用 outbound_clients.close_stream() 关闭返回的响应。
+
+    Args:
+        db (Session): 数据库会话
+        api_config (ApiConfig): 使用的API配置
+        message (str): 用户消息
+
+    Returns:
+        httpx.Response: 尚未读取响应体的上游响应
+    """
+    headers, payload = await asyncio.to_thread(build_chat_request, db, api_config, message, True)
+    release_db(db)
+
+    request_quota.record(api_config.id)
+    response = await outbound_clients.send_stream("POST", api_config.endpoint, api_config=api_config,
+                                                headers=headers, json=payload)
+    _record_upstream_status(api_config, response)
+    if response.status_code != 200:
+        detail = (await response.aread()).decode(errors="replace")
+        await outbound_clients.close_stream(response, api_config)
+        raise HTTPException(status_code=response.status_code, detail=detail)
+    return response
+
+
+def _sse(data: dict) -> str:
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def relay_chat_stream(response: httpx.Response, request: Request,
+                            cache_key: Optional[str] = None, cache_ttl: int = 0,
+                            api_config: Optional[ApiConfig] = None) -> AsyncIterator[str]:
+    """
+    将上游的流式响应逐段转发为服务器发送事件(SSE)
+
+    每次只在客户端取走上一段后才读取下一段上游数据，形成自然的背压；
+    客户端断开时停止读取。无论正常结束、客户端断开还是读取出错，上游响应都会被关闭。
+    上游完整结束时，拼接后的回复写入补全缓存。
+
+    Yields:
+        str: SSE 事件，格式为 data: {"content": "..."}，结束时为 data: [DONE]
+    """
+    parts = []
+    completed = False
+    try:
+        async for line in response.aiter_lines():
+            if await request.is_disconnected():
+                break
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                completed = True
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            choices = chunk.get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                parts.append(content)
+                yield _sse({"content": content})
+    finally:
+        await outbound_clients.close_stream(response, api_config)
+    if completed and cache_key:
+        completion_cache.set(cache_key, "".join(parts), cache_ttl)
+    yield "data: [DONE]\n\n"
+
+
+async def replay_cached_stream(content: str) -> AsyncIterator[str]:
+    """
+    以SSE格式输出缓存中的完整回复
+    """
+    yield _sse({"content": content})
+    yield "data: [DONE]\n\n"
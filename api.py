@@ -2,6 +2,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database import get_db
+from fast_json import list_response
 from crude import (
     create_user, get_users, update_user, delete_user,
     create_admin, get_admins, update_admin, delete_admin,
@@ -23,7 +24,7 @@ def create_user_endpoint(user: UserCreate, db: Session = Depends(get_db)):
 
 @router.get("/users", response_model=list[User])
 def read_users(skip: int = 0, limit: int = 100, search: str = None, db: Session = Depends(get_db)):
-    return get_users(db, skip=skip, limit=limit, search=search)
+    return list_response(User, get_users(db, skip=skip, limit=limit, search=search))
 
 @router.put("/users/{user_id}", response_model=User)
 def update_user_endpoint(user_id: int, user_data: UserUpdate, db: Session = Depends(get_db)):
@@ -42,7 +43,7 @@ def create_admin_endpoint(admin: AdminCreate, db: Session = Depends(get_db)):
 
 @router.get("/admins", response_model=list[Admin])
 def read_admins(skip: int = 0, limit: int = 100, search: str = None, db: Session = Depends(get_db)):
-    return get_admins(db, skip=skip, limit=limit, search=search)
+    return list_response(Admin, get_admins(db, skip=skip, limit=limit, search=search))
 
 @router.put("/admins/{admin_id}", response_model=Admin)
 def update_admin_endpoint(admin_id: int, admin_data: AdminUpdate, db: Session = Depends(get_db)):
@@ -61,7 +62,7 @@ def create_api_config_endpoint(api_config: ApiConfigCreate, db: Session = Depend
 
 @router.get("/api-configs", response_model=list[ApiConfig])
 def read_api_configs(skip: int = 0, limit: int = 100, search: str = None, db: Session = Depends(get_db)):
-    return get_api_configs(db, skip=skip, limit=limit, search=search)
+    return list_response(ApiConfig, get_api_configs(db, skip=skip, limit=limit, search=search))
 
 @router.put("/api-configs/{config_id}", response_model=ApiConfig)
 def update_api_config_endpoint(config_id: int, api_config: ApiConfigUpdate, db: Session = Depends(get_db)):
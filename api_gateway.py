@@ -0,0 +1,244 @@
+"""
+通用出站网关模块
+
+按 ApiConfig 的 endpoint、method、auth_type 和解密后的密钥调用任意已登记的外部API
+（音乐、人脸、声纹等提供商），供 /api/proxy/{config_id} 使用。
+
+- 每个配置可单独设置超时（ApiConfig.timeout_seconds）
+- 幂等方法在连接失败、超时或 502/503/504 时按带抖动的指数退避重试
+- 每个配置一个熔断器：连续失败达到阈值后在冷却期内直接失败，
+  不再占用线程和连接等待不健康的上游；冷却期后放行一个探测请求
+- 每次调用的延迟和结果反馈给负载均衡器（见 load_balancer.py），
+  按类别调用时由均衡器在同类配置中选择
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException, status
+
+from http_clients import OUTBOUND_CONNECT_TIMEOUT, outbound_clients
+from load_balancer import latency_balancer
+from models import ApiConfig
+from quota import request_quota, select_available_config
+from secure_keys import secure_key_manager
+
+GATEWAY_MAX_RETRIES = int(os.getenv("GATEWAY_MAX_RETRIES", 2))
+GATEWAY_BACKOFF_BASE = float(os.getenv("GATEWAY_BACKOFF_BASE", 0.2))
+GATEWAY_BACKOFF_MAX = float(os.getenv("GATEWAY_BACKOFF_MAX", 5))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", 30))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed: 正常放行；连续失败达到阈值后进入 open
+    open: 冷却期内直接拒绝；冷却期结束后进入 half_open
+    half_open: 只放行一个探测请求，成功则 closed，失败则重新 open
+    """
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, open_seconds: float = CIRCUIT_OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self):
+        """
+        调用被取消、结果未知时归还半开探测名额，状态不变
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        """
+        冷却期内返回True（不占用半开探测名额）
+        """
+        return self.state == "open" and time.monotonic() - self.opened_at < self.open_seconds
+
+    def retry_after(self) -> int:
+        remaining = self.open_seconds - (time.monotonic() - self.opened_at)
+        return max(1, int(remaining) + 1)
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+_breakers: Dict[int, CircuitBreaker] = {}
+
+
+def get_breaker(config_id: int) -> CircuitBreaker:
+    breaker = _breakers.get(config_id)
+    if breaker is None:
+        breaker = _breakers.setdefault(config_id, CircuitBreaker())
+    return breaker
+
+
+def breaker_states() -> Dict[int, dict]:
+    return {config_id: breaker.snapshot() for config_id, breaker in _breakers.items()}
+
+
+def build_auth_headers(api_config: ApiConfig) -> dict:
+    """
+    根据 auth_type 构造认证请求头
+    """
+    if not api_config.encrypted_key or (api_config.auth_type or "none") == "none":
+        return {}
+    api_key = secure_key_manager.decrypt_key(api_config.encrypted_key)
+    if api_config.auth_type == "apiKey":
+        return {"X-API-Key": api_key}
+    # bearer 和 oauth 都以 Bearer 令牌发送
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def _backoff(attempt: int) -> float:
+    # 全抖动指数退避：在 [0, min(上限, 基数 * 2^attempt)] 内随机
+    return random.uniform(0, min(GATEWAY_BACKOFF_MAX, GATEWAY_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _timeout(api_config: ApiConfig) -> Optional[httpx.Timeout]:
+    if not api_config.timeout_seconds:
+        return None
+    seconds = float(api_config.timeout_seconds)
+    return httpx.Timeout(seconds, connect=min(seconds, OUTBOUND_CONNECT_TIMEOUT))
+
+
+async def call_api_config(api_config: ApiConfig, params: Optional[dict] = None, content: Optional[bytes] = None,
+                          headers: Optional[dict] = None) -> httpx.Response:
+    """
+    按API配置调用上游
+
+    Args:
+        api_config (ApiConfig): 要调用的API配置
+        params (Optional[dict]): 查询参数
+        content (Optional[bytes]): 请求体
+        headers (Optional[dict]): 额外请求头（如 Content-Type）
+
+    Returns:
+        httpx.Response: 上游响应
+
+    Raises:
+        HTTPException: 配置停用(404)、配额耗尽(429)、熔断中(503)、上游不可达(502/504)
+    """
+    if not api_config.is_active:
+        raise HTTPException(status_code=404, detail="API config not found")
+    select_available_config([api_config])
+
+    method = (api_config.method or "GET").upper()
+    # 先构造认证头：解密密钥失败时不应占用半开探测名额
+    request_headers = dict(headers or {}, **build_auth_headers(api_config))
+    kwargs = {"params": params, "content": content, "headers": request_headers}
+    timeout = _timeout(api_config)
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    attempts = 1 + (GATEWAY_MAX_RETRIES if method in IDEMPOTENT_METHODS else 0)
+
+    breaker = get_breaker(api_config.id)
+    if not breaker.allow():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="上游服务暂不可用，请稍后重试",
+            headers={"Retry-After": str(breaker.retry_after())},
+        )
+
+    try:
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            request_quota.record(api_config.id)
+            started = latency_balancer.start(api_config.id)
+            response = error = None
+            try:
+                response = await outbound_clients.request(method, api_config.endpoint, api_config=api_config, **kwargs)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                error = e
+            finally:
+                # 取消或其他异常时同样结束计数，否则 in_flight 泄漏会让该配置一直被降权
+                latency_balancer.finish(api_config.id, started, ok=response is not None and response.status_code < 500)
+            if error is not None:
+                if not last_attempt:
+                    await asyncio.sleep(_backoff(attempt))
+                    continue
+                breaker.record_failure()
+                timed_out = isinstance(error, httpx.TimeoutException)
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT if timed_out else status.HTTP_502_BAD_GATEWAY,
+                    detail=f"上游请求失败: {type(error).__name__}",
+                )
+            if response.status_code in RETRYABLE_STATUS and not last_attempt:
+                await asyncio.sleep(_backoff(attempt))
+                continue
+            if response.status_code == 429:
+                retry_after = response.headers.get("retry-after", "")
+                request_quota.block(api_config.id, float(retry_after) if retry_after.isdigit() else 60)
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return response
+    except HTTPException:
+        # 已按上游不可达记录失败
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # 客户端断开等导致的取消：结果未知，只归还探测名额，否则熔断器会一直停在半开状态
+        breaker.release()
+        raise
+
+
+def choose_config(candidates: List[ApiConfig]) -> ApiConfig:
+    """
+    在同类别的候选配置中选择本次调用使用的配置
+
+    先排除熔断中和接近配额的配置，再交给负载均衡器选择；
+    全部不可用时仍交给均衡器，由 call_api_config 返回相应的错误。
+
+    Args:
+        candidates (List[ApiConfig]): 候选配置（非空）
+
+    Returns:
+        ApiConfig: 选中的配置
+    """
+    healthy = [
+        c for c in candidates
+        if not get_breaker(c.id).is_open() and request_quota.is_available(c)
+    ]
+    return latency_balancer.choose(healthy or candidates)
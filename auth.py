@@ -4,30 +4,39 @@
 该模块负责用户认证、密码验证和JWT令牌管理。
 包含用户密码哈希、JWT令牌生成和验证等功能。
 """
+import logging
 import os
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from database import get_db
-from crude import get_user, get_admin
+from crude import get_user, get_admin, get_user_by_username, get_admin_by_username
+from models import Admin, User
 from schemas import TokenData
+from token_revocation import token_revocation_store
+from write_queue import write_queue
+import password_hashing
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # JWT配置
 # 注意：在生产环境中，这些值必须通过环境变量设置，不能使用默认值
 SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-jwt-key-here-change-in-production")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
 
-# 密码哈希上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码哈希上下文（全项目共用）
+pwd_context = password_hashing.pwd_context
 
 # OAuth2密码流
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -43,7 +52,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: 密码匹配返回True，否则返回False
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hashing.verify_password(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """
@@ -55,11 +64,40 @@ def get_password_hash(password: str) -> str:
     Returns:
         str: 哈希后的密码
     """
-    return pwd_context.hash(password)
+    return password_hashing.hash_password(password)
+
+def _check_credentials(db: Session, lookup, username: str, password: str):
+    """
+    查找主体并校验密码（bcrypt 计算，在线程池中执行）
 
-def authenticate_user(db: Session, username: str, password: str):
+    Returns:
+        tuple: (主体, 新哈希)；校验失败时主体为None；哈希参数未变化时新哈希为None
     """
-    验证用户凭据
+    principal = lookup(db, username)
+    if not principal:
+        return None, None
+    verified, new_hash = password_hashing.verify_and_update(password, principal.hashed_password)
+    return (principal, new_hash) if verified else (None, None)
+
+def _save_password_hash(db: Session, model, principal_id: int, new_hash: str):
+    db.query(model).filter(model.id == principal_id).update({model.hashed_password: new_hash}, synchronize_session=False)
+    db.commit()
+
+async def _authenticate(db: Session, lookup, model, username: str, password: str):
+    principal, new_hash = await run_in_threadpool(_check_credentials, db, lookup, username, password)
+    if principal is None:
+        return False
+    if new_hash:
+        # 哈希参数已变化（如调整了 BCRYPT_ROUNDS）：经写队列用新参数保存，失败不影响本次登录
+        try:
+            await write_queue.awrite(db, _save_password_hash, model, principal.id, new_hash)
+        except Exception as e:
+            logger.warning(f"重新哈希密码失败: {e}")
+    return principal
+
+async def authenticate_user(db: Session, username: str, password: str):
+    """
+    验证用户凭据；查询和 bcrypt 校验在线程池中执行，不阻塞事件循环
     
     Args:
         db (Session): 数据库会话
@@ -69,14 +107,11 @@ def authenticate_user(db: Session, username: str, password: str):
     Returns:
         User对象或False: 验证成功返回User对象，失败返回False
     """
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
-        return False
-    return user
+    return await _authenticate(db, get_user_by_username, User, username, password)
 
-def authenticate_admin(db: Session, username: str, password: str):
+async def authenticate_admin(db: Session, username: str, password: str):
     """
-    验证管理员凭据
+    验证管理员凭据；查询和 bcrypt 校验在线程池中执行，不阻塞事件循环
     
     Args:
         db (Session): 数据库会话
@@ -86,10 +121,7 @@ def authenticate_admin(db: Session, username: str, password: str):
     Returns:
         Admin对象或False: 验证成功返回Admin对象，失败返回False
     """
-    admin = get_admin(db, username)
-    if not admin or not verify_password(password, admin.hashed_password):
-        return False
-    return admin
+    return await _authenticate(db, get_admin_by_username, Admin, username, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -107,23 +139,80 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.setdefault("typ", "access")
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
-    获取当前认证用户
+    创建刷新令牌
     
     Args:
-        token (str): JWT访问令牌
-        db (Session): 数据库会话
+        data (dict): 要编码到令牌中的数据
+        expires_delta (Optional[timedelta]): 令牌过期时间，默认 REFRESH_TOKEN_EXPIRE_DAYS 天
         
     Returns:
-        User或Admin对象: 当前认证的用户或管理员
+        str: JWT刷新令牌
+    """
+    to_encode = dict(data, typ="refresh")
+    return create_access_token(to_encode, expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+def build_token_claims(principal) -> dict:
+    """
+    根据用户或管理员对象构建令牌声明
+    
+    声明中包含免查库鉴权所需的全部信息：用户ID、角色、激活状态和令牌版本。
+    
+    Args:
+        principal: User或Admin对象
+        
+    Returns:
+        dict: 令牌声明
+    """
+    return {
+        "sub": principal.username,
+        "uid": principal.id,
+        "role": principal.role,
+        "knd": "admin" if isinstance(principal, Admin) else "user",
+        "act": bool(getattr(principal, "is_active", True)),
+        "ver": principal.token_version or 0,
+    }
+
+def create_token_pair(principal) -> dict:
+    """
+    为用户或管理员签发访问令牌和刷新令牌
+    
+    Args:
+        principal: User或Admin对象
+        
+    Returns:
+        dict: 符合 Token 模型的令牌响应
+    """
+    claims = build_token_claims(principal)
+    return {
+        "access_token": create_access_token(claims, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def decode_token(token: str, expected_type: str = "access") -> TokenData:
+    """
+    解码并校验令牌，不访问数据库
+    
+    依次校验签名与过期时间、令牌类型、吊销列表、令牌版本和激活状态。
+    
+    Args:
+        token (str): JWT令牌
+        expected_type (str): 期望的令牌类型，access 或 refresh
+        
+    Returns:
+        TokenData: 令牌中携带的主体信息
         
     Raises:
-        HTTPException: 令牌无效或用户不存在时抛出401错误
+        HTTPException: 令牌无效时抛出401错误
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -132,19 +221,109 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        role: str = payload.get("role")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username, role=role)
     except JWTError:
         raise credentials_exception
-    # 根据角色获取用户或管理员
-    user = get_user(db, username=token_data.username) if token_data.role == "user" else get_admin(db, username=token_data.username)
-    if user is None:
+    if payload.get("typ", "access") != expected_type or payload.get("sub") is None or payload.get("uid") is None:
+        raise credentials_exception
+    token_data = TokenData(
+        username=payload["sub"],
+        role=payload.get("role"),
+        user_id=payload["uid"],
+        kind=payload.get("knd", "user"),
+        is_active=payload.get("act", True),
+        token_version=payload.get("ver", 0),
+        jti=payload.get("jti"),
+        expires_at=datetime.utcfromtimestamp(payload["exp"]),
+    )
+    if token_data.jti and token_revocation_store.is_revoked(token_data.jti):
+        raise credentials_exception
+    if not token_revocation_store.is_version_valid(token_data.kind, token_data.user_id, token_data.token_version):
+        raise credentials_exception
+    if not token_data.is_active:
         raise credentials_exception
+    return token_data
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> TokenData:
+    """
+    获取当前认证主体（仅依据令牌声明，不访问数据库）
+    
+    只需要用户ID和角色进行鉴权的接口应使用此依赖。
+    
+    Args:
+        token (str): JWT访问令牌
+        
+    Returns:
+        TokenData: 当前认证主体
+    """
+    return decode_token(token, "access")
+
+async def get_current_user(principal: TokenData = Depends(get_current_principal), db: Session = Depends(get_db)):
+    """
+    获取当前认证用户
+    
+    Args:
+        principal (TokenData): 已校验的令牌主体
+        db (Session): 数据库会话
+        
+    Returns:
+        User或Admin对象: 当前认证的用户或管理员
+        
+    Raises:
+        HTTPException: 令牌无效或用户不存在时抛出401错误
+    """
+    # 根据主体类型获取用户或管理员
+    if principal.kind == "admin":
+        user = get_admin(db, admin_id=principal.user_id)
+    else:
+        user = get_user(db, user_id=principal.user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+def refresh_token_pair(db: Session, refresh_token: str) -> dict:
+    """
+    使用刷新令牌换取新的令牌对
+    
+    刷新令牌只能使用一次：旧刷新令牌会被吊销（轮换）。
+    此处重新读取主体，以便新令牌携带最新的角色和激活状态。
+    
+    Args:
+        db (Session): 数据库会话
+        refresh_token (str): 刷新令牌
+        
+    Returns:
+        dict: 新的令牌响应
+    """
+    token_data = decode_token(refresh_token, "refresh")
+    if token_data.kind == "admin":
+        principal = get_admin(db, admin_id=token_data.user_id)
+    else:
+        principal = get_user(db, user_id=token_data.user_id)
+    if principal is None or not getattr(principal, "is_active", True) \
+            or (principal.token_version or 0) != token_data.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token_revocation_store.revoke(db, token_data.jti, token_data.expires_at)
+    return create_token_pair(principal)
+
+def revoke_token(db: Session, token_data: TokenData):
+    """
+    吊销单个令牌（用于登出）
+    
+    Args:
+        db (Session): 数据库会话
+        token_data (TokenData): 已校验的令牌主体
+    """
+    if token_data.jti:
+        token_revocation_store.revoke(db, token_data.jti, token_data.expires_at)
+
 def check_role(required_role: str):
     """
     检查用户角色权限的装饰器函数
@@ -0,0 +1,184 @@
+"""
+批量请求模块
+
+POST /api/batch 在一次往返中执行多个子请求。子请求以进程内ASGI调用的方式交给应用本身处理，
+与单独请求走同样的路由、依赖、鉴权和异常处理；父请求的 Authorization 等请求头会转发给每个子请求。
+
+执行顺序：
+    - 连续的读请求（GET/HEAD/OPTIONS）并发执行，并发数不超过 BATCH_MAX_CONCURRENCY，
+      每个读请求使用各自的数据库会话（Session 不能在并发请求间共享）；
+    - 写请求按顺序逐个执行，作为屏障：之前的读请求全部完成后才开始，之后的请求能看到它的结果；
+      同一批次中的写请求共用一个数据库会话（get_db 通过 shared_session() 取得），
+      某个写请求失败时回滚该会话中未提交的修改，后续请求照常执行。
+结果按子请求的顺序返回。
+"""
+import asyncio
+import json
+import os
+from contextvars import ContextVar
+from typing import List, Optional
+from urllib.parse import unquote
+
+from fastapi import HTTPException, Request
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from schemas import BatchItem
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 20))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+BATCH_PATH = "/api/batch"
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+# 转发给子请求的父请求头
+FORWARDED_HEADERS = ("authorization", "cookie", "accept-language", "x-cache-bypass")
+# 返回给客户端的子响应头
+RETURNED_HEADERS = ("content-type", "etag", "cache-control", "location", "retry-after", "x-cache")
+
+_shared_session: ContextVar[Optional[Session]] = ContextVar("batch_shared_session", default=None)
+
+
+def shared_session() -> Optional[Session]:
+    """
+    当前批量写请求共用的数据库会话；不在批量写请求中时返回None
+    """
+    return _shared_session.get()
+
+
+def _error(status_code: int, detail: str) -> dict:
+    return {"status": status_code, "headers": {"content-type": "application/json"}, "body": {"detail": detail}}
+
+
+async def _call(app, parent: Request, item: BatchItem) -> dict:
+    """
+    以进程内ASGI调用执行一个子请求，返回 {status, headers, body}
+    """
+    method = item.method.upper()
+    path, _, query = item.path.partition("?")
+    if not path.startswith("/") or path.rstrip("/") == BATCH_PATH:
+        return _error(400, f"Invalid batch path: {item.path}")
+
+    body = b"" if item.body is None else json.dumps(item.body).encode("utf-8")
+    headers = [(name.encode(), parent.headers[name].encode()) for name in FORWARDED_HEADERS if name in parent.headers]
+    for name, value in (item.headers or {}).items():
+        headers.append((name.lower().encode("latin-1"), str(value).encode("latin-1")))
+    if item.body is not None:
+        headers.append((b"content-type", b"application/json"))
+    headers.append((b"content-length", str(len(body)).encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": parent.url.scheme,
+        "path": unquote(path),
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": parent.scope.get("root_path", ""),
+        "headers": headers,
+        "client": parent.scope.get("client"),
+        "server": parent.scope.get("server"),
+        "state": dict(parent.scope.get("state") or {}),
+    }
+
+    finished = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # 请求体已发送完毕；响应结束前不报告断开，流式响应才能正常输出
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    status_code = None
+    response_headers = {}
+    chunks = []
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            for name, value in message.get("headers", []):
+                name = name.decode("latin-1").lower()
+                if name in RETURNED_HEADERS:
+                    response_headers[name] = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    except Exception as e:
+        # ServerErrorMiddleware 发送500响应后会重新抛出异常
+        if status_code is None:
+            return _error(500, str(e))
+    finally:
+        finished.set()
+
+    content = b"".join(chunks)
+    if not content:
+        payload = None
+    elif response_headers.get("content-type", "").startswith("application/json"):
+        try:
+            payload = json.loads(content)
+        except ValueError:
+            payload = content.decode("utf-8", errors="replace")
+    else:
+        payload = content.decode("utf-8", errors="replace")
+    return {"status": status_code or 500, "headers": response_headers, "body": payload}
+
+
+async def run_batch(app, parent: Request, items: List[BatchItem]) -> List[dict]:
+    """
+    执行批量请求
+
+    Args:
+        app: ASGI应用
+        parent (Request): 批量请求本身，用于转发请求头
+        items (List[BatchItem]): 子请求
+
+    Returns:
+        List[dict]: 与子请求一一对应的 {status, headers, body}
+
+    Raises:
+        HTTPException: 子请求数量超过 BATCH_MAX_REQUESTS 时返回400
+    """
+    if len(items) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+
+    results: List[Optional[dict]] = [None] * len(items)
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    session: Optional[Session] = None
+
+    async def read(index: int):
+        async with semaphore:
+            results[index] = await _call(app, parent, items[index])
+
+    try:
+        index = 0
+        while index < len(items):
+            if items[index].method.upper() in READ_METHODS:
+                end = index
+                while end < len(items) and items[end].method.upper() in READ_METHODS:
+                    end += 1
+                await asyncio.gather(*(read(i) for i in range(index, end)))
+                index = end
+                continue
+
+            if session is None:
+                session = SessionLocal()
+            token = _shared_session.set(session)
+            try:
+                results[index] = await _call(app, parent, items[index])
+            finally:
+                _shared_session.reset(token)
+            if results[index]["status"] >= 400:
+                session.rollback()
+            index += 1
+    finally:
+        if session is not None:
+            session.close()
+    return results
@@ -0,0 +1,99 @@
+"""
+列表响应序列化基准测试
+
+比较几种把ORM对象列表编码为HTTP响应体的方式，报告每行耗时（微秒）：
+    fastapi   FastAPI 默认路径：按 response_model 校验、转成字典后用标准库 json 编码
+    orjson    同样的校验和转换，用 ORJSONResponse 编码
+    adapter   fast_json.list_response(validate=True)：预先构建的 TypeAdapter 一次完成校验和编码
+    trusted   fast_json.list_response：从ORM对象状态直接取字段，跳过校验，orjson 编码
+
+不需要数据库，使用内存中构造的 ApiConfig 对象。
+
+用法：
+    python bench_serialization.py --rows 10,100,1000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from typing import List
+
+import fast_json
+from models import ApiConfig
+from schemas import ApiConfig as PydanticApiConfig
+
+
+def make_rows(n: int) -> list:
+    now = datetime.datetime.utcnow()
+    return [
+        ApiConfig(
+            id=i, name=f"config-{i}", endpoint=f"https://api.example.com/v1/resource/{i}", method="GET",
+            is_active=True, is_public=i % 2 == 0, description="示例API配置" * 3, auth_type="bearer",
+            provider="example", category="ai", max_requests=1000, priority=2, cache_ttl=3600,
+            timeout_seconds=30.0, created_at=now, updated_at=now,
+        )
+        for i in range(n)
+    ]
+
+
+def bench(fn, rows: list, min_time: float) -> float:
+    """
+    重复调用 fn 至少 min_time 秒，返回每行平均耗时（微秒）
+    """
+    fn(rows)
+    loops = 0
+    started = time.perf_counter()
+    while True:
+        fn(rows)
+        loops += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / loops / len(rows) * 1e6
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="列表响应序列化基准测试")
+    parser.add_argument("--rows", default="10,100,1000", help="逗号分隔的行数")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每项至少运行的秒数")
+    args = parser.parse_args()
+
+    field = create_response_field(name="Response_read_api_configs", type_=List[PydanticApiConfig],
+                                  mode="serialization")
+    loop = asyncio.new_event_loop()
+
+    def fastapi_path(rows, response_class=JSONResponse):
+        content = loop.run_until_complete(serialize_response(field=field, response_content=rows))
+        return response_class(content).body
+
+    def orjson_path(rows):
+        return fastapi_path(rows, fast_json.FastJSONResponse)
+
+    def adapter_path(rows):
+        return fast_json.list_response(PydanticApiConfig, rows, validate=True).body
+
+    def trusted_path(rows):
+        return fast_json.list_response(PydanticApiConfig, rows).body
+
+    paths = [("fastapi", fastapi_path), ("orjson", orjson_path), ("adapter", adapter_path), ("trusted", trusted_path)]
+    if fast_json.orjson is None:
+        print("未安装 orjson，orjson 一列使用标准库 json，trusted 一列与 adapter 相同")
+
+    print(f"{'行数':>6} " + " ".join(f"{name + '(us/行)':>14}" for name, _ in paths) + f" {'加速比':>8}")
+    for n in (int(x) for x in args.rows.split(",") if x.strip()):
+        rows = make_rows(n)
+        # 各路径输出的JSON必须一致
+        expected = json.loads(fastapi_path(rows))
+        assert all(json.loads(fn(rows)) == expected for _, fn in paths)
+        results = [bench(fn, rows, args.min_time) for _, fn in paths]
+        print(f"{n:>6} " + " ".join(f"{r:>14.2f}" for r in results) + f" {results[0] / results[-1]:>7.1f}x")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
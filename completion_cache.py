@@ -0,0 +1,154 @@
+"""
+AI对话补全缓存模块
+
+相同的提问（例如界面上的预设问题）不必每次都付费调用上游。
+缓存键为 (ApiConfig id, 模型, 规范化后的消息, 参数) 的哈希；
+内存层是按字节数限制大小的LRU，可选的磁盘层(SQLite)在重启后依然有效。
+每个 ApiConfig 的 cache_ttl 字段控制缓存有效期，为 0 时不缓存。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 10000))
+# 为空时不启用磁盘层
+COMPLETION_CACHE_DISK_PATH = os.getenv("COMPLETION_CACHE_DISK_PATH", "")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_messages(messages: list) -> list:
+    """
+    规范化消息：角色转小写，内容去除首尾空白并合并连续空白
+    """
+    return [
+        {"role": str(m.get("role", "")).lower(), "content": _WHITESPACE.sub(" ", str(m.get("content", ""))).strip()}
+        for m in messages
+    ]
+
+
+def make_cache_key(api_config_id: int, model: str, messages: list, params: Optional[dict] = None) -> str:
+    """
+    计算缓存键
+    """
+    raw = json.dumps(
+        {"config": api_config_id, "model": model, "messages": normalize_messages(messages), "params": params or {}},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class CompletionCache:
+    """
+    两级补全缓存：内存LRU + 可选的SQLite磁盘层
+    """
+    def __init__(self, max_bytes: int = COMPLETION_CACHE_MAX_BYTES,
+                 max_entries: int = COMPLETION_CACHE_MAX_ENTRIES,
+                 disk_path: str = COMPLETION_CACHE_DISK_PATH):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (过期时间, 内容, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypasses": 0, "stores": 0, "evictions": 0}
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=OFF")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS completion_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._disk.execute("DELETE FROM completion_cache WHERE expires_at < ?", (time.time(),))
+
+    def _put_memory(self, key: str, value: str, expires_at: float):
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[2]
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存，依次查内存层和磁盘层；磁盘命中会回填内存层
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                self._entries.pop(key)
+                self._bytes -= entry[2]
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value, expires_at FROM completion_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._put_memory(key, row[0], row[1])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str, ttl: int):
+        """
+        写入缓存
+
+        Args:
+            key (str): 缓存键
+            value (str): 补全内容
+            ttl (int): 有效期（秒），小于等于0时不缓存
+        """
+        if not ttl or ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._put_memory(key, value, expires_at)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO completion_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+            self.stats["stores"] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypasses"] += 1
+
+    def snapshot(self) -> dict:
+        """
+        返回缓存统计，包括命中率
+        """
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return dict(
+                self.stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                disk_enabled=self._disk is not None,
+                hit_ratio=round(hits / lookups, 4) if lookups else 0.0,
+            )
+
+
+# 创建全局实例
+completion_cache = CompletionCache()
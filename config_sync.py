@@ -3,54 +3,277 @@
 
 该模块负责在环境变量(.env文件)和数据库之间同步API配置信息。
 支持从数据库同步到.env文件，以及从.env文件初始化数据库。
+
+从 .env 同步到数据库时按差异处理：一次查询读出全部API配置，计算需要新增、更新和删除的配置，
+在同一个事务中提交，未变化的配置不会被写入。服务运行期间可监视 .env 的修改时间，
+文件变化后只应用变化的部分。写回 .env 时先写临时文件再原子替换。
 """
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv, find_dotenv
-from sqlalchemy.orm import Session
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from dotenv import dotenv_values, find_dotenv
 from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal
 from models import ApiConfig
-from database import get_db
+from permissions import permission_engine
 from secure_keys import secure_key_manager
 
+logger = logging.getLogger(__name__)
+
+ENV_WATCH_ENABLED = os.getenv("ENV_WATCH_ENABLED", "true").lower() == "true"
+ENV_WATCH_INTERVAL = float(os.getenv("ENV_WATCH_INTERVAL", 2))
+
+ENDPOINT_SUFFIX = "_ENDPOINT"
+API_KEY_SUFFIX = "_API_KEY"
+
+
+def env_prefix(name: str) -> str:
+    """
+    API配置名称对应的环境变量前缀，例如 "DeepSeek" -> "DEEPSEEK"
+    """
+    return name.upper().replace(" ", "_")
+
+
+def _is_config_var(key: str) -> bool:
+    return key.endswith(ENDPOINT_SUFFIX) or key.endswith(API_KEY_SUFFIX)
+
+
+def _atomic_write(path: str, content: str):
+    # 写入同目录下的临时文件后替换，读取方不会看到写了一半的文件
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".env.", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class ConfigSyncer:
+    """
+    .env 与数据库之间的差异同步
+    """
+    def __init__(self):
+        self._applied: Optional[Dict[str, Tuple[str, Optional[str]]]] = None  # 上次应用的 前缀 -> (端点, 密钥)
+        self._dotenv_keys = set()   # 出现过在 .env 文件中的变量名
+        self._mtime = None
+        self._task: Optional[asyncio.Task] = None
+
+    def read_desired(self, env_path: str) -> Dict[str, Tuple[str, Optional[str]]]:
+        """
+        读取 .env 文件和进程环境变量中的API配置
+
+        以 .env 文件为准；只在进程环境中设置（不来自 .env）的变量作为补充。
+
+        Returns:
+            Dict[str, Tuple[str, Optional[str]]]: 前缀 -> (端点, 明文密钥)
+        """
+        file_values = dotenv_values(env_path) if env_path and os.path.exists(env_path) else {}
+        self._dotenv_keys.update(file_values)
+        values = {k: v for k, v in os.environ.items() if _is_config_var(k) and k not in self._dotenv_keys}
+        values.update({k: v for k, v in file_values.items() if v is not None and _is_config_var(k)})
+        return {
+            key[:-len(ENDPOINT_SUFFIX)]: (endpoint, values.get(key[:-len(ENDPOINT_SUFFIX)] + API_KEY_SUFFIX) or None)
+            for key, endpoint in values.items()
+            if key.endswith(ENDPOINT_SUFFIX)
+        }
+
+    def apply(self, desired: Dict[str, Tuple[str, Optional[str]]], removed=()) -> dict:
+        """
+        计算与数据库的差异并在一个事务中应用
+
+        Args:
+            desired: 需要存在的配置，前缀 -> (端点, 明文密钥)
+            removed: 需要删除的配置前缀（已从 .env 中移除的配置）
+
+        Returns:
+            dict: 新增、更新、删除的配置数量
+        """
+        summary = {"inserted": 0, "updated": 0, "deleted": 0}
+        if not desired and not removed:
+            return summary
+        db = SessionLocal()
+        try:
+            existing = {env_prefix(c.name): c for c in db.query(ApiConfig).all()}
+            touched, deleted_ids = [], []
+            for prefix, (endpoint, api_key) in desired.items():
+                config = existing.get(prefix)
+                if config is None:
+                    config = ApiConfig(name=prefix.lower(), endpoint=endpoint)
+                    if api_key:
+                        config.encrypted_key = secure_key_manager.encrypt_key(api_key)
+                    db.add(config)
+                    touched.append(config)
+                    summary["inserted"] += 1
+                    continue
+                changed = False
+                if config.endpoint != endpoint:
+                    config.endpoint = endpoint
+                    changed = True
+                if api_key and not self._same_key(config.encrypted_key, api_key):
+                    config.encrypted_key = secure_key_manager.encrypt_key(api_key)
+                    changed = True
+                if changed:
+                    touched.append(config)
+                    summary["updated"] += 1
+            for prefix in removed:
+                config = existing.get(prefix)
+                if config is not None:
+                    deleted_ids.append(config.id)
+                    db.delete(config)
+                    summary["deleted"] += 1
+            db.commit()
+            for config in touched:
+                db.refresh(config)
+                permission_engine.apply_config(config)
+            for config_id in deleted_ids:
+                permission_engine.remove_config(config_id)
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return summary
+
+    @staticmethod
+    def _same_key(encrypted_key: Optional[str], api_key: str) -> bool:
+        if not encrypted_key:
+            return False
+        try:
+            return secure_key_manager.decrypt_key(encrypted_key) == api_key
+        except Exception:
+            return False
+
+    def sync_from_file(self, env_path: Optional[str] = None) -> dict:
+        """
+        读取 .env 并把全部配置同步到数据库（只写入有差异的配置）
+        """
+        env_path = env_path or find_dotenv()
+        if env_path and os.path.exists(env_path):
+            self._mtime = self._stat(env_path)
+        desired = self.read_desired(env_path)
+        summary = self.apply(desired)
+        self._applied = desired
+        return summary
+
+    def apply_changes(self, env_path: str) -> dict:
+        """
+        只应用 .env 中相对上次同步发生变化的配置
+
+        删除只针对上次同步后从 .env 中移除的配置，不会删除在管理界面中添加的配置；
+        .env 中未变化的配置也不会覆盖在管理界面中做的修改。
+        """
+        desired = self.read_desired(env_path)
+        baseline = self._applied or {}
+        changed = {prefix: value for prefix, value in desired.items() if baseline.get(prefix) != value}
+        removed = set(baseline) - set(desired)
+        summary = self.apply(changed, removed)
+        self._applied = desired
+        return summary
+
+    @staticmethod
+    def _stat(path: str):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    async def watch(self, env_path: str, interval: float = ENV_WATCH_INTERVAL):
+        """
+        按修改时间轮询 .env，变化时应用变化的部分
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                current = self._stat(env_path)
+            except FileNotFoundError:
+                continue
+            if current == self._mtime:
+                continue
+            try:
+                summary = await asyncio.to_thread(self.apply_changes, env_path)
+            except Exception as e:
+                # 不记录修改时间，下一轮重试，避免文件不再变化时这次修改永远不被应用
+                logger.error(f"同步 .env 变化失败: {e}")
+                continue
+            self._mtime = current
+            if any(summary.values()):
+                logger.info(f".env 已变化，同步到数据库: {summary}")
+
+    def start_watching(self):
+        """
+        启动 .env 监视任务（ENV_WATCH_ENABLED 为 false 或找不到 .env 时不启动）
+        """
+        env_path = find_dotenv()
+        if not ENV_WATCH_ENABLED or not env_path or self._task is not None:
+            return
+        # 以当前内容为基准，之后只应用变化的部分
+        if self._applied is None:
+            self._applied = self.read_desired(env_path)
+        self._mtime = self._stat(env_path)
+        self._task = asyncio.create_task(self.watch(env_path))
+
+    async def stop_watching(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# 创建全局实例
+config_syncer = ConfigSyncer()
+
+
 def sync_env_from_db():
     """
     从数据库同步API配置到.env文件
-    
+
     该函数读取数据库中的所有API配置，并将其写入.env文件。
     每个配置项将生成两个环境变量：
     1. {NAME}_ENDPOINT - API端点URL
-    2. {NAME}_API_KEY - 加密的API密钥（如果存在）
-    
-    注意：此操作会覆盖.env文件中的现有内容。
+    2. {NAME}_API_KEY - 解密后的API密钥（如果存在）
+
+    .env 中的其他变量（如 SECRET_KEY）原样保留；文件以原子替换的方式写入。
     """
     env_path = find_dotenv()
     if not env_path:
         raise FileNotFoundError(".env file not found")
 
     try:
-        # 获取所有API配置
-        db = next(get_db())
-        configs = db.query(ApiConfig).all()
+        db = SessionLocal()
+        try:
+            configs = db.query(ApiConfig).all()
+        finally:
+            db.close()
+
+        # 保留非API配置的行
+        with open(env_path) as f:
+            kept = [line.rstrip("\n") for line in f
+                    if not _is_config_var(line.split("=", 1)[0].strip())]
+        while kept and not kept[-1].strip():
+            kept.pop()
 
-        # 构建新的.env内容
         lines = []
         for config in configs:
-            # 将配置名称转换为大写并用下划线替换空格
-            key = config.name.upper().replace(" ", "_")
-            endpoint_var = f"{key}_ENDPOINT"
-            key_var = f"{key}_API_KEY"
-
-            # 添加端点配置
-            lines.append(f"{endpoint_var}={config.endpoint}")
-            
-            # 如果存在加密的API密钥，则解密并添加
+            key = env_prefix(config.name)
+            lines.append(f"{key}{ENDPOINT_SUFFIX}={config.endpoint}")
             if config.encrypted_key:
                 decrypted_key = secure_key_manager.decrypt_key(config.encrypted_key)
-                lines.append(f"{key_var}={decrypted_key}")
+                lines.append(f"{key}{API_KEY_SUFFIX}={decrypted_key}")
 
-        # 写入.env文件
-        with open(env_path, 'w') as f:
-            f.write('\n'.join(lines))
+        _atomic_write(env_path, "\n".join(kept + ([""] if kept else []) + lines) + "\n")
         print("✅ Config synced to .env")
     except Exception as e:
         print(f"❌ Error syncing config to .env: {e}")
@@ -58,47 +281,18 @@ def sync_env_from_db():
 def sync_db_from_env():
     """
     从.env文件同步API配置到数据库（用于初始化）
-    
-    该函数读取.env文件中的API配置，并将其存储到数据库中。
-    只会处理以 _ENDPOINT 结尾的环境变量。
-    对应的API密钥变量应命名为 {NAME}_API_KEY。
-    
-    注意：此操作会更新数据库中的现有配置或创建新配置。
-    """
-    load_dotenv()
-    db = next(get_db())
 
-    try:
-        # 读取所有以 _ENDPOINT 结尾的环境变量
-        for key in os.environ.keys():
-            if key.endswith("_ENDPOINT"):
-                # 从环境变量名称提取API配置名称
-                name = key.replace("_ENDPOINT", "").lower()
-                endpoint = os.environ[key]
-                
-                # 查找对应的API密钥环境变量
-                api_key_var = f"{name.upper()}_API_KEY"
-                api_key = os.environ.get(api_key_var)
-
-                # 创建或更新配置
-                config = db.query(ApiConfig).filter(ApiConfig.name == name).first()
-                if not config:
-                    # 创建新配置
-                    config = ApiConfig(name=name, endpoint=endpoint)
-                    db.add(config)
-                else:
-                    # 更新现有配置
-                    config.endpoint = endpoint
-                
-                # 如果存在API密钥，则加密存储
-                if api_key:
-                    config.encrypted_key = secure_key_manager.encrypt_key(api_key)
+    只会处理以 _ENDPOINT 结尾的变量，对应的API密钥变量应命名为 {NAME}_API_KEY。
+    一次查询读出现有配置，只写入有变化的配置，全部变更在同一个事务中提交。
 
-                db.commit()
-        print("✅ .env synced to DB")
+    Returns:
+        dict: 新增、更新、删除的配置数量；出错时为None
+    """
+    try:
+        summary = config_syncer.sync_from_file()
+        print(f"✅ .env synced to DB: {summary}")
+        return summary
     except SQLAlchemyError as e:
-        db.rollback()
         print(f"❌ Database error syncing .env to DB: {e}")
     except Exception as e:
-        db.rollback()
-        print(f"❌ Error syncing .env to DB: {e}")
\ No newline at end of file
+        print(f"❌ Error syncing .env to DB: {e}")
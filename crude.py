@@ -1,30 +1,47 @@
 import uuid
 import datetime
-from typing import Optional
-from sqlalchemy.orm import Session
+from typing import Optional, Sequence
+from sqlalchemy.orm import Session, load_only
 from models import User, Device, Task, Admin, ApiConfig, ApiPermission, UserPreference, BiometricData
 from schemas import (
     UserCreate, UserUpdate, DeviceCreate, DeviceUpdate, TaskCreate, TaskUpdate,
     AdminCreate, AdminUpdate, ApiConfigCreate, ApiConfigUpdate, ApiPermissionCreate, ApiPermissionUpdate,
     UserPreferenceCreate, UserPreferenceUpdate, BiometricDataCreate, BiometricDataUpdate
 )
-from passlib.context import CryptContext
+from password_hashing import hash_password
 from secure_keys import secure_key_manager
+from token_revocation import revoke_all_tokens
+from permissions import permission_engine
+from database import run_after_commit
 from fastapi import HTTPException
 import logging
 
 logger = logging.getLogger(__name__)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 修改这些字段后，主体此前签发的令牌全部失效
+TOKEN_SENSITIVE_FIELDS = {"is_active", "role", "password", "hashed_password"}
 
-def get_user(db: Session, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+def _token_sensitive_changed(db_obj, data: dict) -> bool:
+    return any(
+        key in TOKEN_SENSITIVE_FIELDS and value is not None and getattr(db_obj, key, None) != value
+        for key, value in data.items()
+    )
+
+def _load_only(query, model, fields: Optional[Sequence[str]]):
+    # ?fields= 指定了字段时只加载对应的列（主键总会加载）
+    if not fields:
+        return query
+    columns = [getattr(model, name) for name in fields if name in model.__mapper__.column_attrs]
+    return query.options(load_only(*(columns or [model.id])))
+
+def get_user(db: Session, user_id: int, fields: Optional[Sequence[str]] = None):
+    return _load_only(db.query(User), User, fields).filter(User.id == user_id).first()
 
 def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100, search: str = None):
-    query = db.query(User)
+def get_users(db: Session, skip: int = 0, limit: int = 100, search: str = None, fields: Optional[Sequence[str]] = None):
+    query = _load_only(db.query(User), User, fields)
     if search:
         query = query.filter(
             User.username.contains(search) | 
@@ -33,8 +50,15 @@ def get_users(db: Session, skip: int = 0, limit: int = 100, search: str = None):
         )
     return query.offset(skip).limit(limit).all()
 
+def _hash_password_field(data: dict) -> dict:
+    # 明文密码不落库，转换为 hashed_password
+    password = data.pop("password", None)
+    if password:
+        data["hashed_password"] = hash_password(password)
+    return data
+
 def create_user(db: Session, user: UserCreate):
-    db_user = User(**user.dict())
+    db_user = User(**_hash_password_field(user.dict(exclude={"full_name"})))
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
@@ -43,15 +67,19 @@ def create_user(db: Session, user: UserCreate):
 def update_user(db: Session, user_id: int, user_data: dict):
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user:
-        for key, value in user_data.items():
+        sensitive_changed = _token_sensitive_changed(db_user, user_data)
+        for key, value in _hash_password_field(dict(user_data)).items():
             setattr(db_user, key, value)
         db.commit()
+        if sensitive_changed:
+            revoke_all_tokens(db, db_user)
         db.refresh(db_user)
     return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = db.query(User).filter(User.id == user_id).first()
     if db_user:
+        revoke_all_tokens(db, db_user)
         db.delete(db_user)
         db.commit()
         return True
@@ -90,11 +118,14 @@ def delete_device(db: Session, device_id: int):
         return True
     return False
 
-def get_task(db: Session, task_id: int):
-    return db.query(Task).filter(Task.id == task_id).first()
+def get_task(db: Session, task_id: int, fields: Optional[Sequence[str]] = None):
+    return _load_only(db.query(Task), Task, fields).filter(Task.id == task_id).first()
 
-def get_tasks(db: Session, owner_id: int):
-    return db.query(Task).filter(Task.owner_id == owner_id).all()
+def get_tasks(db: Session, owner_id: int = None, skip: int = 0, limit: int = 100, fields: Optional[Sequence[str]] = None):
+    query = _load_only(db.query(Task), Task, fields)
+    if owner_id:
+        query = query.filter(Task.owner_id == owner_id)
+    return query.offset(skip).limit(limit).all()
 
 def create_task(db: Session, task: TaskCreate, owner_id: int):
     db_task = Task(**task.dict(), owner_id=owner_id)
@@ -120,20 +151,20 @@ def delete_task(db: Session, task_id: int):
         return True
     return False
 
-def get_admin(db: Session, admin_id: int):
-    return db.query(Admin).filter(Admin.id == admin_id).first()
+def get_admin(db: Session, admin_id: int, fields: Optional[Sequence[str]] = None):
+    return _load_only(db.query(Admin), Admin, fields).filter(Admin.id == admin_id).first()
 
 def get_admin_by_username(db: Session, username: str):
     return db.query(Admin).filter(Admin.username == username).first()
 
-def get_admins(db: Session, skip: int = 0, limit: int = 100, search: str = None):
-    query = db.query(Admin)
+def get_admins(db: Session, skip: int = 0, limit: int = 100, search: str = None, fields: Optional[Sequence[str]] = None):
+    query = _load_only(db.query(Admin), Admin, fields)
     if search:
         query = query.filter(Admin.username.contains(search))
     return query.offset(skip).limit(limit).all()
 
 def create_admin(db: Session, admin: AdminCreate):
-    db_admin = Admin(**admin.dict())
+    db_admin = Admin(**_hash_password_field(admin.dict()))
     db.add(db_admin)
     db.commit()
     db.refresh(db_admin)
@@ -142,24 +173,28 @@ def create_admin(db: Session, admin: AdminCreate):
 def update_admin(db: Session, admin_id: int, admin_data: dict):
     db_admin = db.query(Admin).filter(Admin.id == admin_id).first()
     if db_admin:
-        for key, value in admin_data.items():
+        sensitive_changed = _token_sensitive_changed(db_admin, admin_data)
+        for key, value in _hash_password_field(dict(admin_data)).items():
             setattr(db_admin, key, value)
         db.commit()
+        if sensitive_changed:
+            revoke_all_tokens(db, db_admin)
         db.refresh(db_admin)
     return db_admin
 
 def delete_admin(db: Session, admin_id: int):
     db_admin = db.query(Admin).filter(Admin.id == admin_id).first()
     if db_admin:
+        revoke_all_tokens(db, db_admin)
         db.delete(db_admin)
         db.commit()
         return True
     return False
 
-def get_api_config(db: Session, api_config_id: int):
-    return db.query(ApiConfig).filter(ApiConfig.id == api_config_id).first()
-def get_api_configs(db: Session, skip: int = 0, limit: int = 100, search: str = None):
-    query = db.query(ApiConfig)
+def get_api_config(db: Session, api_config_id: int, fields: Optional[Sequence[str]] = None):
+    return _load_only(db.query(ApiConfig), ApiConfig, fields).filter(ApiConfig.id == api_config_id).first()
+def get_api_configs(db: Session, skip: int = 0, limit: int = 100, search: str = None, fields: Optional[Sequence[str]] = None):
+    query = _load_only(db.query(ApiConfig), ApiConfig, fields)
     if search:
         query = query.filter(ApiConfig.name.contains(search) | ApiConfig.endpoint.contains(search))
     return query.offset(skip).limit(limit).all()
@@ -179,6 +214,8 @@ def create_api_config_crud(db: Session, api_config: ApiConfigCreate):
             category=api_config.category,
             max_requests=api_config.max_requests,
             priority=api_config.priority,
+            cache_ttl=api_config.cache_ttl,
+            timeout_seconds=api_config.timeout_seconds,
             music_genres=api_config.music_genres,
             music_quality=api_config.music_quality,
             music_region=api_config.music_region
@@ -192,6 +229,7 @@ def create_api_config_crud(db: Session, api_config: ApiConfigCreate):
         db.add(db_api_config)
         db.commit()
         db.refresh(db_api_config)
+        run_after_commit(db, permission_engine.apply_config, db_api_config)
         return db_api_config
     except Exception as e:
         db.rollback()
@@ -218,6 +256,7 @@ def update_api_config(db: Session, api_config_id: int, api_config_data: ApiConfi
     try:
         db.commit()
         db.refresh(db_api_config)
+        run_after_commit(db, permission_engine.apply_config, db_api_config)
         return db_api_config
     except Exception as e:
         db.rollback()
@@ -235,6 +274,7 @@ def delete_api_config(db: Session, api_config_id: int):
     if db_api_config:
         db.delete(db_api_config)
         db.commit()
+        run_after_commit(db, permission_engine.remove_config, api_config_id)
         return True
     return False
 
@@ -249,6 +289,7 @@ def create_api_permission(db: Session, api_permission: ApiPermissionCreate):
     db.add(db_api_permission)
     db.commit()
     db.refresh(db_api_permission)
+    run_after_commit(db, permission_engine.apply_permission, db_api_permission)
     return db_api_permission
 
 def update_api_permission(db: Session, api_permission_id: int, api_permission_data: dict):
@@ -258,6 +299,7 @@ def update_api_permission(db: Session, api_permission_id: int, api_permission_da
             setattr(db_api_permission, key, value)
         db.commit()
         db.refresh(db_api_permission)
+        run_after_commit(db, permission_engine.apply_permission, db_api_permission)
     return db_api_permission
 
 def delete_api_permission(db: Session, api_permission_id: int):
@@ -265,6 +307,7 @@ def delete_api_permission(db: Session, api_permission_id: int):
     if db_api_permission:
         db.delete(db_api_permission)
         db.commit()
+        run_after_commit(db, permission_engine.remove_permission, api_permission_id)
         return True
     return False
 
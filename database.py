@@ -24,6 +24,23 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def run_after_commit(db, fn, *args):
+    """
+    在会话的修改真正提交后执行 fn(*args)，用于同步内存中的状态（权限位图、令牌吊销列表等）
+
+    写队列的组提交会话中 commit() 只刷新，db.info["after_commit"] 存在时先记录下来，
+    由写队列在整组提交成功后执行，提交失败时丢弃；其他会话中调用方已提交，直接执行。
+
+    Args:
+        db (Session): 数据库会话
+        fn (Callable): 提交后执行的函数
+    """
+    hooks = db.info.get("after_commit")
+    if hooks is None:
+        fn(*args)
+    else:
+        hooks.append((fn, args))
+
 # 在get_db函数中添加连接测试
 def get_db():
     db = SessionLocal()
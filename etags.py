@@ -0,0 +1,116 @@
+"""
+条件请求（ETag / If-None-Match）模块
+
+被跟踪的表在 table_versions 中各有一个版本号。任何通过 Session 提交的变更
+（ORM对象的增删改，以及 query.update()/delete() 等批量语句）都会在同一事务中
+把对应表的版本号加一，事务回滚时版本号随之回滚，多个工作进程看到的版本号一致。
+
+列表和实体端点以 W/"<表名>-<版本号>" 作为弱ETag：先读取版本号（一次主键查询），
+请求的 If-None-Match 匹配时直接返回 304，不执行查询和序列化。
+"""
+import os
+import random
+from itertools import chain
+from typing import Iterable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import TableVersion
+
+# 生成ETag的表
+VERSIONED_TABLES = frozenset({"users", "admins", "api_configs"})
+
+# 默认要求浏览器每次携带ETag重新验证；需要反向代理共享缓存时可改为 "public, no-cache"
+API_CACHE_CONTROL = os.getenv("API_CACHE_CONTROL", "private, no-cache")
+
+_versions = TableVersion.__table__
+
+
+def _bump(connection, tables: Iterable[str]):
+    for name in sorted(tables):
+        result = connection.execute(
+            update(_versions).where(_versions.c.name == name).values(version=_versions.c.version + 1)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(_versions).values(name=name, version=_initial_version()))
+
+
+def _initial_version() -> int:
+    # 随机起点，重建数据库后旧的ETag不会与新版本号碰撞
+    return random.randint(1, 2 ** 31 - 1)
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session: Session, flush_context):
+    tables = {
+        obj.__table__.name for obj in chain(session.new, session.dirty, session.deleted)
+    } & VERSIONED_TABLES
+    if tables:
+        _bump(session.connection(), tables)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _after_bulk_statement(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    table = getattr(orm_execute_state.statement, "table", None)
+    if table is not None and table.name in VERSIONED_TABLES:
+        _bump(orm_execute_state.session.connection(), [table.name])
+
+
+def seed(db: Session):
+    """
+    为被跟踪的表创建版本号记录（启动时调用）
+    """
+    existing = set(db.execute(select(_versions.c.name)).scalars())
+    for name in VERSIONED_TABLES - existing:
+        try:
+            db.execute(insert(_versions).values(name=name, version=_initial_version()))
+            db.commit()
+        except IntegrityError:
+            # 其他进程已经创建
+            db.rollback()
+
+
+def table_etag(db: Session, table: str) -> str:
+    """
+    返回表当前版本对应的弱ETag
+    """
+    version = db.execute(select(_versions.c.version).where(_versions.c.name == table)).scalar()
+    return f'W/"{table}-{version or 0}"'
+
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # 弱比较：忽略 W/ 前缀
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def cache_headers(response: Response, etag: str) -> Response:
+    """
+    为响应设置 ETag 和 Cache-Control
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = API_CACHE_CONTROL
+    response.headers["Vary"] = "Authorization"
+    return response
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """
+    If-None-Match 与 etag 匹配时返回 304 响应，否则返回None
+    """
+    if _matches(request, etag):
+        return cache_headers(Response(status_code=304), etag)
+    return None
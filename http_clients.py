@@ -0,0 +1,201 @@
+"""
+出站HTTP客户端管理模块
+
+为每个上游主机维护一个长期存在的 httpx.AsyncClient 连接池，
+复用 TCP/TLS 连接（可用时启用 HTTP/2），避免每次调用外部API都重新握手。
+客户端随应用生命周期创建和关闭，并统计每个主机的请求数和新建连接数，用于观察连接复用率。
+调用时传入 api_config 的请求还会按API配置记录延迟、状态码和字节数（见 outbound_metrics.py）。
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from outbound_metrics import outbound_metrics
+
+try:
+    import h2  # noqa: F401  HTTP/2 支持需要安装 httpx[http2]
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+OUTBOUND_HTTP2 = os.getenv("OUTBOUND_HTTP2", "true").lower() == "true" and HTTP2_AVAILABLE
+OUTBOUND_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_MAX_CONNECTIONS", 100))
+OUTBOUND_MAX_KEEPALIVE = int(os.getenv("OUTBOUND_MAX_KEEPALIVE", 20))
+OUTBOUND_KEEPALIVE_EXPIRY = float(os.getenv("OUTBOUND_KEEPALIVE_EXPIRY", 30))
+OUTBOUND_CONNECT_TIMEOUT = float(os.getenv("OUTBOUND_CONNECT_TIMEOUT", 5))
+OUTBOUND_READ_TIMEOUT = float(os.getenv("OUTBOUND_READ_TIMEOUT", 60))
+OUTBOUND_WRITE_TIMEOUT = float(os.getenv("OUTBOUND_WRITE_TIMEOUT", 10))
+OUTBOUND_POOL_TIMEOUT = float(os.getenv("OUTBOUND_POOL_TIMEOUT", 5))
+
+
+class OutboundClientManager:
+    """
+    出站客户端管理器
+
+    按 scheme://host:port 为每个上游主机创建一个连接池客户端。
+    """
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self.limits = httpx.Limits(
+            max_connections=OUTBOUND_MAX_CONNECTIONS,
+            max_keepalive_connections=OUTBOUND_MAX_KEEPALIVE,
+            keepalive_expiry=OUTBOUND_KEEPALIVE_EXPIRY,
+        )
+        self.timeout = httpx.Timeout(
+            connect=OUTBOUND_CONNECT_TIMEOUT,
+            read=OUTBOUND_READ_TIMEOUT,
+            write=OUTBOUND_WRITE_TIMEOUT,
+            pool=OUTBOUND_POOL_TIMEOUT,
+        )
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """
+        获取上游主机对应的连接池客户端，不存在时创建
+
+        Args:
+            url (str): 请求地址
+
+        Returns:
+            httpx.AsyncClient: 该主机共享的客户端
+        """
+        host = self._host_key(url)
+        client = self._clients.get(host)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._clients.get(host)
+                if client is None or client.is_closed:
+                    client = httpx.AsyncClient(http2=OUTBOUND_HTTP2, limits=self.limits, timeout=self.timeout)
+                    self._clients[host] = client
+                    self._stats.setdefault(host, {"requests": 0, "errors": 0, "new_connections": 0})
+        return client
+
+    def _tracer(self, host: str):
+        stats = self._stats[host]
+
+        async def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.complete":
+                stats["new_connections"] += 1
+
+        return trace
+
+    @staticmethod
+    def _request_size(request: Optional[httpx.Request]) -> int:
+        if request is None:
+            return 0
+        return int(request.headers.get("content-length", 0))
+
+    async def request(self, method: str, url: str, api_config=None, **kwargs) -> httpx.Response:
+        """
+        通过共享客户端发送请求
+
+        Args:
+            method (str): HTTP方法
+            url (str): 请求地址
+            api_config: 调用所属的API配置，传入时记录该配置的出站指标
+            **kwargs: 传给 httpx.AsyncClient.request 的其他参数
+
+        Returns:
+            httpx.Response: 响应
+        """
+        client = self.get_client(url)
+        host = self._host_key(url)
+        extensions = dict(kwargs.pop("extensions", None) or {}, trace=self._tracer(host))
+        self._stats[host]["requests"] += 1
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, extensions=extensions, **kwargs)
+        except httpx.HTTPError as e:
+            self._stats[host]["errors"] += 1
+            if api_config is not None:
+                request = e.request if isinstance(e, httpx.RequestError) else None
+                outbound_metrics.record(api_config, time.perf_counter() - started, exception=e,
+                                        bytes_sent=self._request_size(request))
+            raise
+        if api_config is not None:
+            outbound_metrics.record(api_config, time.perf_counter() - started, response.status_code,
+                                    bytes_sent=self._request_size(response.request),
+                                    bytes_received=response.num_bytes_downloaded)
+        return response
+
+    async def send_stream(self, method: str, url: str, api_config=None, **kwargs) -> httpx.Response:
+        """
+        通过共享客户端发送请求，不预先读取响应体（用于流式响应）
+
+        调用方必须在读取完毕或中止后调用 close_stream() 或 response.aclose() 归还连接。
+        延迟按收到响应头的时间记录，响应字节数在 close_stream() 时补记。
+
+        Args:
+            method (str): HTTP方法
+            url (str): 请求地址
+            api_config: 调用所属的API配置，传入时记录该配置的出站指标
+            **kwargs: 传给 httpx.AsyncClient.build_request 的其他参数
+
+        Returns:
+            httpx.Response: 响应体尚未读取的响应
+        """
+        client = self.get_client(url)
+        host = self._host_key(url)
+        extensions = dict(kwargs.pop("extensions", None) or {}, trace=self._tracer(host))
+        request = client.build_request(method, url, extensions=extensions, **kwargs)
+        self._stats[host]["requests"] += 1
+        started = time.perf_counter()
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            self._stats[host]["errors"] += 1
+            if api_config is not None:
+                outbound_metrics.record(api_config, time.perf_counter() - started, exception=e,
+                                        bytes_sent=self._request_size(request))
+            raise
+        if api_config is not None:
+            outbound_metrics.record(api_config, time.perf_counter() - started, response.status_code,
+                                    bytes_sent=self._request_size(request))
+        return response
+
+    async def close_stream(self, response: httpx.Response, api_config=None):
+        """
+        关闭流式响应并补记已读取的响应字节数
+        """
+        await response.aclose()
+        if api_config is not None:
+            outbound_metrics.add_received(api_config, response.num_bytes_downloaded)
+
+    async def close(self):
+        """
+        关闭全部客户端，释放连接
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    def metrics(self) -> Dict[str, dict]:
+        """
+        返回每个上游主机的连接复用统计
+        """
+        result = {}
+        for host, stats in self._stats.items():
+            requests = stats["requests"]
+            reused = max(0, requests - stats["new_connections"])
+            result[host] = dict(
+                stats,
+                reused_connections=reused,
+                reuse_ratio=round(reused / requests, 4) if requests else 0.0,
+                http2=OUTBOUND_HTTP2,
+            )
+        return result
+
+
+# 创建全局实例
+outbound_clients = OutboundClientManager()
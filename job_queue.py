@@ -0,0 +1,402 @@
+"""
+异步任务队列模块
+
+耗时较长的AI对话和外部API调用可以作为任务提交：POST /api/jobs 立即返回任务ID，
+客户端随后轮询 GET /api/jobs/{id}，或以SSE方式等待结果（定期发送心跳，
+不会被30秒超时的代理断开）。
+
+任务持久化在 SQLite 的 jobs 表中，重启后未完成的任务会重新排队。
+后台由一个调度协程按 ApiConfig.priority 从高到低派发任务，
+全局并发不超过 JOB_WORKERS，每个API配置的并发不超过 JOB_PER_CONFIG_CONCURRENCY。
+完成的任务结果保留 JOB_RESULT_TTL_SECONDS 秒后清理。
+
+多进程部署（serve.py）时，每个任务由一个工作进程认领（jobs.worker 为其pid）：
+工作进程退出时释放自己未完成的任务，主工作进程每 JOB_ADOPT_INTERVAL 秒认领无人执行的任务，
+避免同一任务在多个进程中重复执行。
+"""
+import asyncio
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+import ai_service
+import api_gateway
+from database import SessionLocal
+from models import ApiConfig, Job
+from schemas import JobStatus
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))
+JOB_PER_CONFIG_CONCURRENCY = int(os.getenv("JOB_PER_CONFIG_CONCURRENCY", 2))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", 3600))
+JOB_CLEANUP_INTERVAL = int(os.getenv("JOB_CLEANUP_INTERVAL", 60))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 15))
+JOB_ADOPT_INTERVAL = float(os.getenv("JOB_ADOPT_INTERVAL", 5))
+
+FINISHED_STATUSES = ("succeeded", "failed")
+UNFINISHED_STATUSES = ("queued", "running")
+
+
+def release_jobs(worker_id: Optional[str] = None) -> int:
+    """
+    释放未完成的任务，使其可以被重新认领
+
+    Args:
+        worker_id (Optional[str]): 只释放该工作进程认领的任务；为None时释放全部（整个服务启动时）
+
+    Returns:
+        int: 释放的任务数
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(Job).filter(Job.status.in_(UNFINISHED_STATUSES))
+        if worker_id is not None:
+            query = query.filter(Job.worker == worker_id)
+        released = query.update({Job.status: "queued", Job.worker: None, Job.started_at: None},
+                                synchronize_session=False)
+        db.commit()
+        return released
+    finally:
+        db.close()
+
+
+class JobQueue:
+    """
+    带优先级和按配置限流的任务调度器
+    """
+    def __init__(self, workers: int = JOB_WORKERS, per_config: int = JOB_PER_CONFIG_CONCURRENCY):
+        self.workers = workers
+        self.per_config = per_config
+        self.worker_id = str(os.getpid())
+        self.adopt_orphans = True
+        self._pending = []                     # 堆: (-priority, 序号, job_id, api_config_id)
+        self._seq = itertools.count()
+        self._running: Dict[int, int] = {}     # api_config_id -> 正在执行的任务数
+        self._active = 0
+        self._tasks = set()
+        self._events: Dict[str, asyncio.Event] = {}  # job_id -> 完成事件
+        self._waiters: Dict[str, int] = {}            # job_id -> 正在等待的协程数
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+    async def start(self, recover: bool = True, adopt_orphans: bool = True):
+        """
+        启动调度协程
+
+        Args:
+            recover (bool): 先释放上次运行留下的全部未完成任务；多进程部署时由父进程在启动工作进程前完成
+            adopt_orphans (bool): 认领无人执行的任务；多进程部署时只有主工作进程认领
+        """
+        self.worker_id = str(os.getpid())
+        self.adopt_orphans = adopt_orphans
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        if recover:
+            released = await asyncio.to_thread(release_jobs)
+            if released:
+                logger.info(f"重新排队 {released} 个未完成的任务")
+        if adopt_orphans:
+            await asyncio.to_thread(self._adopt)
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self):
+        """
+        停止调度并取消正在执行的任务；本进程未完成的任务被释放，由其他工作进程或下次启动时重新执行
+        """
+        self._stopping = True
+        for task in [self._dispatcher, *self._tasks]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[t for t in [self._dispatcher, *self._tasks] if t is not None], return_exceptions=True)
+        self._dispatcher = None
+        self._tasks.clear()
+        self._pending.clear()
+        await asyncio.to_thread(release_jobs, self.worker_id)
+
+    def _adopt(self) -> int:
+        # 认领无人执行的任务；条件更新保证同一任务只被一个进程认领（在线程池中执行）
+        db = SessionLocal()
+        try:
+            orphans = db.query(Job.id, Job.priority, Job.api_config_id).filter(
+                Job.status == "queued", Job.worker.is_(None)
+            ).order_by(Job.created_at).all()
+            adopted = 0
+            for job_id, priority, api_config_id in orphans:
+                claimed = db.query(Job).filter(
+                    Job.id == job_id, Job.status == "queued", Job.worker.is_(None)
+                ).update({Job.worker: self.worker_id}, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    self._enqueue_threadsafe(job_id, priority, api_config_id)
+                    adopted += 1
+            if adopted:
+                logger.info(f"认领 {adopted} 个无人执行的任务")
+            return adopted
+        finally:
+            db.close()
+
+    def submit(self, db: Session, kind: str, api_config: ApiConfig, payload: dict, owner: str) -> Job:
+        """
+        创建任务并排队
+
+        Args:
+            db (Session): 数据库会话
+            kind (str): 任务类型 chat 或 proxy
+            api_config (ApiConfig): 任务使用的API配置
+            payload (dict): 任务参数
+            owner (str): 任务所有者，例如 user:1
+
+        Returns:
+            Job: 新建的任务
+        """
+        job = Job(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            api_config_id=api_config.id,
+            priority=api_config.priority or 2,
+            status="queued",
+            payload=payload,
+            owner=owner,
+            worker=self.worker_id,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._enqueue_threadsafe(job.id, job.priority, job.api_config_id)
+        return job
+
+    def _enqueue_threadsafe(self, job_id: str, priority: Optional[int], api_config_id: int):
+        # 同步端点在线程池中调用 submit；调度状态和 asyncio.Event 只能在事件循环线程中修改
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._enqueue(job_id, priority, api_config_id)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._enqueue(job_id, priority, api_config_id)
+        else:
+            loop.call_soon_threadsafe(self._enqueue, job_id, priority, api_config_id)
+
+    def _enqueue(self, job_id: str, priority: Optional[int], api_config_id: int):
+        heapq.heappush(self._pending, (-(priority or 2), next(self._seq), job_id, api_config_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _dispatch(self):
+        # 按优先级依次派发；所属配置已达并发上限的任务暂缓，不阻塞其他配置的任务
+        deferred = []
+        while self._pending and self._active < self.workers:
+            entry = heapq.heappop(self._pending)
+            api_config_id = entry[3]
+            if self._running.get(api_config_id, 0) >= self.per_config:
+                deferred.append(entry)
+                continue
+            self._running[api_config_id] = self._running.get(api_config_id, 0) + 1
+            self._active += 1
+            task = asyncio.create_task(self._run(entry[2], api_config_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        for entry in deferred:
+            heapq.heappush(self._pending, entry)
+
+    async def _dispatch_loop(self):
+        last_cleanup, last_adopt = 0.0, time.monotonic()
+        interval = min(JOB_ADOPT_INTERVAL, JOB_CLEANUP_INTERVAL) if self.adopt_orphans else JOB_CLEANUP_INTERVAL
+        # 唤醒与取消同时发生时 wait_for 会吞掉取消（Python 3.11 及更早版本），因此还要检查停止标志
+        while not self._stopping:
+            self._wakeup.clear()
+            # 数据库操作在线程池中执行：写队列持有写锁时提交可能要等待，不能阻塞事件循环
+            if self.adopt_orphans and time.monotonic() - last_adopt >= JOB_ADOPT_INTERVAL:
+                await asyncio.to_thread(self._adopt)
+                last_adopt = time.monotonic()
+            self._dispatch()
+            if time.monotonic() - last_cleanup >= JOB_CLEANUP_INTERVAL:
+                await asyncio.to_thread(self._cleanup)
+                last_cleanup = time.monotonic()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job_id: str, api_config_id: int):
+        try:
+            await self._execute(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"任务 {job_id} 执行出错")
+            await asyncio.to_thread(self._finish, job_id, "failed", error=str(e))
+        finally:
+            self._running[api_config_id] -= 1
+            self._active -= 1
+            # 只通知正在等待的协程；没有等待者时不保留事件
+            event = self._events.get(job_id)
+            if event is not None:
+                event.set()
+            self._wakeup.set()
+
+    def _claim(self, job_id: str) -> Optional[tuple]:
+        # 把任务标记为执行中，返回 (类型, 参数, 配置ID)；任务已不在排队状态时返回None
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            if job is None or job.status != "queued":
+                return None
+            job.status = "running"
+            job.started_at = datetime.datetime.utcnow()
+            claimed = (job.kind, job.payload or {}, job.api_config_id)
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    async def _execute(self, job_id: str):
+        claimed = await asyncio.to_thread(self._claim, job_id)
+        if claimed is None:
+            return
+        kind, payload, api_config_id = claimed
+        db = SessionLocal()
+        try:
+            api_config = await asyncio.to_thread(db.get, ApiConfig, api_config_id)
+            if api_config is None:
+                await asyncio.to_thread(self._finish, job_id, "failed", status_code=404, error="API config not found")
+                return
+
+            try:
+                if kind == "chat":
+                    content, _ = await ai_service.complete_chat(db, api_config, payload["message"])
+                    finished = dict(status="succeeded", result=content, status_code=200)
+                else:
+                    ai_service.release_db(db)
+                    body = payload.get("body")
+                    response = await api_gateway.call_api_config(
+                        api_config,
+                        params=payload.get("params"),
+                        content=json.dumps(body).encode() if body is not None else None,
+                        headers={"Content-Type": "application/json"} if body is not None else None,
+                    )
+                    status = "succeeded" if response.status_code < 400 else "failed"
+                    finished = dict(status=status, result=response.text, status_code=response.status_code)
+            except HTTPException as e:
+                finished = dict(status="failed", status_code=e.status_code, error=str(e.detail))
+            await asyncio.to_thread(self._finish, job_id, **finished)
+        finally:
+            db.close()
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None,
+                status_code: Optional[int] = None, error: Optional[str] = None):
+        now = datetime.datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(Job.id == job_id).update({
+                Job.status: status,
+                Job.result: result,
+                Job.status_code: status_code,
+                Job.error: error,
+                Job.finished_at: now,
+                Job.expires_at: now + datetime.timedelta(seconds=JOB_RESULT_TTL_SECONDS),
+            })
+            db.commit()
+        finally:
+            db.close()
+
+    def _cleanup(self):
+        # 删除结果已过期的任务（在线程池中执行）
+        db = SessionLocal()
+        try:
+            expired = db.query(Job.id).filter(
+                Job.status.in_(FINISHED_STATUSES),
+                Job.expires_at < datetime.datetime.utcnow()
+            ).all()
+            if expired:
+                ids = [row[0] for row in expired]
+                db.query(Job).filter(Job.id.in_(ids)).delete(synchronize_session=False)
+                db.commit()
+        finally:
+            db.close()
+
+    async def wait(self, job_id: str, timeout: float) -> bool:
+        """
+        等待任务完成，超时返回False
+        """
+        event = self._events.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # 最后一个等待者退出时移除事件，其他进程的任务或从未完成的任务不会一直占用内存
+            remaining = self._waiters.pop(job_id) - 1
+            if remaining:
+                self._waiters[job_id] = remaining
+            elif self._events.get(job_id) is event:
+                del self._events[job_id]
+
+    def _read_status(self, job_id: str) -> tuple:
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            if job is None:
+                return None, None
+            return JobStatus.model_validate(job).model_dump_json(), job.status
+        finally:
+            db.close()
+
+    async def stream(self, job_id: str) -> AsyncIterator[str]:
+        """
+        以SSE方式输出任务状态，直到任务完成
+
+        状态变化时发送 event: status，等待期间定期发送心跳注释，
+        完成时发送 event: result（任务完整信息），最后发送 data: [DONE]。
+        """
+        last_status = None
+        while True:
+            snapshot, status = await asyncio.to_thread(self._read_status, job_id)
+            if snapshot is None:
+                yield 'event: error\ndata: {"detail": "Job not found"}\n\n'
+                return
+            if status in FINISHED_STATUSES:
+                yield f"event: result\ndata: {snapshot}\n\n"
+                yield "data: [DONE]\n\n"
+                return
+            if status != last_status:
+                yield f"event: status\ndata: {snapshot}\n\n"
+                last_status = status
+            if not await self.wait(job_id, JOB_HEARTBEAT_SECONDS):
+                yield ": keepalive\n\n"
+
+    def snapshot(self) -> dict:
+        """
+        返回调度器状态
+        """
+        return {
+            "pending": len(self._pending),
+            "active": self._active,
+            "workers": self.workers,
+            "per_config": self.per_config,
+            "worker_id": self.worker_id,
+            "adopt_orphans": self.adopt_orphans,
+            "running_by_config": {k: v for k, v in self._running.items() if v},
+        }
+
+
+# 创建全局实例
+job_queue = JobQueue()
@@ -0,0 +1,204 @@
+"""
+加密密钥轮换脚本
+
+把 api_configs.encrypted_key 分批用当前主密钥重新加密：
+每批在独立的短事务中完成，批次之间短暂停顿，不长时间占用 SQLite 写锁。
+轮换期间新旧密钥都在密钥环中，读取不受影响。
+进度（游标）保存在 KEY_ROTATION_STATE_FILE 中，中断后再次运行会从上次的位置继续。
+
+轮换步骤：
+    1. python key_rotation.py --generate-key        生成新密钥
+    2. 设置 ENCRYPTION_KEYS=<新密钥>,<旧密钥> 并重启服务
+    3. python key_rotation.py                       重新加密已有数据（或调用 POST /api/admin/key-rotation）
+    4. 完成后可从 ENCRYPTION_KEYS 中移除旧密钥
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from cryptography.fernet import Fernet
+from sqlalchemy import text
+
+from database import SessionLocal
+from secure_keys import key_id, secure_key_manager
+
+logger = logging.getLogger(__name__)
+
+KEY_ROTATION_BATCH_SIZE = int(os.getenv("KEY_ROTATION_BATCH_SIZE", 50))
+KEY_ROTATION_PAUSE_SECONDS = float(os.getenv("KEY_ROTATION_PAUSE_SECONDS", 0.05))
+KEY_ROTATION_STATE_FILE = os.getenv("KEY_ROTATION_STATE_FILE", ".key_rotation_state.json")
+
+
+class KeyRotationJob:
+    """
+    分批重新加密任务
+    """
+    def __init__(self, batch_size: int = KEY_ROTATION_BATCH_SIZE, pause: float = KEY_ROTATION_PAUSE_SECONDS,
+                 state_file: str = KEY_ROTATION_STATE_FILE):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.state_file = state_file
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.progress = self._load_state()
+
+    def _new_state(self) -> dict:
+        return {
+            "primary_kid": secure_key_manager.primary_kid,
+            "status": "idle",
+            "cursor": 0,
+            "total": 0,
+            "processed": 0,
+            "rotated": 0,
+            "failed": 0,
+            "error": None,
+        }
+
+    def _load_state(self) -> dict:
+        # 只有针对同一主密钥的进度才能续传
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file) as f:
+                    state = json.load(f)
+                if state.get("primary_kid") == secure_key_manager.primary_kid:
+                    return state
+            except (OSError, ValueError):
+                pass
+        return self._new_state()
+
+    def _save_state(self):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.progress, f)
+        os.replace(tmp, self.state_file)
+
+    def _rotate_batch(self) -> int:
+        """
+        重新加密游标之后的一批记录，返回本批读取的记录数
+        """
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                text("SELECT id, encrypted_key FROM api_configs "
+                     "WHERE id > :cursor AND encrypted_key IS NOT NULL ORDER BY id LIMIT :limit"),
+                {"cursor": self.progress["cursor"], "limit": self.batch_size},
+            ).fetchall()
+            rotated = failed = 0
+            for row_id, encrypted_key in rows:
+                if not secure_key_manager.needs_rotation(encrypted_key):
+                    continue
+                try:
+                    new_value = secure_key_manager.rotate(encrypted_key)
+                except Exception as e:
+                    failed += 1
+                    logger.error(f"API配置 {row_id} 的密钥无法解密，已跳过: {e}")
+                    continue
+                # 只在值未被并发修改时更新；被修改的记录已由新写入使用主密钥加密
+                result = db.execute(
+                    text("UPDATE api_configs SET encrypted_key = :new WHERE id = :id AND encrypted_key = :old"),
+                    {"new": new_value, "id": row_id, "old": encrypted_key},
+                )
+                rotated += result.rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if rows:
+            self.progress["cursor"] = rows[-1][0]
+        self.progress["processed"] += len(rows)
+        self.progress["rotated"] += rotated
+        self.progress["failed"] += failed
+        self._save_state()
+        return len(rows)
+
+    def run(self, restart: bool = False) -> dict:
+        """
+        执行（或继续）重新加密，直到处理完全部记录或被停止
+
+        Args:
+            restart (bool): 为True时忽略已保存的进度，从头开始
+
+        Returns:
+            dict: 最终进度
+        """
+        if restart or self.progress["status"] == "completed":
+            self.progress = self._new_state()
+        db = SessionLocal()
+        try:
+            self.progress["total"] = db.execute(
+                text("SELECT COUNT(*) FROM api_configs WHERE encrypted_key IS NOT NULL")
+            ).scalar()
+        finally:
+            db.close()
+        self.progress["status"] = "running"
+        self.progress["error"] = None
+        self._stop.clear()
+        try:
+            while not self._stop.is_set():
+                if self._rotate_batch() < self.batch_size:
+                    self.progress["status"] = "completed"
+                    break
+                time.sleep(self.pause)
+            else:
+                self.progress["status"] = "paused"
+        except Exception as e:
+            self.progress["status"] = "failed"
+            self.progress["error"] = str(e)
+            logger.exception("密钥轮换失败")
+        self._save_state()
+        return self.progress
+
+    def start_background(self, restart: bool = False) -> bool:
+        """
+        在后台线程中运行，已在运行时返回False
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        self._thread = threading.Thread(target=self.run, kwargs={"restart": restart}, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """
+        在当前批次结束后暂停，稍后可继续
+        """
+        self._stop.set()
+
+    def snapshot(self) -> dict:
+        return dict(self.progress, keyring=[kid for kid, _ in secure_key_manager.keyring])
+
+
+# 创建全局实例
+key_rotation_job = KeyRotationJob()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="用当前主密钥分批重新加密 api_configs.encrypted_key")
+    parser.add_argument("--generate-key", action="store_true", help="生成一个新的Fernet密钥后退出")
+    parser.add_argument("--batch-size", type=int, default=KEY_ROTATION_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="忽略已保存的进度，从头开始")
+    args = parser.parse_args()
+
+    if args.generate_key:
+        key = Fernet.generate_key()
+        print(f"新密钥 (kid={key_id(key)}): {key.decode()}")
+        print("将其放在 ENCRYPTION_KEYS 的第一位，旧密钥放在后面，例如：")
+        print(f"ENCRYPTION_KEYS={key.decode()},<旧密钥>")
+        return
+
+    key_rotation_job.batch_size = args.batch_size
+    progress = key_rotation_job.run(restart=args.restart)
+    print(json.dumps(key_rotation_job.snapshot(), ensure_ascii=False, indent=2))
+    if progress["status"] != "completed":
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+API配置负载均衡模块
+
+同一 category 下通常登记了多个提供商（例如不同 music_region 的音乐API）。
+均衡器为每个配置维护延迟和错误率的指数加权移动平均(EWMA)以及进行中的请求数，
+每次从候选中按 priority 加权随机抽取两个，选择得分较低（更快、更健康）的一个
+（power-of-two-choices）。慢或出错的提供商得分升高，流量会自动转移；
+统计值随闲置时间衰减，一段时间没有流量的提供商会被重新试探，恢复后流量逐渐回来。
+"""
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from models import ApiConfig
+
+BALANCER_EWMA_ALPHA = float(os.getenv("BALANCER_EWMA_ALPHA", 0.3))
+# 错误率对得分的放大系数：错误率为1时得分乘以 (1 + 该系数)
+BALANCER_ERROR_PENALTY = float(os.getenv("BALANCER_ERROR_PENALTY", 10))
+# 统计值的衰减时间常数（秒）：闲置该时长后得分衰减到约 1/e
+BALANCER_DECAY_SECONDS = float(os.getenv("BALANCER_DECAY_SECONDS", 30))
+
+
+class ConfigStats:
+    __slots__ = ("latency", "error_rate", "in_flight", "requests", "errors", "selected", "samples", "updated")
+
+    def __init__(self):
+        self.latency = 0.0      # 延迟EWMA（秒）
+        self.error_rate = 0.0   # 错误率EWMA（0~1）
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.selected = 0
+        self.samples = 0
+        self.updated = 0.0
+
+
+class LatencyBalancer:
+    """
+    基于延迟EWMA和错误率的负载均衡器
+    """
+    def __init__(self, alpha: float = BALANCER_EWMA_ALPHA, error_penalty: float = BALANCER_ERROR_PENALTY,
+                 decay_seconds: float = BALANCER_DECAY_SECONDS):
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.decay_seconds = decay_seconds
+        self._stats: Dict[int, ConfigStats] = {}
+        self._decisions: Dict[str, Dict[int, int]] = {}  # category -> {config_id: 被选中次数}
+        self._lock = threading.Lock()
+
+    def _get(self, config_id: int) -> ConfigStats:
+        stats = self._stats.get(config_id)
+        if stats is None:
+            stats = self._stats.setdefault(config_id, ConfigStats())
+        return stats
+
+    def start(self, config_id: int) -> float:
+        """
+        标记一次调用开始，返回开始时间
+        """
+        with self._lock:
+            self._get(config_id).in_flight += 1
+        return time.monotonic()
+
+    def finish(self, config_id: int, started: float, ok: bool):
+        """
+        记录一次调用的结果，更新延迟和错误率的EWMA
+
+        Args:
+            config_id (int): API配置ID
+            started (float): start() 返回的开始时间
+            ok (bool): 调用是否成功（无传输错误且状态码小于500）
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._lock:
+            stats = self._get(config_id)
+            stats.in_flight = max(0, stats.in_flight - 1)
+            stats.requests += 1
+            if not ok:
+                stats.errors += 1
+            if stats.samples == 0:
+                stats.latency = latency
+                stats.error_rate = 0.0 if ok else 1.0
+            else:
+                stats.latency += self.alpha * (latency - stats.latency)
+                stats.error_rate += self.alpha * ((0.0 if ok else 1.0) - stats.error_rate)
+            stats.samples += 1
+            stats.updated = now
+
+    def score(self, api_config: ApiConfig) -> float:
+        """
+        计算配置的得分，越低越好；没有样本的配置得分为0，优先试探
+        """
+        stats = self._stats.get(api_config.id)
+        if stats is None or stats.samples == 0:
+            return 0.0
+        decay = math.exp(-(time.monotonic() - stats.updated) / self.decay_seconds)
+        load = stats.latency * decay * (1 + stats.in_flight)
+        penalty = 1 + self.error_penalty * stats.error_rate * decay
+        return load * penalty / max(1, api_config.priority or 1)
+
+    def choose(self, candidates: List[ApiConfig]) -> ApiConfig:
+        """
+        从候选配置中选择一个
+
+        Args:
+            candidates (List[ApiConfig]): 候选配置（非空）
+
+        Returns:
+            ApiConfig: 选中的配置
+        """
+        if len(candidates) == 1:
+            chosen = candidates[0]
+        else:
+            weights = [max(1, c.priority or 1) for c in candidates]
+            first = random.choices(range(len(candidates)), weights=weights)[0]
+            weights[first] = 0
+            second = random.choices(range(len(candidates)), weights=weights)[0]
+            a, b = candidates[first], candidates[second]
+            chosen = a if self.score(a) <= self.score(b) else b
+        with self._lock:
+            self._get(chosen.id).selected += 1
+            category = chosen.category or ""
+            decisions = self._decisions.setdefault(category, {})
+            decisions[chosen.id] = decisions.get(chosen.id, 0) + 1
+        return chosen
+
+    def snapshot(self) -> dict:
+        """
+        返回每个配置的EWMA统计和每个类别的选择分布
+        """
+        with self._lock:
+            configs = {
+                config_id: {
+                    "latency_ewma_ms": round(stats.latency * 1000, 2),
+                    "error_rate_ewma": round(stats.error_rate, 4),
+                    "in_flight": stats.in_flight,
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "selected": stats.selected,
+                }
+                for config_id, stats in self._stats.items()
+            }
+            decisions = {category: dict(counts) for category, counts in self._decisions.items()}
+        return {"configs": configs, "decisions": decisions}
+
+
+# 创建全局实例
+latency_balancer = LatencyBalancer()
+
+
+def get_category_configs(db: Session, category: str) -> List[ApiConfig]:
+    """
+    返回类别下的全部激活配置
+    """
+    return db.query(ApiConfig).filter(
+        ApiConfig.category == category,
+        ApiConfig.is_active == True
+    ).order_by(ApiConfig.priority.desc(), ApiConfig.id).all()
@@ -0,0 +1,190 @@
+"""
+出站路径压测工具
+
+以不同并发级别请求 /api/ai/chat，报告 p50/p95/p99 延迟、吞吐量、状态码分布，
+以及上游看到的TCP连接数和应用新建的出站连接数，用于离线评估连接池、缓存和重试的改动。
+配合 mock_upstream.py 使用。
+
+用法：
+    python mock_upstream.py --port 8900 &
+    python load_test.py --configure-db --mock-url http://127.0.0.1:8900
+    uvicorn main:app --port 8000 &
+    python load_test.py --base-url http://127.0.0.1:8000 --mock-url http://127.0.0.1:8900 \\
+        --concurrency 1,10,50 --requests 200 --unique
+"""
+import argparse
+import asyncio
+import math
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    最近秩百分位数
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def _one_request(client: httpx.AsyncClient, url: str, message: str, stream: bool, bypass_cache: bool) -> tuple:
+    headers = {"X-Cache-Bypass": "1"} if bypass_cache else {}
+    payload = {"message": message, "stream": stream}
+    started = time.perf_counter()
+    first_byte = None
+    try:
+        if stream:
+            async with client.stream("POST", url, json=payload, headers=headers) as response:
+                async for _ in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - started
+                status = response.status_code
+        else:
+            response = await client.post(url, json=payload, headers=headers)
+            status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    elapsed = time.perf_counter() - started
+    return status, elapsed, first_byte if first_byte is not None else elapsed
+
+
+async def _get_json(client: httpx.AsyncClient, url: Optional[str]) -> dict:
+    if not url:
+        return {}
+    try:
+        response = await client.get(url)
+        return response.json() if response.status_code == 200 else {}
+    except (httpx.HTTPError, ValueError):
+        return {}
+
+
+def _new_connections(metrics: dict) -> int:
+    return sum(host.get("new_connections", 0) for host in metrics.values() if isinstance(host, dict))
+
+
+async def run_level(args, concurrency: int) -> dict:
+    """
+    以指定并发运行一轮压测
+    """
+    chat_url = args.base_url.rstrip("/") + "/api/ai/chat"
+    outbound_url = args.base_url.rstrip("/") + "/api/admin/outbound-connections"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        if args.mock_url:
+            await client.post(args.mock_url.rstrip("/") + "/mock/reset")
+        before = _new_connections(await _get_json(client, outbound_url))
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def worker(i: int):
+            message = f"{args.message} #{uuid.uuid4().hex}" if args.unique else args.message
+            async with semaphore:
+                return await _one_request(client, chat_url, message, args.stream, args.bypass_cache)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[worker(i) for i in range(args.requests)])
+        duration = time.perf_counter() - started
+
+        after = _new_connections(await _get_json(client, outbound_url))
+        mock = await _get_json(client, args.mock_url.rstrip("/") + "/mock/stats" if args.mock_url else None)
+
+    latencies = sorted(r[1] for r in results)
+    first_bytes = sorted(r[2] for r in results)
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "duration_s": duration,
+        "throughput_rps": len(results) / duration if duration else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "ttfb_p50_ms": percentile(first_bytes, 50) * 1000,
+        "status": dict(Counter(str(r[0]) for r in results)),
+        "outbound_new_connections": after - before,
+        "upstream_requests": mock.get("requests"),
+        "upstream_connections": mock.get("connections"),
+        "upstream_peak_active": mock.get("peak_active"),
+    }
+
+
+def format_report(rows: List[dict], stream: bool) -> str:
+    """
+    生成压测报告
+    """
+    lines = [
+        f"{'并发':>6} {'请求':>6} {'吞吐(req/s)':>12} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}"
+        + (f" {'首字节p50':>10}" if stream else "")
+        + f" {'新建出站连接':>12} {'上游连接':>8} {'上游请求':>8}  状态码",
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['concurrency']:>6} {row['requests']:>6} {row['throughput_rps']:>12.1f} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+            + (f" {row['ttfb_p50_ms']:>10.1f}" if stream else "")
+            + f" {row['outbound_new_connections']:>12} {str(row['upstream_connections'] or '-'):>8}"
+            f" {str(row['upstream_requests'] or '-'):>8}  {row['status']}"
+        )
+    return "\n".join(lines)
+
+
+def configure_db(mock_url: str):
+    """
+    将 AI_CHAT_CONFIG_NAME 对应的API配置指向模拟上游（不存在时创建）
+    """
+    from ai_service import AI_CHAT_CONFIG_NAME
+    from database import SessionLocal
+    from models import ApiConfig
+    from secure_keys import secure_key_manager
+
+    endpoint = mock_url.rstrip("/") + "/v1/chat/completions"
+    db = SessionLocal()
+    try:
+        api_config = db.query(ApiConfig).filter(ApiConfig.name == AI_CHAT_CONFIG_NAME).first()
+        if api_config is None:
+            api_config = ApiConfig(name=AI_CHAT_CONFIG_NAME, method="POST", category="ai", auth_type="bearer")
+            db.add(api_config)
+        api_config.endpoint = endpoint
+        api_config.is_active = True
+        api_config.encrypted_key = secure_key_manager.encrypt_key("mock-key")
+        db.commit()
+        print(f"已将 API 配置 {AI_CHAT_CONFIG_NAME} 指向 {endpoint}")
+    finally:
+        db.close()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="/api/ai/chat 出站路径压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--mock-url", default="", help="mock_upstream.py 的地址，用于统计上游连接数")
+    parser.add_argument("--concurrency", default="1,10,50", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=200, help="每个并发级别的请求数")
+    parser.add_argument("--message", default="你好")
+    parser.add_argument("--stream", action="store_true", help="使用流式模式")
+    parser.add_argument("--unique", action="store_true", help="每个请求使用不同的消息，避免命中补全缓存")
+    parser.add_argument("--bypass-cache", action="store_true", help="发送 X-Cache-Bypass: 1")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--configure-db", action="store_true",
+                        help="把对话API配置指向 --mock-url 后退出（需在应用所在目录运行）")
+    args = parser.parse_args()
+
+    if args.configure_db:
+        if not args.mock_url:
+            parser.error("--configure-db 需要 --mock-url")
+        configure_db(args.mock_url)
+        return
+
+    rows = []
+    for level in (int(c) for c in args.concurrency.split(",") if c.strip()):
+        rows.append(asyncio.run(run_level(args, level)))
+    print(format_report(rows, args.stream))
+
+
+if __name__ == "__main__":
+    main()
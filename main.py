@@ -2,7 +2,7 @@ from fastapi import FastAPI, Depends, HTTPException, status, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 from models import ApiConfig
 from schemas import ApiConfigCreate
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
 from typing import List, Optional
 import logging
+import os
 import httpx
 import json
 import random
@@ -35,7 +36,10 @@ from schemas import (
     ApiPermission as PydanticApiPermission,
     ApiPermissionCreate,
     ApiPermissionUpdate,
-    Token
+    Token,
+    TokenData,
+    RefreshTokenRequest,
+    RevokeTokenRequest
 )
 
 # 导入SQLAlchemy模型
@@ -44,8 +48,31 @@ import models as sqlalchemy_models
 from crude import *
 from auth import *
 from datetime import timedelta
+from contextlib import asynccontextmanager
 # 导入config_sync模块
 import config_sync
+from token_revocation import token_revocation_store
+from rate_limiter import enforce_login_rate_limit
+from permissions import permission_engine
+from http_clients import outbound_clients
+from outbound_metrics import outbound_metrics
+import ai_service
+from completion_cache import completion_cache
+from quota import request_quota
+import api_gateway
+from load_balancer import get_category_configs, latency_balancer
+from job_queue import job_queue
+from key_rotation import key_rotation_job
+from schemas import JobCreate, JobStatus, BatchRequest, BatchResult
+from fast_json import FastJSONResponse, list_response, object_response, parse_fields
+import etags
+from static_assets import PrecompressedStaticFiles
+import batch
+import crude
+from admission import AdmissionMiddleware, admission_controller
+from query_stats import QueryStatsMiddleware
+import metrics
+from write_queue import write_queue
 
 # 创建日志记录器
 logger = logging.getLogger(__name__)
@@ -54,7 +81,55 @@ logging.basicConfig(level=logging.INFO)
 # 创建数据库表
 sqlalchemy_models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="AllSmart 智能管理系统", description="用户和管理员后台管理系统", debug=True)
+# 由 serve.py 以多个工作进程运行时，父进程已完成迁移、.env同步和任务恢复；
+# 只有主工作进程认领无人执行的任务并监视 .env，避免各进程重复执行
+SERVER_MANAGED = os.getenv("SERVER_MANAGED", "false").lower() == "true"
+SERVER_PRIMARY_WORKER = os.getenv("SERVER_PRIMARY_WORKER", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    应用生命周期：启动时加载运行期状态，关闭时释放资源
+    """
+    db = SessionLocal()
+    try:
+        # 加载令牌吊销列表和API权限位图到内存
+        token_revocation_store.load(db)
+        permission_engine.load(db)
+        # 确保ETag使用的表版本号记录存在
+        etags.seed(db)
+    finally:
+        db.close()
+    # 定期同步其他工作进程写入的吊销记录和权限修改
+    token_revocation_store.start_syncing()
+    permission_engine.start_reloading()
+    metrics.registry.start()
+    # 启动异步任务调度（未完成的任务重新排队）
+    await job_queue.start(recover=not SERVER_MANAGED, adopt_orphans=SERVER_PRIMARY_WORKER)
+    # 监视 .env 变化，运行期间把API配置的变更同步到数据库
+    if SERVER_PRIMARY_WORKER:
+        config_sync.config_syncer.start_watching()
+    yield
+    await config_sync.config_syncer.stop_watching()
+    await job_queue.stop()
+    # 提交写队列中剩余的写请求
+    write_queue.stop()
+    # 关闭出站连接池
+    await outbound_clients.close()
+    token_revocation_store.stop_syncing()
+    permission_engine.stop_reloading()
+    metrics.registry.stop()
+
+app = FastAPI(title="AllSmart 智能管理系统", description="用户和管理员后台管理系统", debug=True, lifespan=lifespan,
+              default_response_class=FastJSONResponse)
+
+# 按路由类别自适应限制并发，过载时快速返回503（位于CORS之内，503响应同样带CORS头）
+app.add_middleware(AdmissionMiddleware)
+# 按请求统计SQL查询次数和耗时（X-Query-Count、Server-Timing 响应头）
+app.add_middleware(QueryStatsMiddleware)
+# 请求数和延迟直方图（/metrics）
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -67,19 +142,34 @@ app.add_middleware(
 
 # 用户认证端点
 @app.post("/api/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    enforce_login_rate_limit(request, form_data.username)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return create_token_pair(user)
+
+# 刷新令牌端点
+@app.post("/api/token/refresh", response_model=Token)
+def refresh_access_token(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    return refresh_token_pair(db, request.refresh_token)
+
+# 吊销令牌端点（登出）
+@app.post("/api/token/revoke")
+def revoke_access_token(request: RevokeTokenRequest, current_user: TokenData = Depends(get_current_principal),
+                        db: Session = Depends(get_db)):
+    revoke_token(db, current_user)
+    if request.refresh_token:
+        try:
+            revoke_token(db, decode_token(request.refresh_token, "refresh"))
+        except HTTPException:
+            # 刷新令牌已失效，无需再吊销
+            pass
+    return {"message": "Token revoked successfully"}
 
 # env-preview.py
 @app.get("/api/env-preview")
@@ -93,6 +183,11 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # 获取数据库会话
 def get_db():
+    # 批量请求中的写操作共用同一个会话，由 batch.run_batch 负责关闭
+    shared = batch.shared_session()
+    if shared is not None:
+        yield shared
+        return
     db = SessionLocal()
     try:
         yield db
@@ -101,10 +196,11 @@ def get_db():
 
 # 用户注册端点
 @app.post("/register", response_model=dict)
-async def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(request: Request, user: UserCreate, db: Session = Depends(get_db)):
     """
     用户注册接口
     """
+    enforce_login_rate_limit(request, user.username)
     try:
         # 检查用户名是否已存在
         existing_user = db.query(User).filter(User.username == user.username).first()
@@ -117,7 +213,7 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="邮箱已存在")
         
         # 创建新用户
-        new_user = create_user(db=db, user=user)
+        new_user = await write_queue.awrite(db, crude.create_user, user=user)
         
         return {"message": "注册成功", "user_id": new_user.id}
         
@@ -129,12 +225,14 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         return {"error": "注册失败，请稍后重试"}
 # 用户登录端点
 @app.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
     用户登录接口
     """
+    # 限流检查，避免撞库请求耗尽 bcrypt 计算资源
+    enforce_login_rate_limit(request, form_data.username)
     # 认证用户
-    user = authenticate_user(db=db, username=form_data.username, password=form_data.password)
+    user = await authenticate_user(db=db, username=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -142,14 +240,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # 创建访问令牌
-    access_token_expires = timedelta(minutes=30)
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role},
-        expires_delta=access_token_expires
-    )
-    
-    return {"access_token": access_token, "token_type": "bearer"}
+    # 创建访问令牌和刷新令牌
+    return create_token_pair(user)
 
 # 获取当前用户信息
 @app.get("/users/me", response_model=dict)
@@ -168,7 +260,7 @@ async def read_users_me(current_user: User = Depends(get_current_user), db: Sess
 # 获取所有用户列表（管理员权限）
 @app.get("/users", response_model=dict)
 async def read_users(skip: int = 0, limit: int = 100, search: str = None, 
-                   current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+                   current_user: TokenData = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     获取所有用户列表（需要管理员权限）
     """
@@ -199,7 +291,7 @@ async def read_users(skip: int = 0, limit: int = 100, search: str = None,
 
 # 获取特定用户信息（管理员权限）
 @app.get("/users/{user_id}", response_model=dict)
-async def read_user(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def read_user(user_id: int, current_user: TokenData = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     获取特定用户信息（需要管理员权限）
     """
@@ -227,7 +319,7 @@ async def read_user(user_id: int, current_user: User = Depends(get_current_user)
 # 更新用户信息（管理员权限）
 @app.put("/users/{user_id}", response_model=dict)
 async def update_user_info(user_id: int, user_update: UserUpdate, 
-                         current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+                         current_user: TokenData = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     更新用户信息（需要管理员权限）
     """
@@ -238,7 +330,7 @@ async def update_user_info(user_id: int, user_update: UserUpdate,
             detail="需要管理员权限才能修改用户信息"
         )
     
-    updated_user = update_user(db=db, user_id=user_id, user_data=user_update.dict(exclude_unset=True))
+    updated_user = await write_queue.awrite(db, crude.update_user, user_id=user_id, user_data=user_update.dict(exclude_unset=True))
     if not updated_user:
         raise HTTPException(status_code=404, detail="用户未找到")
     
@@ -246,7 +338,7 @@ async def update_user_info(user_id: int, user_update: UserUpdate,
 
 # 删除用户（管理员权限）
 @app.delete("/users/{user_id}", response_model=dict)
-async def delete_user_account(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_user_account(user_id: int, current_user: TokenData = Depends(get_current_principal), db: Session = Depends(get_db)):
     """
     删除用户账户（需要管理员权限）
     """
@@ -257,21 +349,36 @@ async def delete_user_account(user_id: int, current_user: User = Depends(get_cur
             detail="需要管理员权限才能删除用户"
         )
     
-    success = delete_user(db=db, user_id=user_id)
+    success = await write_queue.awrite(db, crude.delete_user, user_id=user_id)
     if not success:
         raise HTTPException(status_code=404, detail="用户未找到")
     
     return {"message": "用户删除成功"}
 @app.get("/api/users", response_model=List[PydanticUser])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = get_users(db, skip=skip, limit=limit)
-    return users
+def read_users(request: Request, skip: int = 0, limit: int = 100, fields: Optional[str] = None,
+               db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticUser, fields)
+    etag = etags.table_etag(db, "users")
+    cached = etags.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    users = get_users(db, skip=skip, limit=limit, fields=selected)
+    return etags.cache_headers(list_response(PydanticUser, users, fields=selected), etag)
 
 @app.get("/api/users/{user_id}", response_model=PydanticUser)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = get_user(db, user_id=user_id)
+def read_user(user_id: int, request: Request, response: Response, fields: Optional[str] = None,
+              db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticUser, fields)
+    etag = etags.table_etag(db, "users")
+    cached = etags.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    db_user = get_user(db, user_id=user_id, fields=selected)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    if selected:
+        return etags.cache_headers(object_response(PydanticUser, db_user, selected), etag)
+    etags.cache_headers(response, etag)
     return db_user
 
 @app.post("/api/users", response_model=PydanticUser)
@@ -279,26 +386,30 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     db_user = get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return create_user(db=db, user=user)
+    return write_queue.write(db, crude.create_user, user=user)
 
 @app.put("/api/users/{user_id}", response_model=PydanticUser)
 def update_user_endpoint(user_id: int, user: UserUpdate, db: Session = Depends(get_db)):
-    db_user = update_user(db, user_id=user_id, user_data=user.dict(exclude_unset=True))
+    db_user = write_queue.write(db, crude.update_user, user_id=user_id, user_data=user.dict(exclude_unset=True))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @app.delete("/api/users/{user_id}")
 def delete_user_endpoint(user_id: int, db: Session = Depends(get_db)):
-    if delete_user(db, user_id=user_id):
+    if write_queue.write(db, crude.delete_user, user_id=user_id):
         return {"message": "User deleted successfully"}
     raise HTTPException(status_code=404, detail="User not found")
 
 # 设备相关端点
+def _owner_id(principal: TokenData) -> Optional[int]:
+    # owner_id 引用 users 表，管理员创建的记录不设所有者
+    return principal.user_id if principal.kind == "user" else None
+
 @app.get("/api/devices", response_model=List[PydanticDevice])
 def read_devices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     devices = get_devices(db, skip=skip, limit=limit)
-    return devices
+    return list_response(PydanticDevice, devices)
 
 @app.get("/api/devices/{device_id}", response_model=PydanticDevice)
 def read_device(device_id: int, db: Session = Depends(get_db)):
@@ -308,63 +419,86 @@ def read_device(device_id: int, db: Session = Depends(get_db)):
     return db_device
 
 @app.post("/api/devices", response_model=PydanticDevice)
-def create_device(device: DeviceCreate, db: Session = Depends(get_db)):
-    return create_device(db=db, device=device)
+def create_device_endpoint(device: DeviceCreate, principal: TokenData = Depends(get_current_principal),
+                           db: Session = Depends(get_db)):
+    return write_queue.write(db, crude.create_device, device=device, owner_id=_owner_id(principal))
 
 @app.put("/api/devices/{device_id}", response_model=PydanticDevice)
 def update_device_endpoint(device_id: int, device: DeviceUpdate, db: Session = Depends(get_db)):
-    db_device = update_device(db, device_id=device_id, device_data=device.dict(exclude_unset=True))
+    db_device = write_queue.write(db, crude.update_device, device_id=device_id, device_data=device.dict(exclude_unset=True))
     if db_device is None:
         raise HTTPException(status_code=404, detail="Device not found")
     return db_device
 
 @app.delete("/api/devices/{device_id}")
 def delete_device_endpoint(device_id: int, db: Session = Depends(get_db)):
-    if delete_device(db, device_id=device_id):
+    if write_queue.write(db, crude.delete_device, device_id=device_id):
         return {"message": "Device deleted successfully"}
     raise HTTPException(status_code=404, detail="Device not found")
 
 # 任务相关端点
 @app.get("/api/tasks", response_model=List[PydanticTask])
-def read_tasks(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    tasks = get_tasks(db, skip=skip, limit=limit)
-    return tasks
+def read_tasks(skip: int = 0, limit: int = 100, fields: Optional[str] = None,
+               db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticTask, fields)
+    tasks = get_tasks(db, skip=skip, limit=limit, fields=selected)
+    return list_response(PydanticTask, tasks, fields=selected)
 
 @app.get("/api/tasks/{task_id}", response_model=PydanticTask)
-def read_task(task_id: int, db: Session = Depends(get_db)):
-    db_task = get_task(db, task_id=task_id)
+def read_task(task_id: int, fields: Optional[str] = None,
+              db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticTask, fields)
+    db_task = get_task(db, task_id=task_id, fields=selected)
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
+    if selected:
+        return object_response(PydanticTask, db_task, selected)
     return db_task
 
 @app.post("/api/tasks", response_model=PydanticTask)
-def create_task_endpoint(task: TaskCreate, db: Session = Depends(get_db)):
-    return create_task(db=db, task=task)
+def create_task_endpoint(task: TaskCreate, principal: TokenData = Depends(get_current_principal),
+                         db: Session = Depends(get_db)):
+    return write_queue.write(db, crude.create_task, task=task, owner_id=_owner_id(principal))
 
 @app.put("/api/tasks/{task_id}", response_model=PydanticTask)
 def update_task_endpoint(task_id: int, task: TaskUpdate, db: Session = Depends(get_db)):
-    db_task = update_task(db, task_id=task_id, task_data=task.dict(exclude_unset=True))
+    db_task = write_queue.write(db, crude.update_task, task_id=task_id, task_data=task.dict(exclude_unset=True))
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return db_task
 
 @app.delete("/api/tasks/{task_id}")
 def delete_task_endpoint(task_id: int, db: Session = Depends(get_db)):
-    if delete_task(db, task_id=task_id):
+    if write_queue.write(db, crude.delete_task, task_id=task_id):
         return {"message": "Task deleted successfully"}
     raise HTTPException(status_code=404, detail="Task not found")
 
 # 管理员相关端点
 @app.get("/api/admins", response_model=List[PydanticAdmin])
-def read_admins(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    admins = get_admins(db, skip=skip, limit=limit)
-    return admins
+def read_admins(request: Request, skip: int = 0, limit: int = 100, fields: Optional[str] = None,
+                db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticAdmin, fields)
+    etag = etags.table_etag(db, "admins")
+    cached = etags.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    admins = get_admins(db, skip=skip, limit=limit, fields=selected)
+    return etags.cache_headers(list_response(PydanticAdmin, admins, fields=selected), etag)
 
 @app.get("/api/admins/{admin_id}", response_model=PydanticAdmin)
-def read_admin(admin_id: int, db: Session = Depends(get_db)):
-    db_admin = get_admin(db, admin_id=admin_id)
+def read_admin(admin_id: int, request: Request, response: Response, fields: Optional[str] = None,
+               db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticAdmin, fields)
+    etag = etags.table_etag(db, "admins")
+    cached = etags.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    db_admin = get_admin(db, admin_id=admin_id, fields=selected)
     if db_admin is None:
         raise HTTPException(status_code=404, detail="Admin not found")
+    if selected:
+        return etags.cache_headers(object_response(PydanticAdmin, db_admin, selected), etag)
+    etags.cache_headers(response, etag)
     return db_admin
 
 @app.post("/api/admins", response_model=PydanticAdmin)
@@ -372,39 +506,54 @@ def create_admin_endpoint(admin: AdminCreate, db: Session = Depends(get_db)):
     db_admin = get_admin_by_username(db, username=admin.username)
     if db_admin:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return create_admin(db=db, admin=admin)
+    return write_queue.write(db, crude.create_admin, admin=admin)
 
 @app.put("/api/admins/{admin_id}", response_model=PydanticAdmin)
 def update_admin_endpoint(admin_id: int, admin: AdminUpdate, db: Session = Depends(get_db)):
-    db_admin = update_admin(db, admin_id=admin_id, admin_data=admin.dict(exclude_unset=True))
+    db_admin = write_queue.write(db, crude.update_admin, admin_id=admin_id, admin_data=admin.dict(exclude_unset=True))
     if db_admin is None:
         raise HTTPException(status_code=404, detail="Admin not found")
     return db_admin
 
 @app.delete("/api/admins/{admin_id}")
 def delete_admin_endpoint(admin_id: int, db: Session = Depends(get_db)):
-    if delete_admin(db, admin_id=admin_id):
+    if write_queue.write(db, crude.delete_admin, admin_id=admin_id):
         return {"message": "Admin deleted successfully"}
     raise HTTPException(status_code=404, detail="Admin not found")
 
 # API配置相关端点
 @app.get("/api/api-configs", response_model=List[PydanticApiConfig])
-def read_api_configs(skip: int = 0, limit: int = 100, search: str = None, db: Session = Depends(get_db)):
-    api_configs = get_api_configs(db, skip=skip, limit=limit, search=search)
-    return api_configs
+def read_api_configs(request: Request, skip: int = 0, limit: int = 100, search: str = None, fields: Optional[str] = None,
+                     db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticApiConfig, fields)
+    etag = etags.table_etag(db, "api_configs")
+    cached = etags.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    api_configs = get_api_configs(db, skip=skip, limit=limit, search=search, fields=selected)
+    return etags.cache_headers(list_response(PydanticApiConfig, api_configs, fields=selected), etag)
 
 @app.get("/api/api-configs/{api_config_id}", response_model=PydanticApiConfig)
-def read_api_config(api_config_id: int, db: Session = Depends(get_db)):
-    db_api_config = get_api_config(db, api_config_id=api_config_id)
+def read_api_config(api_config_id: int, request: Request, response: Response, fields: Optional[str] = None,
+                    db: Session = Depends(get_db)):
+    selected = parse_fields(PydanticApiConfig, fields)
+    etag = etags.table_etag(db, "api_configs")
+    cached = etags.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    db_api_config = get_api_config(db, api_config_id=api_config_id, fields=selected)
     if db_api_config is None:
         raise HTTPException(status_code=404, detail="API config not found")
+    if selected:
+        return etags.cache_headers(object_response(PydanticApiConfig, db_api_config, selected), etag)
+    etags.cache_headers(response, etag)
     return db_api_config
 
 # 更新create_api_config_endpoint函数
 @app.post("/api/api-configs", response_model=PydanticApiConfig)
 def create_api_config_endpoint(api_config: ApiConfigCreate, db: Session = Depends(get_db)):
     try:
-        db_api_config = create_api_config_crud(db, api_config)
+        db_api_config = write_queue.write(db, crude.create_api_config_crud, api_config)
         return db_api_config
     except Exception as e:
         logger.error(f"Failed to create API config: {e}")
@@ -412,107 +561,227 @@ def create_api_config_endpoint(api_config: ApiConfigCreate, db: Session = Depend
 
 @app.put("/api/api-configs/{api_config_id}", response_model=PydanticApiConfig)
 def update_api_config(api_config_id: int, api_config: ApiConfigUpdate, db: Session = Depends(get_db)):
-    db_api_config = update_api_config(db, api_config_id=api_config_id, api_config_data=api_config)
+    db_api_config = write_queue.write(db, crude.update_api_config, api_config_id=api_config_id, api_config_data=api_config)
     if db_api_config is None:
         raise HTTPException(status_code=404, detail="API config not found")
     return db_api_config
 
 @app.delete("/api/api-configs/{api_config_id}")
 def delete_api_config_endpoint(api_config_id: int, db: Session = Depends(get_db)):
-    if delete_api_config(db, api_config_id=api_config_id):
+    if write_queue.write(db, crude.delete_api_config, api_config_id=api_config_id):
         return {"message": "API config deleted successfully"}
     raise HTTPException(status_code=404, detail="API config not found")
 
-# 添加AI服务调用端点
-
-@app.post("/api/ai/chat")
-async def ai_chat(message: str, db: Session = Depends(get_db)):
-    # 获取默认的AI API配置（例如 DeepSeek 或 OpenAI）
-    api_config = db.query(ApiConfig).filter(
-        ApiConfig.name == "DeepSeek",
-        ApiConfig.is_active == True
-    ).first()
-
-    if not api_config:
-        raise HTTPException(status_code=404, detail="AI API配置未找到")
-
-    # 解密API密钥
-    api_key = get_decrypted_api_key(db, api_config.id)
-    if not api_key:
-        raise HTTPException(status_code=500, detail="无法解密API密钥")
-
-    # 构造请求
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "messages": [{"role": "user", "content": message}],
-        "model": "deepseek-chat"
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(api_config.endpoint, headers=headers, json=payload)
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-
-    result = response.json()
-    return {"response": result["choices"][0]["message"]["content"]}
-
 # 添加AI服务调用端点
 from pydantic import BaseModel
 
 class ChatMessage(BaseModel):
     message: str
+    stream: bool = False
 
 @app.post("/api/ai/chat")
-async def ai_chat(chat_message: ChatMessage, db: Session = Depends(get_db)):
-    message = chat_message.message
-    
-    # 获取默认的AI API配置（例如 DeepSeek 或 OpenAI）
-    api_config = db.query(ApiConfig).filter(
-        ApiConfig.name == "DeepSeek",
-        ApiConfig.is_active == True
-    ).first()
-
-    if not api_config:
-        raise HTTPException(status_code=404, detail="AI API配置未找到")
-
-    # 解密API密钥
-    api_key = get_decrypted_api_key(db, api_config.id)
-    if not api_key:
-        raise HTTPException(status_code=500, detail="无法解密API密钥")
-
-    # 构造请求
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "messages": [{"role": "user", "content": message}],
-        "model": "deepseek-chat"
+async def ai_chat(chat_message: ChatMessage, request: Request, db: Session = Depends(get_db)):
+    api_config = ai_service.select_chat_config(db)
+    # 请求头 X-Cache-Bypass: 1 或 Cache-Control: no-cache 时跳过缓存
+    use_cache = request.headers.get("x-cache-bypass") != "1" and "no-cache" not in request.headers.get("cache-control", "")
+    if chat_message.stream:
+        cached, cache_status = ai_service.get_cached_chat(api_config, chat_message.message, use_cache)
+        sse_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": cache_status}
+        if cached is not None:
+            return StreamingResponse(ai_service.replay_cached_stream(cached), media_type="text/event-stream",
+                                     headers=sse_headers)
+        # 流式模式：以SSE逐段转发上游输出，客户端断开或结束后关闭上游连接
+        upstream = await ai_service.open_chat_stream(db, api_config, chat_message.message)
+        cache_key, cache_ttl = ai_service.chat_cache_slot(api_config, chat_message.message)
+        return StreamingResponse(
+            ai_service.relay_chat_stream(upstream, request, cache_key, cache_ttl, api_config),
+            media_type="text/event-stream",
+            headers=sse_headers,
+        )
+    content, cache_status = await ai_service.complete_chat(db, api_config, chat_message.message, use_cache)
+    return JSONResponse({"response": content}, headers={"X-Cache": cache_status})
+
+# 健康检查：供负载均衡器和 serve.py 部署探测，不访问数据库
+@app.get("/health")
+def health():
+    return {"status": "ok", "pid": os.getpid(), "primary": SERVER_PRIMARY_WORKER}
+
+# Prometheus 指标
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# 批量请求：一次往返执行多个子请求，读请求并发、写请求按顺序执行（见 batch.py）
+@app.post("/api/batch", response_model=List[BatchResult])
+async def batch_requests(batch_request: BatchRequest, request: Request):
+    return await batch.run_batch(app, request, batch_request.requests)
+
+# 异步任务：提交后立即返回任务ID，结果通过轮询或SSE获取
+@app.post("/api/jobs", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+def create_job(job: JobCreate, principal: TokenData = Depends(get_current_principal), db: Session = Depends(get_db)):
+    if job.kind == "chat":
+        if not job.message:
+            raise HTTPException(status_code=422, detail="chat 任务需要 message")
+        api_config = ai_service.select_chat_config(db)
+        payload = {"message": job.message}
+    elif job.kind == "proxy":
+        if job.api_config_id is None:
+            raise HTTPException(status_code=422, detail="proxy 任务需要 api_config_id")
+        if principal.kind != "admin" and not permission_engine.can_access(principal.user_id, job.api_config_id):
+            raise HTTPException(status_code=403, detail="没有访问该API的权限")
+        api_config = get_api_config(db, api_config_id=job.api_config_id)
+        if api_config is None or not api_config.is_active:
+            raise HTTPException(status_code=404, detail="API config not found")
+        payload = {"params": job.params, "body": job.body}
+    else:
+        raise HTTPException(status_code=422, detail="不支持的任务类型")
+    return job_queue.submit(db, job.kind, api_config, payload, owner=f"{principal.kind}:{principal.user_id}")
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+def read_job(job_id: str, stream: bool = False, principal: TokenData = Depends(get_current_principal),
+             db: Session = Depends(get_db)):
+    job = db.get(sqlalchemy_models.Job, job_id)
+    if job is None or (principal.kind != "admin" and job.owner != f"{principal.kind}:{principal.user_id}"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    if stream:
+        return StreamingResponse(job_queue.stream(job_id), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    return job
+
+# /api/admin/* 接口只允许管理员访问
+def _require_admin(principal: TokenData):
+    if principal.kind != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions")
+
+# 加密密钥轮换：后台分批用主密钥重新加密 api_configs.encrypted_key
+@app.get("/api/admin/key-rotation")
+def read_key_rotation(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return key_rotation_job.snapshot()
+
+@app.post("/api/admin/key-rotation", status_code=status.HTTP_202_ACCEPTED)
+def start_key_rotation(restart: bool = False, principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    if not key_rotation_job.start_background(restart=restart):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="密钥轮换正在进行中")
+    return key_rotation_job.snapshot()
+
+@app.delete("/api/admin/key-rotation")
+def pause_key_rotation(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    key_rotation_job.stop()
+    return key_rotation_job.snapshot()
+
+# 任务调度器状态
+@app.get("/api/admin/jobs")
+def read_job_queue_stats(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return job_queue.snapshot()
+
+# API配置配额使用情况
+@app.get("/api/api-configs/{api_config_id}/quota")
+def read_api_config_quota(api_config_id: int, db: Session = Depends(get_db)):
+    db_api_config = get_api_config(db, api_config_id=api_config_id)
+    if db_api_config is None:
+        raise HTTPException(status_code=404, detail="API config not found")
+    return {
+        "api_config_id": api_config_id,
+        "max_requests": db_api_config.max_requests,
+        "worker_limit": request_quota.limit(db_api_config),
+        "used": request_quota.usage(api_config_id),
+        "available": request_quota.is_available(db_api_config),
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(api_config.endpoint, headers=headers, json=payload)
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
+# AI补全缓存统计
+@app.get("/api/ai/cache/stats")
+def read_completion_cache_stats():
+    return completion_cache.snapshot()
+
+# 出站连接池统计
+@app.get("/api/admin/outbound-connections")
+def read_outbound_connections(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return outbound_clients.metrics()
+
+# 按API配置统计的出站调用指标：延迟直方图、状态码、异常和字节数
+@app.get("/api/admin/outbound-metrics")
+def read_outbound_metrics(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return outbound_metrics.snapshot()
+
+# 通用API网关：按配置的端点、方法和认证方式调用外部API
+async def _forward_to_config(api_config: ApiConfig, request: Request) -> Response:
+    headers = {}
+    if "content-type" in request.headers:
+        headers["Content-Type"] = request.headers["content-type"]
+    upstream = await api_gateway.call_api_config(
+        api_config,
+        params=dict(request.query_params),
+        content=await request.body() or None,
+        headers=headers,
+    )
+    return Response(
+        content=upstream.content,
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type"),
+        headers={"X-Api-Config-Id": str(api_config.id)},
+    )
 
-    result = response.json()
-    return {"response": result["choices"][0]["message"]["content"]}
-@app.post("/api/ai/chat")
-async def ai_chat(message: str):
-    return {"response": "这是AI的模拟回复，实际API尚未连接。"}
+@app.api_route("/api/proxy/{config_id}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def proxy_api_call(config_id: int, request: Request, principal: TokenData = Depends(get_current_principal),
+                         db: Session = Depends(get_db)):
+    if principal.kind != "admin" and not permission_engine.can_access(principal.user_id, config_id):
+        raise HTTPException(status_code=403, detail="没有访问该API的权限")
+    api_config = get_api_config(db, api_config_id=config_id)
+    if api_config is None:
+        raise HTTPException(status_code=404, detail="API config not found")
+    ai_service.release_db(db)
+    return await _forward_to_config(api_config, request)
+
+# 按类别调用：由负载均衡器在同类别的激活配置中选择
+@app.api_route("/api/proxy/category/{category}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def proxy_category_call(category: str, request: Request, principal: TokenData = Depends(get_current_principal),
+                              db: Session = Depends(get_db)):
+    candidates = [
+        c for c in get_category_configs(db, category)
+        if principal.kind == "admin" or permission_engine.can_access(principal.user_id, c.id)
+    ]
+    if not candidates:
+        raise HTTPException(status_code=404, detail="该类别下没有可用的API配置")
+    ai_service.release_db(db)
+    return await _forward_to_config(api_gateway.choose_config(candidates), request)
+
+# 网关熔断器状态
+@app.get("/api/admin/circuit-breakers")
+def read_circuit_breakers(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return api_gateway.breaker_states()
+
+# 负载均衡统计：每个配置的延迟/错误率EWMA和各类别的选择分布
+@app.get("/api/admin/load-balancer")
+def read_load_balancer_stats(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return latency_balancer.snapshot()
+
+@app.get("/api/admin/admission")
+def read_admission_stats(principal: TokenData = Depends(get_current_principal)):
+    _require_admin(principal)
+    return admission_controller.snapshot()
 
 # API权限相关端点
 @app.get("/api/api-permissions", response_model=List[PydanticApiPermission])
 def read_api_permissions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     api_permissions = get_api_permissions(db, skip=skip, limit=limit)
-    return api_permissions
+    return list_response(PydanticApiPermission, api_permissions)
+
+@app.get("/api/api-permissions/check")
+def check_api_permission(user_id: int, api_config_id: int):
+    return {
+        "user_id": user_id,
+        "api_config_id": api_config_id,
+        "can_access": permission_engine.can_access(user_id, api_config_id),
+        "can_modify": permission_engine.can_modify(user_id, api_config_id),
+    }
 
 @app.get("/api/api-permissions/{api_permission_id}", response_model=PydanticApiPermission)
 def read_api_permission(api_permission_id: int, db: Session = Depends(get_db)):
@@ -523,18 +792,18 @@ def read_api_permission(api_permission_id: int, db: Session = Depends(get_db)):
 
 @app.post("/api/api-permissions", response_model=PydanticApiPermission)
 def create_api_permission_endpoint(api_permission: ApiPermissionCreate, db: Session = Depends(get_db)):
-    return create_api_permission(db=db, api_permission=api_permission)
+    return write_queue.write(db, crude.create_api_permission, api_permission=api_permission)
 
 @app.put("/api/api-permissions/{api_permission_id}", response_model=PydanticApiPermission)
 def update_api_permission_endpoint(api_permission_id: int, api_permission: ApiPermissionUpdate, db: Session = Depends(get_db)):
-    db_api_permission = update_api_permission(db, api_permission_id=api_permission_id, api_permission_data=api_permission.dict(exclude_unset=True))
+    db_api_permission = write_queue.write(db, crude.update_api_permission, api_permission_id=api_permission_id, api_permission_data=api_permission.dict(exclude_unset=True))
     if db_api_permission is None:
         raise HTTPException(status_code=404, detail="API permission not found")
     return db_api_permission
 
 @app.delete("/api/api-permissions/{api_permission_id}")
 def delete_api_permission_endpoint(api_permission_id: int, db: Session = Depends(get_db)):
-    if delete_api_permission(db, api_permission_id=api_permission_id):
+    if write_queue.write(db, crude.delete_api_permission, api_permission_id=api_permission_id):
         return {"message": "API permission deleted successfully"}
     raise HTTPException(status_code=404, detail="API permission not found")
 
@@ -546,7 +815,7 @@ def read_user_preferences(user_id: int, preference_type: Optional[str] = None, d
 
 @app.post("/api/user-preferences")
 def create_user_preference_endpoint(user_preference: UserPreferenceCreate, db: Session = Depends(get_db)):
-    return create_user_preference(db=db, user_preference=user_preference)
+    return write_queue.write(db, crude.create_user_preference, user_preference=user_preference)
 
 @app.put("/api/user-preferences/{user_id}/{preference_type}/{preference_name}")
 def update_user_preference_endpoint(
@@ -556,7 +825,7 @@ def update_user_preference_endpoint(
     value: dict,
     db: Session = Depends(get_db)
 ):
-    return update_user_preference(db, user_id, preference_type, preference_name, value)
+    return write_queue.write(db, crude.update_user_preference, user_id, preference_type, preference_name, value)
 
 @app.delete("/api/user-preferences/{user_id}/{preference_type}/{preference_name}")
 def delete_user_preference_endpoint(
@@ -565,7 +834,7 @@ def delete_user_preference_endpoint(
     preference_name: str,
     db: Session = Depends(get_db)
 ):
-    if delete_user_preference(db, user_id, preference_type, preference_name):
+    if write_queue.write(db, crude.delete_user_preference, user_id, preference_type, preference_name):
         return {"message": "User preference deleted successfully"}
     raise HTTPException(status_code=404, detail="User preference not found")
 
@@ -578,7 +847,8 @@ def redirect_to_admin():
 
 # 静态文件服务
 # 使用 public 目录作为静态文件服务
-app.mount("/", StaticFiles(directory="public", html=True), name="static")
+# 静态文件：预压缩、带哈希文件名的长期缓存和 ETag/304（见 static_assets.py）
+app.mount("/", PrecompressedStaticFiles(directory="public", html=True), name="static")
 
 @app.exception_handler(Exception)
 async def exception_handler(request: Request, exc: Exception):
@@ -592,6 +862,6 @@ if __name__ == "__main__":
     # 启动时从 .env 同步到数据库
     config_sync.sync_db_from_env()
     
-    # 使用 uvicorn 运行应用（正确方式）
+    # 使用 uvicorn 运行应用（开发模式）；生产环境使用 python serve.py
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
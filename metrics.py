@@ -0,0 +1,446 @@
+"""
+Prometheus 指标模块
+
+GET /metrics 以 Prometheus 文本格式输出：
+    - http_requests_total、http_request_duration_seconds：按路由模板、方法、状态码统计的请求数和延迟直方图；
+    - db_pool_*：SQLAlchemy 连接池的借出次数、当前借出数和溢出连接数；
+    - cache_*：SimpleCache 和AI补全缓存的命中、未命中次数和条目数；
+    - password_verify_duration_seconds：bcrypt 密码校验耗时；
+    - outbound_requests_total、outbound_request_duration_seconds：按API配置统计的出站调用。
+
+记录时只在进程内的字典上加一次锁累加，不做任何跨进程同步。
+设置 METRICS_DIR 时（serve.py 多进程运行时自动设置），每个工作进程每 METRICS_FLUSH_SECONDS 秒
+把自己的指标写入该目录下的 <pid>.json（只写自己的文件，无需跨进程加锁），
+/metrics 由任一工作进程汇总目录中的全部文件：计数器和直方图累加（已退出的工作进程的计数保留，
+计数器不会因进程回收而回退），仪表值只累加仍在运行的进程。
+"""
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import fcntl  # 仅 Unix 可用，用于合并已退出进程的指标文件
+except ImportError:
+    fcntl = None
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PASSWORD_VERIFY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# 指标名 -> (类型, 说明)
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests by route, method and status"),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by route and method"),
+    "db_pool_checkouts_total": ("counter", "Connections checked out from the SQLAlchemy pool"),
+    "db_pool_checked_out": ("gauge", "Connections currently checked out"),
+    "db_pool_overflow": ("gauge", "Overflow connections currently open beyond pool_size"),
+    "db_pool_size": ("gauge", "Configured pool size"),
+    "cache_hits_total": ("counter", "Cache hits"),
+    "cache_misses_total": ("counter", "Cache misses"),
+    "cache_entries": ("gauge", "Entries currently cached"),
+    "password_verify_duration_seconds": ("histogram", "bcrypt password verification latency"),
+    "outbound_requests_total": ("counter", "Outbound API calls by config and status"),
+    "outbound_request_duration_seconds": ("histogram", "Outbound API call latency by config"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+# 采集器返回的样本：(类型, 指标名, 标签, 值)；直方图的值为 (各桶计数, 总和, 桶上界)
+Sample = Tuple[str, str, Labels, object]
+
+
+class MetricsRegistry:
+    """
+    进程内指标登记表
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], list] = {}  # [各桶计数..., 超出最大桶的计数, 总和]
+        self._buckets: Dict[str, tuple] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = (), buckets: tuple = HTTP_BUCKETS):
+        """
+        向直方图记录一个样本（秒）
+        """
+        key = (name, labels)
+        index = bisect_left(buckets, value)
+        with self._lock:
+            row = self._histograms.get(key)
+            if row is None:
+                row = [0] * (len(buckets) + 1) + [0.0]
+                self._histograms[key] = row
+                self._buckets[name] = buckets
+            row[index] += 1
+            row[-1] += value
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """
+        登记采集器，生成指标时调用，用于连接池、缓存等已有统计
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """
+        本进程的全部指标，可序列化为JSON
+        """
+        with self._lock:
+            counters = [[name, labels, value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, labels, row[:-1], row[-1]] for (name, labels), row in self._histograms.items()]
+            buckets = dict(self._buckets)
+        gauges = []
+        for collector in self._collectors:
+            for kind, name, labels, value in collector():
+                if kind == "counter":
+                    counters.append([name, labels, value])
+                elif kind == "gauge":
+                    gauges.append([name, labels, value])
+                else:
+                    histograms.append([name, labels, list(value[0]), value[1]])
+                    buckets[name] = value[2]
+        return {"pid": os.getpid(), "counters": counters, "gauges": gauges,
+                "histograms": histograms, "buckets": buckets}
+
+    # ---- 多进程汇总 ----
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(METRICS_DIR, f"{pid}.json")
+
+    def flush(self):
+        """
+        把本进程的指标写入 METRICS_DIR
+        """
+        if not METRICS_DIR:
+            return
+        path = self._path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _flush_loop(self):
+        while not self._stop.wait(METRICS_FLUSH_SECONDS):
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def start(self):
+        """
+        多进程运行时启动定期写文件的后台线程（应用启动时调用）
+        """
+        if METRICS_DIR and self._flusher is None:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            self._stop.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def stop(self):
+        """
+        停止后台线程并写入最终的计数（应用关闭时调用）
+        """
+        self._stop.set()
+        self._flusher = None
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def _load_all(self) -> List[dict]:
+        snapshots = []
+        lock = open(os.path.join(METRICS_DIR, ".lock"), "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(METRICS_DIR, "archive.json")
+            archive = None
+            finished = []
+            for name in os.listdir(METRICS_DIR):
+                if not name.endswith(".json") or name == "archive.json":
+                    continue
+                try:
+                    with open(os.path.join(METRICS_DIR, name)) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if _alive(data["pid"]) or fcntl is None:
+                    snapshots.append(data)
+                    continue
+                # 已退出的工作进程：计数器和直方图并入 archive.json，仪表值丢弃
+                if archive is None:
+                    archive = _read_json(archive_path) or {"pid": None, "counters": [], "gauges": [],
+                                                            "histograms": [], "buckets": {}}
+                archive = _merge([archive, dict(data, gauges=[])])
+                finished.append(name)
+            if archive is not None:
+                tmp = f"{archive_path}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(archive, f)
+                os.replace(tmp, archive_path)
+                # 合并结果写入后再删除，中途失败时不会丢失计数
+                for name in finished:
+                    os.remove(os.path.join(METRICS_DIR, name))
+            else:
+                archive = _read_json(archive_path)
+            if archive is not None:
+                snapshots.append(archive)
+        finally:
+            lock.close()
+        return snapshots
+
+    def render(self) -> str:
+        """
+        生成 Prometheus 文本格式的指标；多进程运行时汇总所有工作进程
+        """
+        if METRICS_DIR:
+            self.flush()
+            merged = _merge(self._load_all())
+        else:
+            merged = _merge([self.snapshot()])
+        return _render(merged)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# 登记表在 METRICS_DIR 中写入的文件：<pid>.json、archive.json、它们的临时文件和 .lock
+_OWN_FILE_PATTERN = re.compile(r"^(?:\d+|archive)\.json(?:\.tmp)?$|^\.lock$")
+
+
+def clear_directory(directory: str) -> int:
+    """
+    删除目录中登记表写入的指标文件（上次运行留下的计数），不删除其他文件
+
+    Returns:
+        int: 删除的文件数
+    """
+    removed = 0
+    for name in os.listdir(directory):
+        if _OWN_FILE_PATTERN.match(name):
+            try:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _key(name: str, labels) -> Tuple[str, Labels]:
+    return name, tuple(tuple(pair) for pair in labels)
+
+
+def _merge(snapshots: List[dict]) -> dict:
+    counters: Dict[Tuple[str, Labels], float] = {}
+    gauges: Dict[Tuple[str, Labels], float] = {}
+    histograms: Dict[Tuple[str, Labels], list] = {}
+    buckets: Dict[str, list] = {}
+    for data in snapshots:
+        buckets.update(data.get("buckets", {}))
+        for name, labels, value in data["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data["gauges"]:
+            key = _key(name, labels)
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, counts, total in data["histograms"]:
+            key = _key(name, labels)
+            row = histograms.get(key)
+            if row is None:
+                histograms[key] = [list(counts), total]
+            else:
+                row[0] = [a + b for a, b in zip(row[0], counts)]
+                row[1] += total
+    return {
+        "pid": None,
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "gauges": [[name, labels, value] for (name, labels), value in gauges.items()],
+        "histograms": [[name, labels, counts, total] for (name, labels), (counts, total) in histograms.items()],
+        "buckets": buckets,
+    }
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _render(merged: dict) -> str:
+    samples: Dict[str, List[str]] = {}
+    for name, labels, value in sorted(merged["counters"] + merged["gauges"]):
+        samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for name, labels, counts, total in sorted(merged["histograms"]):
+        lines = samples.setdefault(name, [])
+        bounds = merged["buckets"].get(name, ())
+        cumulative = 0
+        for bound, count in zip(list(bounds) + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    output = []
+    for name in sorted(samples):
+        kind, description = METRICS.get(name, ("untyped", name))
+        output.append(f"# HELP {name} {description}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(samples[name])
+    return "\n".join(output) + "\n"
+
+
+# ---- 采集器 ----
+
+def instrument_engine(engine):
+    """
+    统计连接池的借出次数，并登记连接池状态的采集器
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        registry.inc("db_pool_checkouts_total")
+
+    def collect():
+        pool = engine.pool
+        if hasattr(pool, "checkedout"):
+            yield "gauge", "db_pool_checked_out", (), pool.checkedout()
+            yield "gauge", "db_pool_overflow", (), max(0, pool.overflow())
+            yield "gauge", "db_pool_size", (), pool.size()
+
+    registry.register_collector(collect)
+
+
+def _collect_caches():
+    from SimpleCache import cache
+    from completion_cache import completion_cache
+
+    label = (("cache", "simple"),)
+    yield "counter", "cache_hits_total", label, cache.hits
+    yield "counter", "cache_misses_total", label, cache.misses
+    yield "gauge", "cache_entries", label, len(cache.cache)
+
+    stats = completion_cache.snapshot()
+    label = (("cache", "completion"),)
+    yield "counter", "cache_hits_total", label, stats["memory_hits"] + stats["disk_hits"]
+    yield "counter", "cache_misses_total", label, stats["misses"]
+    yield "gauge", "cache_entries", label, stats["entries"]
+
+
+def _collect_outbound():
+    from outbound_metrics import LATENCY_BUCKETS_MS, outbound_metrics
+
+    bounds = tuple(bound / 1000 for bound in LATENCY_BUCKETS_MS)
+    for item in outbound_metrics.snapshot():
+        labels = (("api_config", str(item["api_config_id"])), ("provider", item["provider"] or ""))
+        for code, count in item["status"].items():
+            yield "counter", "outbound_requests_total", labels + (("status", code),), count
+        for name, count in item["exceptions"].items():
+            yield "counter", "outbound_requests_total", labels + (("status", name),), count
+        counts = list(item["latency_buckets"].values())
+        yield "histogram", "outbound_request_duration_seconds", labels, (counts, item["latency_sum_ms"] / 1000, bounds)
+
+
+# ---- HTTP 中间件 ----
+
+_route_templates: Dict[object, str] = {}
+
+
+def _route_template(scope: Scope) -> str:
+    # 路由匹配后 scope 中有 endpoint；用路由模板作标签，避免每个ID一个时间序列
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "static"
+    template = _route_templates.get(endpoint)
+    if template is None:
+        for route in scope["app"].routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                template = route.path
+                break
+            if getattr(route, "app", None) is endpoint:
+                # 挂载的子应用（静态文件）使用挂载名
+                template = route.name or route.path
+                break
+        else:
+            template = "unknown"
+        _route_templates[endpoint] = template
+    return template
+
+
+class MetricsMiddleware:
+    """
+    统计每个HTTP请求的状态码和延迟的ASGI中间件
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = _route_template(scope)
+            method = scope["method"]
+            registry.inc("http_requests_total", (("method", method), ("route", route), ("status", str(status_code))))
+            registry.observe("http_request_duration_seconds", time.perf_counter() - started,
+                             (("method", method), ("route", route)))
+
+
+# 创建全局实例
+registry = MetricsRegistry()
+registry.register_collector(_collect_caches)
+registry.register_collector(_collect_outbound)
@@ -4,7 +4,7 @@
 该脚本负责初始化数据库表结构和添加缺失的列。
 在项目首次运行或更新时执行此脚本以确保数据库结构是最新的。
 """
-from sqlalchemy import create_engine, MetaData, Table
+from sqlalchemy import create_engine, MetaData, Table, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
 from models import Base, ApiConfig
@@ -32,6 +32,26 @@ def migrate_database():
     
     print("数据库迁移完成")
 
+def _ensure_column(conn, table: str, column: str, column_type: str):
+    """
+    检查表中是否存在指定列，不存在则添加
+
+    Args:
+        conn: 数据库连接
+        table (str): 表名
+        column (str): 列名
+        column_type (str): 列的SQL类型定义
+    """
+    try:
+        conn.execute(text(f"SELECT {column} FROM {table} LIMIT 1"))
+        print(f"{table}表的{column}列已存在")
+    except OperationalError as e:
+        if "no such column" in str(e):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+            print(f"已添加{table}表的{column}列")
+        else:
+            raise
+
 def add_missing_columns(engine):
     """
     添加可能缺失的列
@@ -42,59 +62,25 @@ def add_missing_columns(engine):
     Args:
         engine: SQLAlchemy数据库引擎
     """
-    # 检查api_configs表是否缺少新添加的列
     try:
-        # 尝试查询新添加的列来检查是否存在
-        with engine.connect() as conn:
-            # 检查music_genres列
-            try:
-                conn.execute("SELECT music_genres FROM api_configs LIMIT 1")
-                print("music_genres列已存在")
-            except OperationalError as e:
-                if "no such column" in str(e):
-                    # 添加music_genres列
-                    conn.execute("ALTER TABLE api_configs ADD COLUMN music_genres TEXT")
-                    print("已添加music_genres列")
-            
-            # 检查music_quality列
-            try:
-                conn.execute("SELECT music_quality FROM api_configs LIMIT 1")
-                print("music_quality列已存在")
-            except OperationalError as e:
-                if "no such column" in str(e):
-                    # 添加music_quality列
-                    conn.execute("ALTER TABLE api_configs ADD COLUMN music_quality VARCHAR(20)")
-                    print("已添加music_quality列")
+        with engine.begin() as conn:
+            # api_configs表的音乐相关列
+            _ensure_column(conn, "api_configs", "music_genres", "TEXT")
+            _ensure_column(conn, "api_configs", "music_quality", "VARCHAR(20)")
+            _ensure_column(conn, "api_configs", "music_region", "VARCHAR(10)")
+            _ensure_column(conn, "api_configs", "cache_ttl", "INTEGER DEFAULT 3600")
+            _ensure_column(conn, "api_configs", "timeout_seconds", "FLOAT")
             
-            # 检查music_region列
-            try:
-                conn.execute("SELECT music_region FROM api_configs LIMIT 1")
-                print("music_region列已存在")
-            except OperationalError as e:
-                if "no such column" in str(e):
-                    # 添加music_region列
-                    conn.execute("ALTER TABLE api_configs ADD COLUMN music_region VARCHAR(10)")
-                    print("已添加music_region列")
+            # admins表和users表的updated_at列
+            _ensure_column(conn, "admins", "updated_at", "DATETIME")
+            _ensure_column(conn, "users", "updated_at", "DATETIME")
             
-            # 检查admins表的updated_at列
-            try:
-                conn.execute("SELECT updated_at FROM admins LIMIT 1")
-                print("admins表的updated_at列已存在")
-            except OperationalError as e:
-                if "no such column" in str(e):
-                    # 添加updated_at列
-                    conn.execute("ALTER TABLE admins ADD COLUMN updated_at DATETIME")
-                    print("已添加admins表的updated_at列")
-                    
-            # 检查users表的updated_at列
-            try:
-                conn.execute("SELECT updated_at FROM users LIMIT 1")
-                print("users表的updated_at列已存在")
-            except OperationalError as e:
-                if "no such column" in str(e):
-                    # 添加updated_at列
-                    conn.execute("ALTER TABLE users ADD COLUMN updated_at DATETIME")
-                    print("已添加users表的updated_at列")
+            # 令牌版本列，用于按用户吊销全部令牌
+            _ensure_column(conn, "users", "token_version", "INTEGER DEFAULT 0")
+            _ensure_column(conn, "admins", "token_version", "INTEGER DEFAULT 0")
+
+            # 多进程部署时记录执行任务的工作进程
+            _ensure_column(conn, "jobs", "worker", "VARCHAR(32)")
                     
     except Exception as e:
         print(f"添加缺失列时出错: {e}")
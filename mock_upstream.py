@@ -0,0 +1,219 @@
+"""
+本地模拟上游服务
+
+模拟兼容 OpenAI 协议的 chat/completions 接口（普通和流式两种模式），
+用于在没有 DeepSeek 账号的情况下离线压测 /api/ai/chat 的出站路径
+（连接池、缓存、重试等）。可配置延迟分布、错误率和限流。
+
+用法：
+    python mock_upstream.py --port 8900 --latency-ms 300 --distribution lognormal --error-rate 0.01 --rps 50
+
+然后把 AI_CHAT_CONFIG_NAME 对应的 API 配置的 endpoint 指向
+http://127.0.0.1:8900/v1/chat/completions（可用 load_test.py --configure-db 完成）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 模拟参数，可通过环境变量或命令行参数设置
+settings = {
+    "latency_ms": float(os.getenv("MOCK_LATENCY_MS", 200)),       # 平均延迟（流式模式下为首个分片的延迟）
+    "jitter_ms": float(os.getenv("MOCK_JITTER_MS", 50)),          # 延迟的离散程度
+    "distribution": os.getenv("MOCK_DISTRIBUTION", "normal"),     # fixed/uniform/normal/lognormal/exponential
+    "chunk_delay_ms": float(os.getenv("MOCK_CHUNK_DELAY_MS", 20)),  # 流式模式下分片间隔
+    "chunks": int(os.getenv("MOCK_CHUNKS", 20)),                  # 流式模式下的分片数
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", 0)),         # 返回500的概率
+    "rps": float(os.getenv("MOCK_RPS", 0)),                       # 每秒允许的请求数，0为不限
+    "max_concurrency": int(os.getenv("MOCK_MAX_CONCURRENCY", 0)),  # 最大并发数，0为不限
+}
+
+app = FastAPI(title="Mock chat-completions upstream")
+
+
+class MockStats:
+    """
+    模拟服务的统计：请求数、错误数、限流数、并发峰值和客户端连接数
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.throttled = 0
+            self.active = 0
+            self.peak_active = 0
+            self.connections = set()  # 客户端 (host, port)，每个不同的源端口对应一个TCP连接
+            self._tokens = settings["rps"]
+            self._refilled = time.monotonic()
+
+    def enter(self, request: Request) -> str:
+        """
+        记录一个新请求，返回 ok / throttled / error
+        """
+        with self._lock:
+            self.requests += 1
+            if request.client:
+                self.connections.add((request.client.host, request.client.port))
+            if settings["rps"] > 0:
+                now = time.monotonic()
+                self._tokens = min(settings["rps"], self._tokens + (now - self._refilled) * settings["rps"])
+                self._refilled = now
+                if self._tokens < 1:
+                    self.throttled += 1
+                    return "throttled"
+                self._tokens -= 1
+            if settings["max_concurrency"] and self.active >= settings["max_concurrency"]:
+                self.throttled += 1
+                return "throttled"
+            if random.random() < settings["error_rate"]:
+                self.errors += 1
+                return "error"
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            return "ok"
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "active": self.active,
+                "peak_active": self.peak_active,
+                "connections": len(self.connections),
+                "settings": dict(settings),
+            }
+
+
+stats = MockStats()
+
+
+def sample_latency() -> float:
+    """
+    按配置的分布采样一次延迟（秒）
+    """
+    mean = settings["latency_ms"]
+    jitter = settings["jitter_ms"]
+    distribution = settings["distribution"]
+    if distribution == "uniform":
+        value = random.uniform(mean - jitter, mean + jitter)
+    elif distribution == "normal":
+        value = random.gauss(mean, jitter)
+    elif distribution == "lognormal":
+        # 长尾分布：中位数为 mean，jitter/mean 作为形状参数
+        sigma = jitter / mean if mean > 0 else 0
+        value = mean * random.lognormvariate(0, sigma)
+    elif distribution == "exponential":
+        value = random.expovariate(1 / mean) if mean > 0 else 0
+    else:
+        value = mean
+    return max(0.0, value) / 1000
+
+
+def _reply_text(messages: list) -> str:
+    content = messages[-1].get("content", "") if messages else ""
+    return f"模拟回复: {content}"
+
+
+@app.post("/v1/chat/completions")
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    outcome = stats.enter(request)
+    if outcome == "throttled":
+        return JSONResponse({"error": {"message": "rate limited"}}, status_code=429, headers={"Retry-After": "1"})
+    if outcome == "error":
+        return JSONResponse({"error": {"message": "mock upstream error"}}, status_code=500)
+
+    try:
+        body = await request.json()
+        text = _reply_text(body.get("messages") or [])
+        await asyncio.sleep(sample_latency())
+    except BaseException:
+        stats.leave()
+        raise
+
+    if not body.get("stream"):
+        stats.leave()
+        return {
+            "id": f"mock-{time.time_ns()}",
+            "object": "chat.completion",
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        }
+
+    async def generate():
+        try:
+            chunks = max(1, settings["chunks"])
+            size = max(1, -(-len(text) // chunks))
+            for i in range(0, len(text), size):
+                if i:
+                    await asyncio.sleep(settings["chunk_delay_ms"] / 1000)
+                delta = {"choices": [{"index": 0, "delta": {"content": text[i:i + size]}}]}
+                yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            stats.leave()
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.get("/mock/stats")
+def read_stats():
+    return stats.snapshot()
+
+
+@app.post("/mock/reset")
+def reset_stats():
+    stats.reset()
+    return stats.snapshot()
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地模拟 chat/completions 上游服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=settings["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=settings["jitter_ms"])
+    parser.add_argument("--distribution", default=settings["distribution"],
+                        choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--chunk-delay-ms", type=float, default=settings["chunk_delay_ms"])
+    parser.add_argument("--chunks", type=int, default=settings["chunks"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"])
+    parser.add_argument("--rps", type=float, default=settings["rps"], help="超过该速率返回429，0为不限")
+    parser.add_argument("--max-concurrency", type=int, default=settings["max_concurrency"],
+                        help="超过该并发数返回429，0为不限")
+    args = parser.parse_args()
+
+    settings.update(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        distribution=args.distribution,
+        chunk_delay_ms=args.chunk_delay_ms,
+        chunks=args.chunks,
+        error_rate=args.error_rate,
+        rps=args.rps,
+        max_concurrency=args.max_concurrency,
+    )
+    stats.reset()
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
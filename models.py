@@ -1,13 +1,12 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, Index
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey, Text, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
-from passlib.context import CryptContext
+from password_hashing import pwd_context
 import datetime  # ✅ 已经导入
 created_at = Column(DateTime, default=func.now())
 updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 class User(Base):
     """
@@ -24,6 +23,7 @@ class User(Base):
     hashed_password = Column(String)
     role = Column(String, default="user")
     is_active = Column(Boolean, default=True)
+    token_version = Column(Integer, default=0)  # 令牌版本，递增后旧令牌全部失效
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
@@ -111,6 +111,7 @@ class Admin(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     role = Column(String, default="admin")  # admin, superadmin
+    token_version = Column(Integer, default=0)  # 令牌版本，递增后旧令牌全部失效
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
     
@@ -160,6 +161,8 @@ class ApiConfig(Base):
     category = Column(String(50), nullable=True)   # API类别
     max_requests = Column(Integer, default=1000)   # 每小时最大请求数
     priority = Column(Integer, default=2)          # 优先级
+    cache_ttl = Column(Integer, default=3600)      # 响应缓存有效期（秒），0表示不缓存
+    timeout_seconds = Column(Float, nullable=True) # 调用超时（秒），为空时使用全局默认值
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     
@@ -228,4 +231,58 @@ class BiometricData(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
     
     # 关系定义
-    user = relationship("User", back_populates="biometric_data")
\ No newline at end of file
+    user = relationship("User", back_populates="biometric_data")
+
+class RevokedToken(Base):
+    """
+    已吊销令牌模型
+
+    记录被吊销的单个令牌(jti)，或某个主体(subject)的最低有效令牌版本。
+    """
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String(64), unique=True, index=True, nullable=True)
+    subject = Column(String(64), index=True, nullable=True)  # 例如 user:1, admin:2
+    token_version = Column(Integer, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class Job(Base):
+    """
+    异步任务模型
+
+    耗时较长的AI对话或外部API调用以任务形式提交，由后台工作协程执行，
+    结果保存到 expires_at 后清理。
+    """
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True, index=True)   # uuid4 hex
+    kind = Column(String(20))                               # chat 或 proxy
+    api_config_id = Column(Integer, ForeignKey("api_configs.id"), index=True)
+    priority = Column(Integer, default=2)                   # 取自 ApiConfig.priority
+    status = Column(String(20), default="queued", index=True)  # queued/running/succeeded/failed
+    payload = Column(JSON, nullable=True)
+    result = Column(Text, nullable=True)
+    status_code = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    owner = Column(String(64), index=True)                  # 例如 user:1, admin:2
+    worker = Column(String(32), nullable=True, index=True)  # 负责执行的工作进程（pid），为空表示无人认领
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+
+class TableVersion(Base):
+    """
+    表版本号模型
+
+    被跟踪的表每次在事务中发生变更时，版本号在同一事务中加一，
+    用于生成列表和实体端点的ETag（见 etags.py）。
+    """
+    __tablename__ = "table_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,131 @@
+"""
+出站调用指标模块
+
+按 ApiConfig（id、名称、提供商）统计每次出站调用：延迟直方图、状态码计数、
+异常类型计数以及请求/响应字节数。直方图使用固定的桶边界，每次记录只需一次二分查找
+和几次整数加法，开销很低；分位数由桶边界近似得出。
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Optional
+
+# 延迟直方图的桶上界（毫秒），最后一个桶收集超过最大上界的样本
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class ConfigMetrics:
+    """
+    单个API配置的出站指标
+    """
+    __slots__ = ("config_id", "name", "provider", "buckets", "latency_sum_ms", "count",
+                 "status", "exceptions", "bytes_sent", "bytes_received")
+
+    def __init__(self, config_id: int, name: Optional[str], provider: Optional[str]):
+        self.config_id = config_id
+        self.name = name
+        self.provider = provider
+        self.buckets = array("Q", [0] * (len(LATENCY_BUCKETS_MS) + 1))
+        self.latency_sum_ms = 0.0
+        self.count = 0
+        self.status: Dict[int, int] = {}
+        self.exceptions: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def quantile(self, q: float):
+        """
+        由直方图近似分位数，返回所在桶的上界（毫秒）；落在最后一个桶时返回 "+Inf"
+        """
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else "+Inf"
+        return "+Inf"
+
+    def snapshot(self) -> dict:
+        return {
+            "api_config_id": self.config_id,
+            "name": self.name,
+            "provider": self.provider,
+            "requests": self.count,
+            "avg_latency_ms": round(self.latency_sum_ms / self.count, 2) if self.count else None,
+            "latency_sum_ms": self.latency_sum_ms,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "latency_buckets": {
+                (f"le_{bound}" if i < len(LATENCY_BUCKETS_MS) else "+Inf"): n
+                for i, (bound, n) in enumerate(zip(LATENCY_BUCKETS_MS + (None,), self.buckets))
+            },
+            "status": {str(code): n for code, n in sorted(self.status.items())},
+            "exceptions": dict(self.exceptions),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+class OutboundMetrics:
+    """
+    出站指标登记表
+    """
+    def __init__(self):
+        self._configs: Dict[int, ConfigMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, api_config) -> ConfigMetrics:
+        metrics = self._configs.get(api_config.id)
+        if metrics is None:
+            metrics = ConfigMetrics(api_config.id, api_config.name, api_config.provider)
+            self._configs[api_config.id] = metrics
+        return metrics
+
+    def record(self, api_config, latency_seconds: float, status_code: Optional[int] = None,
+               exception: Optional[BaseException] = None, bytes_sent: int = 0, bytes_received: int = 0):
+        """
+        记录一次出站调用
+
+        Args:
+            api_config: 调用所属的API配置
+            latency_seconds (float): 从发出请求到收到响应头（或出错）的耗时
+            status_code (Optional[int]): 响应状态码，出错时为None
+            exception (Optional[BaseException]): 调用抛出的异常
+            bytes_sent (int): 请求体字节数
+            bytes_received (int): 响应体字节数
+        """
+        latency_ms = latency_seconds * 1000
+        index = bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+        with self._lock:
+            metrics = self._get(api_config)
+            metrics.buckets[index] += 1
+            metrics.latency_sum_ms += latency_ms
+            metrics.count += 1
+            if status_code is not None:
+                metrics.status[status_code] = metrics.status.get(status_code, 0) + 1
+            if exception is not None:
+                name = type(exception).__name__
+                metrics.exceptions[name] = metrics.exceptions.get(name, 0) + 1
+            metrics.bytes_sent += bytes_sent
+            metrics.bytes_received += bytes_received
+
+    def add_received(self, api_config, nbytes: int):
+        """
+        补记流式响应读取完毕后的响应字节数
+        """
+        with self._lock:
+            self._get(api_config).bytes_received += nbytes
+
+    def snapshot(self) -> list:
+        """
+        返回全部API配置的指标
+        """
+        with self._lock:
+            return [metrics.snapshot() for metrics in self._configs.values()]
+
+
+# 创建全局实例
+outbound_metrics = OutboundMetrics()
@@ -0,0 +1,172 @@
+"""
+密码哈希模块
+
+全项目共用的 bcrypt 哈希上下文。bcrypt 成本因子通过环境变量 BCRYPT_ROUNDS 配置，
+应使用本模块的校准命令在部署主机上测出合适的值：
+
+    python password_hashing.py --target-ms 250
+
+校准命令会对每个成本因子做基准测试，输出单次哈希耗时和单核/全部核心的吞吐量报告，
+并推荐不超过目标耗时的最大成本因子。修改 BCRYPT_ROUNDS 后，
+旧参数生成的哈希会在用户下次登录成功时透明地重新哈希。
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+from metrics import PASSWORD_VERIFY_BUCKETS, registry
+
+# 本模块经 crude 先于 auth 导入，需自行加载 .env，否则 .env 中的 BCRYPT_ROUNDS 不生效
+load_dotenv()
+
+# bcrypt 成本因子，每加1耗时翻倍
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
+# 密码哈希上下文；最小/最大轮数与默认值一致，参数变化后 needs_update 会标记旧哈希
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def hash_password(password: str) -> str:
+    """
+    对密码进行哈希处理
+
+    Args:
+        password (str): 明文密码
+
+    Returns:
+        str: 哈希后的密码
+    """
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """
+    验证明文密码与哈希密码是否匹配
+
+    Args:
+        plain_password (str): 明文密码
+        hashed_password (str): 哈希密码
+
+    Returns:
+        bool: 密码匹配返回True，否则返回False
+    """
+    if not hashed_password:
+        return False
+    started = time.perf_counter()
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    finally:
+        registry.observe("password_verify_duration_seconds", time.perf_counter() - started,
+                         buckets=PASSWORD_VERIFY_BUCKETS)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    验证密码，并在哈希参数过期时返回新的哈希
+
+    Args:
+        plain_password (str): 明文密码
+        hashed_password (str): 哈希密码
+
+    Returns:
+        Tuple[bool, Optional[str]]: (是否匹配, 需要更新时的新哈希，否则为None)
+    """
+    if not hashed_password:
+        return False, None
+    started = time.perf_counter()
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    finally:
+        registry.observe("password_verify_duration_seconds", time.perf_counter() - started,
+                         buckets=PASSWORD_VERIFY_BUCKETS)
+
+
+def benchmark(rounds_range: range, samples: int = 5) -> List[dict]:
+    """
+    对不同成本因子的 bcrypt 哈希做基准测试
+
+    Args:
+        rounds_range (range): 要测试的成本因子范围
+        samples (int): 每个成本因子的采样次数
+
+    Returns:
+        List[dict]: 每个成本因子的耗时（中位数，毫秒）和吞吐量
+    """
+    cores = os.cpu_count() or 1
+    results = []
+    for rounds in rounds_range:
+        context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            context.hash("calibration-password")
+            timings.append(time.perf_counter() - start)
+        median = statistics.median(timings)
+        results.append({
+            "rounds": rounds,
+            "latency_ms": median * 1000,
+            "per_core_per_second": 1 / median,
+            "all_cores_per_second": cores / median,
+        })
+    return results
+
+
+def calibrate(target_ms: float, results: List[dict]) -> int:
+    """
+    选择耗时不超过目标值的最大成本因子
+
+    Args:
+        target_ms (float): 单次哈希的目标耗时（毫秒）
+        results (List[dict]): benchmark() 的结果
+
+    Returns:
+        int: 推荐的成本因子
+    """
+    suitable = [r["rounds"] for r in results if r["latency_ms"] <= target_ms]
+    return max(suitable) if suitable else min(r["rounds"] for r in results)
+
+
+def format_report(results: List[dict], recommended: int) -> str:
+    """
+    生成基准测试报告
+    """
+    lines = [
+        f"bcrypt 基准测试（CPU核心数: {os.cpu_count() or 1}，当前 BCRYPT_ROUNDS={BCRYPT_ROUNDS}）",
+        f"{'rounds':>6}  {'耗时(ms)':>10}  {'单核登录/秒':>12}  {'全核登录/秒':>12}",
+    ]
+    for r in results:
+        marker = "  <- 推荐" if r["rounds"] == recommended else ""
+        lines.append(
+            f"{r['rounds']:>6}  {r['latency_ms']:>10.1f}  "
+            f"{r['per_core_per_second']:>12.1f}  {r['all_cores_per_second']:>12.1f}{marker}"
+        )
+    lines.append(f"\n请在 .env 中设置 BCRYPT_ROUNDS={recommended}")
+    return "\n".join(lines)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="在当前主机上校准 bcrypt 成本因子")
+    parser.add_argument("--target-ms", type=float, default=250, help="单次哈希的目标耗时（毫秒）")
+    parser.add_argument("--min-rounds", type=int, default=8)
+    parser.add_argument("--max-rounds", type=int, default=15)
+    parser.add_argument("--samples", type=int, default=5, help="每个成本因子的采样次数")
+    args = parser.parse_args()
+
+    results = benchmark(range(args.min_rounds, args.max_rounds + 1), args.samples)
+    print(format_report(results, calibrate(args.target_ms, results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+API权限引擎
+
+将 api_permissions 表物化为每个用户的位图：第 N 位表示用户对 id 为 N 的 ApiConfig 的权限。
+公开(is_public)的配置单独存为一个位图，在检查访问权限时合并，
+因此 can_access(user_id, config_id) 是一次字典查找加一次位运算，不需要查询数据库。
+
+位图在启动时全量加载，之后由 crude 中的 ApiPermission / ApiConfig 增删改函数增量维护；
+多进程部署时每个进程的后台线程按 PERMISSION_RELOAD_SECONDS 定期全量重建，以获取其他进程的修改，
+权限检查本身只读内存。重建期间的增量修改会记录下来，在换入新位图时重放，不会丢失。
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import ApiConfig, ApiPermission
+
+logger = logging.getLogger(__name__)
+
+PERMISSION_RELOAD_SECONDS = float(os.getenv("PERMISSION_RELOAD_SECONDS", 60))
+
+
+class PermissionEngine:
+    """
+    基于位图的API权限引擎
+    """
+    def __init__(self):
+        self._access: Dict[int, int] = {}   # user_id -> 可访问配置位图
+        self._modify: Dict[int, int] = {}   # user_id -> 可修改配置位图
+        self._public = 0                    # 公开配置位图
+        # user_id -> {permission_id: (api_config_id, can_access, can_modify)}，用于增量重算
+        self._grants: Dict[int, Dict[int, Tuple[int, bool, bool]]] = {}
+        self._owners: Dict[int, int] = {}   # permission_id -> user_id
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._journal = None                # 全量重建期间的增量修改，换入新位图后重放
+        self._reloader = None
+        self._stop = threading.Event()
+
+    def load(self, db: Session):
+        """
+        从数据库全量构建位图
+        """
+        with self._lock:
+            self._journal = []
+        try:
+            public = 0
+            for (config_id,) in db.query(ApiConfig.id).filter(ApiConfig.is_public == True).all():
+                public |= 1 << config_id
+            rows = db.query(
+                ApiPermission.id, ApiPermission.user_id, ApiPermission.api_config_id,
+                ApiPermission.can_access, ApiPermission.can_modify
+            ).all()
+        except Exception:
+            with self._lock:
+                self._journal = None
+            raise
+
+        grants: Dict[int, Dict[int, Tuple[int, bool, bool]]] = {}
+        owners: Dict[int, int] = {}
+        access: Dict[int, int] = {}
+        modify: Dict[int, int] = {}
+        for permission_id, user_id, config_id, can_access, can_modify in rows:
+            if user_id is None or config_id is None:
+                continue
+            grants.setdefault(user_id, {})[permission_id] = (config_id, bool(can_access), bool(can_modify))
+            owners[permission_id] = user_id
+            if can_access:
+                access[user_id] = access.get(user_id, 0) | (1 << config_id)
+            if can_modify:
+                modify[user_id] = modify.get(user_id, 0) | (1 << config_id)
+
+        with self._lock:
+            self._public = public
+            self._grants, self._owners = grants, owners
+            self._access, self._modify = access, modify
+            # 读取快照之后提交的修改可能不在快照中；这些操作都是幂等的赋值，重放一遍即可
+            journal, self._journal = self._journal, None
+            for operation, args in journal:
+                operation(*args)
+            self._loaded_at = time.monotonic()
+
+    def _reload_loop(self):
+        while not self._stop.wait(PERMISSION_RELOAD_SECONDS):
+            db = SessionLocal()
+            try:
+                self.load(db)
+            except Exception as e:
+                logger.error(f"重新加载API权限失败: {e}")
+            finally:
+                db.close()
+
+    def start_reloading(self):
+        """
+        启动定期全量重建的后台线程（应用启动时调用）
+        """
+        if self._reloader is None:
+            self._stop.clear()
+            self._reloader = threading.Thread(target=self._reload_loop, name="permission-reload", daemon=True)
+            self._reloader.start()
+
+    def stop_reloading(self):
+        self._stop.set()
+        self._reloader = None
+
+    def _update(self, operation, *args):
+        # 调用方持有 _lock
+        operation(*args)
+        if self._journal is not None:
+            self._journal.append((operation, args))
+
+    def _recompute(self, user_id: int, config_id: int):
+        # 同一用户对同一配置可能有多条授权记录，任一允许即允许
+        grants = self._grants.get(user_id, {}).values()
+        bit = 1 << config_id
+        can_access = any(a for c, a, _ in grants if c == config_id)
+        can_modify = any(m for c, _, m in grants if c == config_id)
+        access = self._access.get(user_id, 0)
+        modify = self._modify.get(user_id, 0)
+        self._access[user_id] = access | bit if can_access else access & ~bit
+        self._modify[user_id] = modify | bit if can_modify else modify & ~bit
+
+    def _remove_grant(self, permission_id: int):
+        user_id = self._owners.pop(permission_id, None)
+        if user_id is None:
+            return
+        previous = self._grants.get(user_id, {}).pop(permission_id, None)
+        if previous is not None:
+            self._recompute(user_id, previous[0])
+
+    def _set_grant(self, permission_id: int, user_id, config_id, can_access: bool, can_modify: bool):
+        self._remove_grant(permission_id)
+        if user_id is None or config_id is None:
+            return
+        self._grants.setdefault(user_id, {})[permission_id] = (config_id, can_access, can_modify)
+        self._owners[permission_id] = user_id
+        self._recompute(user_id, config_id)
+
+    def _set_public(self, config_id: int, is_public: bool):
+        bit = 1 << config_id
+        self._public = self._public | bit if is_public else self._public & ~bit
+
+    def _remove_config(self, config_id: int):
+        mask = ~(1 << config_id)
+        self._public &= mask
+        for user_id in list(self._access):
+            self._access[user_id] &= mask
+        for user_id in list(self._modify):
+            self._modify[user_id] &= mask
+        for grants in self._grants.values():
+            for permission_id in [pid for pid, grant in grants.items() if grant[0] == config_id]:
+                del grants[permission_id]
+                self._owners.pop(permission_id, None)
+
+    def apply_permission(self, permission: ApiPermission):
+        """
+        新增或更新一条授权记录后调用
+        """
+        with self._lock:
+            self._update(self._set_grant, permission.id, permission.user_id, permission.api_config_id,
+                         bool(permission.can_access), bool(permission.can_modify))
+
+    def remove_permission(self, permission_id: int):
+        """
+        删除一条授权记录后调用
+        """
+        with self._lock:
+            self._update(self._remove_grant, permission_id)
+
+    def apply_config(self, api_config: ApiConfig):
+        """
+        新增或更新API配置后调用，同步公开位
+        """
+        with self._lock:
+            self._update(self._set_public, api_config.id, bool(api_config.is_public))
+
+    def remove_config(self, config_id: int):
+        """
+        删除API配置后调用，清除所有用户在该配置上的位和授权记录
+        """
+        with self._lock:
+            self._update(self._remove_config, config_id)
+
+    def can_access(self, user_id: int, config_id: int) -> bool:
+        """
+        检查用户是否可以访问API配置（公开配置对所有用户可见）
+        """
+        return bool(((self._access.get(user_id, 0) | self._public) >> config_id) & 1)
+
+    def can_modify(self, user_id: int, config_id: int) -> bool:
+        """
+        检查用户是否可以修改API配置
+        """
+        return bool((self._modify.get(user_id, 0) >> config_id) & 1)
+
+    def accessible_config_ids(self, user_id: int) -> List[int]:
+        """
+        返回用户可访问的全部API配置ID
+        """
+        bits = self._access.get(user_id, 0) | self._public
+        ids = []
+        while bits:
+            low = bits & -bits
+            ids.append(low.bit_length() - 1)
+            bits ^= low
+        return ids
+
+
+# 创建全局实例
+permission_engine = PermissionEngine()
@@ -0,0 +1,165 @@
+"""
+按请求统计SQL查询模块
+
+通过 SQLAlchemy 的 before_cursor_execute/after_cursor_execute 事件记录每条语句的耗时，
+归集到当前请求（ContextVar，线程池和写队列中执行的查询同样计入发起它的请求）：
+    - 查询次数、数据库总耗时、行数（ORM加载的对象数 + 增删改影响的行数）；
+    - 响应头 X-Query-Count 和 Server-Timing（db、app 两项，可在浏览器开发者工具中查看）；
+    - 同一条语句在一个请求中执行超过 QUERY_REPEAT_THRESHOLD 次时记录警告（典型的 N+1 查询）；
+    - 耗时超过 SLOW_QUERY_MS 的语句写入慢查询日志，绑定参数只记录类型，不记录值。
+
+慢查询日志使用 "slow_query" 记录器，设置 SLOW_QUERY_LOG_FILE 时同时写入该文件。
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from database import Base
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_query")
+
+QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", "true").lower() == "true"
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 10))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE")
+
+if SLOW_QUERY_LOG_FILE:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG_FILE, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(asctime)s [%(process)d] %(message)s"))
+    slow_query_logger.addHandler(_handler)
+    slow_query_logger.setLevel(logging.WARNING)
+
+
+class RequestQueries:
+    """
+    一个请求中执行的查询
+    """
+    __slots__ = ("count", "seconds", "rows", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements: Counter = Counter()
+
+    def merge(self, other: "RequestQueries"):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.rows += other.rows
+        self.statements.update(other.statements)
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+
+def current() -> Optional[RequestQueries]:
+    """
+    当前请求的查询统计；不在请求中时返回None
+    """
+    return _current.get()
+
+
+def _redact(parameters) -> str:
+    # 只保留参数的类型，避免把密码哈希、API密钥等写进日志
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: <{type(value).__name__}>" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            return f"[{len(parameters)} rows of {_redact(parameters[0])}]"
+        return "(" + ", ".join(f"<{type(value).__name__}>" for value in parameters) + ")"
+    return "<none>" if parameters is None else f"<{type(parameters).__name__}>"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 开始时间记在本次执行的 context 上：语句出错时 after_cursor_execute 不会执行，随 context 一起丢弃；
+    # 没有执行上下文的内部语句（如主键默认值生成）不计时
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        stats.statements[statement] += 1
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            f"慢查询 {elapsed * 1000:.1f}ms: {' '.join(statement.split())} params={_redact(parameters)}"
+        )
+
+
+@event.listens_for(Base, "load", propagate=True)
+def _on_load(target, context):
+    stats = _current.get()
+    if stats is not None:
+        stats.rows += 1
+
+
+def _server_timing(stats: RequestQueries, total: float) -> str:
+    return (f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries, {stats.rows} rows", '
+            f"app;dur={total * 1000:.1f}")
+
+
+def _report_repeats(scope: Scope, stats: RequestQueries):
+    for statement, count in stats.statements.items():
+        if count > QUERY_REPEAT_THRESHOLD:
+            logger.warning(
+                f"{scope['method']} {scope['path']} 中同一语句执行了 {count} 次（可能是N+1查询）: "
+                f"{' '.join(statement.split())[:300]}"
+            )
+
+
+class QueryStatsMiddleware:
+    """
+    为每个HTTP请求收集查询统计并写入响应头的ASGI中间件
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not QUERY_STATS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        # /api/batch 的子请求单独统计，结束后再计入批量请求本身
+        parent = _current.get()
+        stats = RequestQueries()
+        token = _current.set(stats)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Query-Count"] = str(stats.count)
+                headers.append("Server-Timing", _server_timing(stats, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if parent is not None:
+                parent.merge(stats)
+            else:
+                _report_repeats(scope, stats)
@@ -0,0 +1,153 @@
+"""
+API调用配额模块
+
+按 ApiConfig.max_requests（每小时最大请求数）跟踪每个配置最近一小时的调用次数。
+每个配置使用一个环形缓冲区：把一小时分成 QUOTA_BUCKETS 个时间片，
+每个时间片保存计数和所属的时间片编号，过期的时间片在写入时被覆盖。
+
+配置接近配额时，调用方应切换到同一 category 中按 priority 排序的下一个可用配置，
+而不是等上游返回 429。
+
+计数只在进程内保存。serve.py 以多个工作进程运行时设置 QUOTA_WORKERS 为工作进程数，
+每个进程只使用 max_requests / QUOTA_WORKERS 的份额，合计不超过配置的配额；
+上游返回429后的封锁同样只在收到429的进程内生效。
+"""
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from models import ApiConfig
+
+QUOTA_WINDOW_SECONDS = int(os.getenv("QUOTA_WINDOW_SECONDS", 3600))
+QUOTA_BUCKETS = int(os.getenv("QUOTA_BUCKETS", 60))
+# 使用量达到 max_requests 的该比例时视为接近配额
+QUOTA_HEADROOM = float(os.getenv("QUOTA_HEADROOM", 0.95))
+# 共享同一配额的进程数，每个进程只使用 1/QUOTA_WORKERS 的配额
+QUOTA_WORKERS = max(1, int(os.getenv("QUOTA_WORKERS", 1)))
+
+
+class SlidingWindowQuota:
+    """
+    基于环形缓冲区的滑动窗口计数器
+    """
+    def __init__(self, window_seconds: int = QUOTA_WINDOW_SECONDS, buckets: int = QUOTA_BUCKETS,
+                 workers: int = QUOTA_WORKERS):
+        self.buckets = buckets
+        self.workers = workers
+        self.bucket_seconds = window_seconds / buckets
+        self._windows: Dict[int, Tuple[array, array]] = {}  # config_id -> (计数, 时间片编号)
+        self._blocked_until: Dict[int, float] = {}          # 上游返回429后的封锁截止时间
+        self._lock = threading.Lock()
+
+    def _epoch(self, now: float) -> int:
+        return int(now / self.bucket_seconds)
+
+    def _window(self, config_id: int) -> Tuple[array, array]:
+        window = self._windows.get(config_id)
+        if window is None:
+            window = (array("I", [0] * self.buckets), array("q", [-1] * self.buckets))
+            self._windows[config_id] = window
+        return window
+
+    def record(self, config_id: int, now: Optional[float] = None):
+        """
+        记录一次调用
+        """
+        epoch = self._epoch(now or time.time())
+        index = epoch % self.buckets
+        with self._lock:
+            counts, epochs = self._window(config_id)
+            if epochs[index] != epoch:
+                epochs[index] = epoch
+                counts[index] = 0
+            counts[index] += 1
+
+    def usage(self, config_id: int, now: Optional[float] = None) -> int:
+        """
+        返回窗口内的调用次数
+        """
+        oldest = self._epoch(now or time.time()) - self.buckets
+        with self._lock:
+            window = self._windows.get(config_id)
+            if window is None:
+                return 0
+            counts, epochs = window
+            return sum(c for c, e in zip(counts, epochs) if e > oldest)
+
+    def block(self, config_id: int, seconds: float):
+        """
+        上游返回429时调用，在 seconds 秒内视该配置为配额耗尽
+        """
+        with self._lock:
+            self._blocked_until[config_id] = time.time() + seconds
+
+    def limit(self, api_config: ApiConfig) -> float:
+        """
+        本进程可使用的每小时请求数，0 表示不限制
+        """
+        return (api_config.max_requests or 0) / self.workers
+
+    def is_available(self, api_config: ApiConfig, headroom: float = QUOTA_HEADROOM) -> bool:
+        """
+        检查配置是否仍有配额余量
+        """
+        if self._blocked_until.get(api_config.id, 0) > time.time():
+            return False
+        limit = self.limit(api_config)
+        if not limit:
+            return True
+        return self.usage(api_config.id) < limit * headroom
+
+    def retry_after(self, config_id: int) -> int:
+        """
+        估算配置恢复可用所需的秒数：最早的非空时间片滑出窗口的时间
+        """
+        now = time.time()
+        blocked = self._blocked_until.get(config_id, 0) - now
+        oldest = self._epoch(now) - self.buckets
+        with self._lock:
+            window = self._windows.get(config_id)
+            live = [e for c, e in zip(*window) if c and e > oldest] if window else []
+        expires = (min(live) + self.buckets) * self.bucket_seconds - now if live else 0
+        return max(1, int(max(blocked, expires)) + 1)
+
+
+# 创建全局实例
+request_quota = SlidingWindowQuota()
+
+
+def get_failover_candidates(db: Session, primary: ApiConfig) -> List[ApiConfig]:
+    """
+    返回主配置及同类别的其他激活配置，按 priority 从高到低排序（3=高，1=低）
+    """
+    if not primary.category:
+        return [primary]
+    others = db.query(ApiConfig).filter(
+        ApiConfig.category == primary.category,
+        ApiConfig.is_active == True,
+        ApiConfig.id != primary.id
+    ).order_by(ApiConfig.priority.desc(), ApiConfig.id).all()
+    return [primary] + others
+
+
+def select_available_config(candidates: List[ApiConfig]) -> ApiConfig:
+    """
+    按顺序选择第一个仍有配额余量的配置
+
+    Raises:
+        HTTPException: 全部配置都接近配额时抛出429错误，带 Retry-After 头
+    """
+    for api_config in candidates:
+        if request_quota.is_available(api_config):
+            return api_config
+    retry_after = min(request_quota.retry_after(c.id) for c in candidates)
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="所有可用的API配置均已达到调用配额",
+        headers={"Retry-After": str(retry_after)},
+    )
@@ -0,0 +1,167 @@
+"""
+登录限流模块
+
+使用令牌桶算法按客户端IP和用户名限制 /login、/api/token、/register 的请求频率，
+防止撞库请求把服务器CPU耗尽在 bcrypt 计算上。
+
+令牌桶保存在固定大小的槽位数组中（每个槽位：键指纹、剩余令牌数、上次更新时间），
+按需惰性补充令牌，不需要后台线程。设置 RATE_LIMIT_SHARED_FILE 后，
+槽位数组映射到本地文件，多个工作进程共享同一组令牌桶。
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+
+try:
+    import fcntl  # 仅 Unix 可用，用于多进程共享时加文件锁
+except ImportError:
+    fcntl = None
+
+# 单个槽位：键指纹(uint64)、剩余令牌数(double)、上次更新时间(double)
+SLOT = struct.Struct("<Qdd")
+# 发生哈希冲突时最多探测的相邻槽位数
+PROBES = 4
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_SLOTS = int(os.getenv("RATE_LIMIT_SLOTS", 65536))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", 20))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", 20))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", 5))
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", 5))
+RATE_LIMIT_SHARED_FILE = os.getenv("RATE_LIMIT_SHARED_FILE")
+# 仅在部署于可信反向代理之后时开启，否则客户端可伪造 X-Forwarded-For
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+
+
+class TokenBucketLimiter:
+    """
+    基于槽位数组的令牌桶限流器
+
+    Args:
+        burst (float): 桶容量，即允许的突发请求数
+        refill_per_second (float): 每秒补充的令牌数
+        slots (int): 槽位数量，决定可同时跟踪的键数量
+        shared_file (Optional[str]): 共享槽位文件路径，为空时只在进程内生效
+    """
+    def __init__(self, burst: float, refill_per_second: float, slots: int = RATE_LIMIT_SLOTS,
+                 shared_file: Optional[str] = None):
+        self.burst = burst
+        self.refill_per_second = refill_per_second
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._file = None
+        size = slots * SLOT.size
+        if shared_file:
+            self._file = open(shared_file, "a+b")
+            if os.path.getsize(shared_file) < size:
+                self._file.truncate(size)
+            self._buf = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._buf = bytearray(size)
+
+    @staticmethod
+    def _fingerprint(key: str) -> int:
+        # 指纹为 0 表示空槽位，因此强制最低位为 1
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") | 1
+
+    def _locate(self, fingerprint: int, now: float) -> int:
+        """
+        查找键所在的槽位；找不到时选择空槽位或最久未使用的槽位
+        """
+        base = fingerprint % self.slots
+        victim, victim_updated = -1, math.inf
+        for i in range(PROBES):
+            index = (base + i) % self.slots
+            fp, _, updated = SLOT.unpack_from(self._buf, index * SLOT.size)
+            if fp == fingerprint:
+                return index
+            if fp == 0:
+                updated = -math.inf
+            if updated < victim_updated:
+                victim, victim_updated = index, updated
+        SLOT.pack_into(self._buf, victim * SLOT.size, fingerprint, self.burst, now)
+        return victim
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        尝试从键对应的桶中取出令牌
+
+        Args:
+            key (str): 限流键，例如客户端IP或用户名
+            cost (float): 本次请求消耗的令牌数
+
+        Returns:
+            float: 0 表示允许；否则为需要等待的秒数
+        """
+        fingerprint = self._fingerprint(key)
+        with self._lock:
+            if self._file is not None and fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                index = self._locate(fingerprint, now)
+                offset = index * SLOT.size
+                _, tokens, updated = SLOT.unpack_from(self._buf, offset)
+                tokens = min(self.burst, tokens + max(0.0, now - updated) * self.refill_per_second)
+                if tokens >= cost:
+                    SLOT.pack_into(self._buf, offset, fingerprint, tokens - cost, now)
+                    return 0.0
+                SLOT.pack_into(self._buf, offset, fingerprint, tokens, now)
+                return (cost - tokens) / self.refill_per_second
+            finally:
+                if self._file is not None and fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+
+
+def _create_limiter(name: str, burst: float, per_minute: float) -> TokenBucketLimiter:
+    shared_file = f"{RATE_LIMIT_SHARED_FILE}.{name}" if RATE_LIMIT_SHARED_FILE else None
+    return TokenBucketLimiter(burst, per_minute / 60.0, shared_file=shared_file)
+
+
+# 创建全局实例
+ip_limiter = _create_limiter("ip", RATE_LIMIT_IP_BURST, RATE_LIMIT_IP_PER_MINUTE)
+username_limiter = _create_limiter("user", RATE_LIMIT_USER_BURST, RATE_LIMIT_USER_PER_MINUTE)
+
+
+def get_client_ip(request: Request) -> str:
+    """
+    获取客户端IP，仅在信任代理时使用 X-Forwarded-For
+    """
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def enforce_login_rate_limit(request: Request, username: Optional[str] = None):
+    """
+    对认证类接口执行限流检查
+
+    先检查客户端IP的令牌桶，再检查用户名的令牌桶，任一耗尽即拒绝。
+
+    Args:
+        request (Request): 当前请求
+        username (Optional[str]): 登录或注册使用的用户名
+
+    Raises:
+        HTTPException: 超出限制时抛出429错误，并带有 Retry-After 头
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    wait = ip_limiter.acquire(f"ip:{get_client_ip(request)}")
+    if not wait and username:
+        wait = username_limiter.acquire(f"user:{username.strip().lower()}")
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="请求过于频繁，请稍后重试",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
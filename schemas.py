@@ -97,6 +97,8 @@ class ApiConfigBase(BaseModel):
     category: Optional[str] = None
     max_requests: Optional[int] = 1000
     priority: Optional[int] = 2
+    cache_ttl: Optional[int] = 3600
+    timeout_seconds: Optional[float] = None
     # 音乐特定字段
     music_genres: Optional[str] = None
     music_quality: Optional[str] = None
@@ -182,11 +184,65 @@ class BiometricData(BiometricDataBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
 
 class TokenData(BaseModel):
     username: Optional[str] = None
     role: Optional[str] = None
+    # 以下字段直接来自令牌声明，用于免查库鉴权
+    user_id: Optional[int] = None
+    kind: Optional[str] = "user"  # user 或 admin，决定主体所在的表
+    is_active: Optional[bool] = True
+    token_version: Optional[int] = 0
+    jti: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class RevokeTokenRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
 class LoginRequest(BaseModel):
     username: str
-    password: str
\ No newline at end of file
+    password: str
+
+# 异步任务相关
+class JobCreate(BaseModel):
+    kind: str = "chat"                      # chat: AI对话; proxy: 调用指定API配置
+    message: Optional[str] = None           # chat 任务的用户消息
+    api_config_id: Optional[int] = None     # proxy 任务调用的API配置
+    params: Optional[Dict[str, Any]] = None  # proxy 任务的查询参数
+    body: Optional[Any] = None              # proxy 任务的JSON请求体
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str
+    api_config_id: Optional[int] = None
+    priority: Optional[int] = None
+    result: Optional[str] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+# 批量请求相关
+class BatchItem(BaseModel):
+    method: str = "GET"
+    path: str                                # 例如 /api/users?limit=20
+    body: Optional[Any] = None               # JSON请求体
+    headers: Optional[Dict[str, str]] = None  # 额外的请求头，例如 If-None-Match
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+class BatchResult(BaseModel):
+    status: int
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
@@ -4,61 +4,109 @@
 
 该模块负责API密钥的加密和解密操作，使用Fernet对称加密算法确保密钥安全存储。
 在生产环境中，应使用强密钥并通过环境变量配置，避免硬编码在代码中。
+
+支持密钥轮换：ENCRYPTION_KEYS 配置一个密钥环（逗号分隔，第一个为当前主密钥，
+其余为仍可解密的旧密钥），每个条目可写作 kid:key 或只写 key（kid 取密钥指纹）。
+密文格式为 v1:<kid>:<Fernet令牌>，解密时按 kid 直接选择密钥；
+旧版本的双重 base64 密文仍可解密。已有数据用 key_rotation.py 分批重新加密。
 """
 import base64
+import hashlib
 import os
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import secrets
 
+ENVELOPE_VERSION = "v1"
+# 未配置密钥时，开发环境生成的密钥保存在该文件中，重启后保持不变
+ENCRYPTION_KEY_FILE = os.getenv("ENCRYPTION_KEY_FILE", ".encryption_key")
+
+def key_id(key: bytes) -> str:
+    """
+    计算密钥指纹，作为默认的密钥ID
+    """
+    return hashlib.sha256(key).hexdigest()[:8]
+
+def _is_placeholder(value: str) -> bool:
+    return not value or value.startswith("your-")
+
+def _validate_key(key: str) -> bytes:
+    """
+    校验Fernet密钥（32字节的urlsafe base64编码）
+
+    Raises:
+        ValueError: 密钥格式无效
+    """
+    try:
+        decoded_key = base64.urlsafe_b64decode(key)
+    except Exception:
+        raise ValueError("Encryption key must be a valid base64-encoded 32-byte string.")
+    if len(decoded_key) != 32:
+        raise ValueError("Encryption key must be a 32-byte base64-encoded string.")
+    return key.encode()
+
+def _parse_keyring(value: str) -> list:
+    """
+    解析密钥环配置，返回 [(kid, key), ...]，第一个为主密钥
+    """
+    keyring = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        kid, _, key = entry.rpartition(":")
+        key_bytes = _validate_key(key)
+        keyring.append((kid or key_id(key_bytes), key_bytes))
+    return keyring
+
+def _load_dev_key() -> bytes:
+    # 读取或生成并保存开发环境密钥，避免每次启动使用不同的随机密钥导致已存密文无法解密
+    if os.path.exists(ENCRYPTION_KEY_FILE):
+        with open(ENCRYPTION_KEY_FILE, "rb") as f:
+            return _validate_key(f.read().decode().strip())
+    key = Fernet.generate_key()
+    fd = os.open(ENCRYPTION_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
 class SecureKeyManager:
     """
     安全密钥管理器类
     
-    负责API密钥的加密和解密，使用环境变量中的加密密钥进行初始化，
-    如果未设置则会生成一个临时密钥（仅用于开发环境）。
+    负责API密钥的加密和解密。密钥环来自环境变量 ENCRYPTION_KEYS / ENCRYPTION_KEY；
+    都未设置时使用保存在 ENCRYPTION_KEY_FILE 中的开发密钥（仅用于开发环境）。
     """
     def __init__(self):
         """
         初始化安全密钥管理器
-        从环境变量中读取加密密钥，如果不存在则生成一个临时密钥（仅用于开发环境）
+
+        Raises:
+            ValueError: 环境变量中的密钥格式无效
         """
-        # 从环境变量获取加密密钥
-        env_key = os.getenv('ENCRYPTION_KEY')
+        keyring = _parse_keyring(os.getenv("ENCRYPTION_KEYS", ""))
+        env_key = os.getenv('ENCRYPTION_KEY', '')
+        if not _is_placeholder(env_key):
+            key = _validate_key(env_key)
+            if all(k != key for _, k in keyring):
+                keyring.append((key_id(key), key))
         
-        if not env_key or env_key == 'your-encryption-key-here' or env_key == '':
-            # 如果没有设置环境变量或使用默认值，生成一个随机密钥
-            # 注意：这仅适用于开发环境，生产环境必须使用固定的密钥
-            self.key = Fernet.generate_key()
-            print("Warning: Encryption key not set in environment variables. Using generated key.")
+        if not keyring:
+            # 注意：这仅适用于开发环境，生产环境必须通过环境变量配置固定的密钥
+            key = _load_dev_key()
+            keyring.append((key_id(key), key))
+            print(f"Warning: Encryption key not set in environment variables. Using development key from {ENCRYPTION_KEY_FILE}.")
             print("For production, set ENCRYPTION_KEY in your .env file.")
-        else:
-            # 检查环境变量中的密钥是否是有效的Fernet密钥
-            try:
-                # 如果是有效的base64编码且长度正确，则直接使用
-                decoded_key = base64.urlsafe_b64decode(env_key)
-                if len(decoded_key) == 32:
-                    self.key = env_key.encode() if isinstance(env_key, str) else env_key
-                else:
-                    # 如果长度不正确，生成新的有效密钥
-                    self.key = Fernet.generate_key()
-                    print("Warning: Invalid encryption key length in environment variables. Using generated key.")
-                    print("Encryption key must be a 32-byte base64-encoded string.")
-            except Exception:
-                # 如果不是有效的base64编码，生成新的有效密钥
-                self.key = Fernet.generate_key()
-                print("Warning: Invalid encryption key format in environment variables. Using generated key.")
-                print("Encryption key must be a valid base64-encoded 32-byte string.")
-        
-        # 确保最终的密钥是有效的Fernet密钥
-        if isinstance(self.key, str):
-            self.key = self.key.encode()
         
-        # 创建Fernet实例
+        self.keyring = keyring
+        self.primary_kid, self.key = keyring[0]
         self.cipher = Fernet(self.key)
+        self._ciphers = {kid: Fernet(key) for kid, key in keyring}
+        # 按顺序尝试全部密钥，用于旧格式密文或未知kid
+        self._multi = MultiFernet([Fernet(key) for _, key in keyring])
     
     def encrypt_key(self, plain_text: str) -> str:
         """
@@ -68,14 +116,14 @@ class SecureKeyManager:
             plain_text (str): 明文API密钥
             
         Returns:
-            str: 加密后的API密钥(base64编码)
+            str: 加密后的API密钥，格式为 v1:<kid>:<Fernet令牌>
             
         Raises:
             Exception: 加密过程中出现的任何错误
         """
         try:
-            encrypted = self.cipher.encrypt(plain_text.encode())
-            return base64.b64encode(encrypted).decode()
+            token = self.cipher.encrypt(plain_text.encode()).decode()
+            return f"{ENVELOPE_VERSION}:{self.primary_kid}:{token}"
         except Exception as e:
             raise Exception(f"Encryption failed: {str(e)}")
     
@@ -84,7 +132,7 @@ class SecureKeyManager:
         解密API密钥
         
         Args:
-            encrypted_text (str): 加密的API密钥(base64编码)
+            encrypted_text (str): 加密的API密钥（v1 格式或旧版的 base64 格式）
             
         Returns:
             str: 解密后的明文API密钥
@@ -93,11 +141,26 @@ class SecureKeyManager:
             Exception: 解密过程中出现的任何错误
         """
         try:
-            encrypted_bytes = base64.b64decode(encrypted_text)
-            decrypted = self.cipher.decrypt(encrypted_bytes)
-            return decrypted.decode()
+            if encrypted_text.startswith(ENVELOPE_VERSION + ":"):
+                _, kid, token = encrypted_text.split(":", 2)
+                cipher = self._ciphers.get(kid, self._multi)
+                return cipher.decrypt(token.encode()).decode()
+            # 旧格式：Fernet令牌再做一次 base64 编码
+            return self._multi.decrypt(base64.b64decode(encrypted_text)).decode()
         except Exception as e:
             raise Exception(f"Decryption failed: {str(e)}")
+    
+    def needs_rotation(self, encrypted_text: str) -> bool:
+        """
+        判断密文是否需要用主密钥重新加密（旧格式或非主密钥加密）
+        """
+        return not encrypted_text.startswith(f"{ENVELOPE_VERSION}:{self.primary_kid}:")
+    
+    def rotate(self, encrypted_text: str) -> str:
+        """
+        用主密钥重新加密密文
+        """
+        return self.encrypt_key(self.decrypt_key(encrypted_text))
 
 # 创建全局实例
 secure_key_manager = SecureKeyManager()
\ No newline at end of file
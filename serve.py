@@ -0,0 +1,270 @@
+"""
+生产环境启动脚本（预派生多进程）
+
+    python serve.py --workers 4 --port 8000
+
+父进程完成只需执行一次的启动步骤（数据库迁移、.env 同步到数据库、释放上次运行留下的任务），
+绑定监听端口后派生 SERVER_WORKERS 个工作进程共享该端口，每个工作进程运行一个 uvicorn 服务
+（安装了 uvloop/httptools 时使用它们）。第0个工作进程为主工作进程，负责监视 .env 和认领无人执行的任务。
+
+工作进程回收：
+    - 处理 SERVER_MAX_REQUESTS（加随机抖动，避免同时重启）个请求后退出；
+    - 常驻内存超过 SERVER_MAX_MEMORY_MB 时退出；
+退出前停止接收新连接并等待进行中的请求完成（最多 SERVER_GRACEFUL_TIMEOUT 秒），父进程随即派生新的工作进程。
+异常退出的工作进程认领的任务由父进程释放，重新排队。
+
+进程间状态：
+    - 登录限流的令牌桶通过 RATE_LIMIT_SHARED_FILE 共享（未设置时使用临时文件）；
+    - API调用配额按进程计数，QUOTA_WORKERS 设为工作进程数，每个进程只使用 1/N 的 max_requests；
+    - 熔断器和负载均衡器的延迟/错误率 EWMA 按进程独立维护：某个上游故障时，
+      每个工作进程都要各自累计到 CIRCUIT_FAILURE_THRESHOLD 次失败才会熔断，各进程的选路统计也互不相同。
+
+收到 SIGTERM/SIGINT 时父进程通知所有工作进程平滑退出，超时后强制结束。
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("serve")
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 0))  # 0 表示 CPU 核数
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", 10000))  # 0 表示不限制
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", 1000))
+SERVER_MAX_MEMORY_MB = int(os.getenv("SERVER_MAX_MEMORY_MB", 0))  # 0 表示不限制
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+SERVER_MEMORY_CHECK_INTERVAL = float(os.getenv("SERVER_MEMORY_CHECK_INTERVAL", 5))
+
+# 工作进程启动后很快退出时，延迟再派生，避免配置错误时反复重启
+RESPAWN_BACKOFF_SECONDS = 1.0
+
+
+def _module_available(name: str) -> bool:
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def rss_mb() -> float:
+    """
+    当前进程的常驻内存（MB）
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # 非Linux平台退回历史峰值
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _watch_memory(server, limit_mb: int):
+    while not server.should_exit:
+        usage = rss_mb()
+        if usage > limit_mb:
+            logger.warning(f"工作进程 {os.getpid()} 内存 {usage:.0f}MB 超过 {limit_mb}MB，处理完当前请求后退出")
+            server.should_exit = True
+            return
+        time.sleep(SERVER_MEMORY_CHECK_INTERVAL)
+
+
+def run_worker(sock, primary: bool, options: dict):
+    """
+    工作进程入口：在父进程绑定的端口上运行一个 uvicorn 服务
+    """
+    # main 在导入时读取这些变量
+    os.environ["SERVER_MANAGED"] = "true"
+    os.environ["SERVER_PRIMARY_WORKER"] = "true" if primary else "false"
+
+    import uvicorn
+
+    max_requests = options["max_requests"]
+    if max_requests:
+        max_requests += random.randint(0, options["max_requests_jitter"])
+    config = uvicorn.Config(
+        "main:app",
+        loop="uvloop" if _module_available("uvloop") else "asyncio",
+        http="httptools" if _module_available("httptools") else "h11",
+        limit_max_requests=max_requests or None,
+        timeout_graceful_shutdown=options["graceful_timeout"],
+        log_level=options["log_level"],
+    )
+    server = uvicorn.Server(config)
+    if options["max_memory_mb"]:
+        threading.Thread(target=_watch_memory, args=(server, options["max_memory_mb"]), daemon=True).start()
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    """
+    派生并监控工作进程
+    """
+
+    def __init__(self, sock, workers: int, options: dict):
+        self.sock = sock
+        self.workers = workers
+        self.options = options
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[int, multiprocessing.process.BaseProcess] = {}  # 槽位 -> 进程
+        self._started: Dict[int, float] = {}
+        self._stopping = threading.Event()
+
+    def _spawn(self, slot: int):
+        process = self._context.Process(
+            target=run_worker, args=(self.sock, slot == 0, self.options), name=f"worker-{slot}"
+        )
+        process.start()
+        self._processes[slot] = process
+        self._started[slot] = time.monotonic()
+        logger.info(f"启动工作进程 {slot} (pid={process.pid}{', 主工作进程' if slot == 0 else ''})")
+
+    def _reap(self, slot: int, process):
+        import job_queue
+        process.join()
+        if process.exitcode != 0:
+            logger.warning(f"工作进程 {slot} (pid={process.pid}) 异常退出，退出码 {process.exitcode}")
+        # 平滑退出时工作进程已释放自己的任务；异常退出时由父进程释放
+        released = job_queue.release_jobs(str(process.pid))
+        if released:
+            logger.info(f"重新排队工作进程 {process.pid} 留下的 {released} 个任务")
+
+    def stop(self, *_):
+        self._stopping.set()
+
+    def run(self):
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while not self._stopping.is_set():
+            for slot, process in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+                self._reap(slot, process)
+                if self._stopping.is_set():
+                    break
+                if time.monotonic() - self._started[slot] < RESPAWN_BACKOFF_SECONDS:
+                    self._stopping.wait(RESPAWN_BACKOFF_SECONDS)
+                    if self._stopping.is_set():
+                        break
+                self._spawn(slot)
+            self._stopping.wait(0.5)
+
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        通知所有工作进程平滑退出，超时后强制结束
+        """
+        logger.info("正在停止工作进程")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.options["graceful_timeout"] + 5
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        for slot, process in self._processes.items():
+            if process.is_alive():
+                logger.warning(f"工作进程 {slot} (pid={process.pid}) 未在规定时间内退出，强制结束")
+                process.kill()
+            self._reap(slot, process)
+        self._processes.clear()
+
+
+def prepare():
+    """
+    只需执行一次的启动步骤，在派生工作进程之前完成
+    """
+    import config_sync
+    import job_queue
+    from migrate_database import migrate_database
+
+    migrate_database()
+    summary = config_sync.sync_db_from_env()
+    logger.info(f"已从 .env 同步API配置: {summary}")
+    released = job_queue.release_jobs()
+    if released:
+        logger.info(f"重新排队 {released} 个未完成的任务")
+
+
+def main(argv: Optional[list] = None):
+    """主函数"""
+    parser = argparse.ArgumentParser(description="以多个工作进程运行 AllSmart 服务")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="工作进程数，默认为CPU核数")
+    parser.add_argument("--max-requests", type=int, default=SERVER_MAX_REQUESTS, help="处理多少个请求后回收工作进程，0表示不回收")
+    parser.add_argument("--max-requests-jitter", type=int, default=SERVER_MAX_REQUESTS_JITTER)
+    parser.add_argument("--max-memory-mb", type=int, default=SERVER_MAX_MEMORY_MB, help="常驻内存上限，0表示不限制")
+    parser.add_argument("--graceful-timeout", type=int, default=SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    prepare()
+
+    import uvicorn
+    sock = uvicorn.Config("main:app", host=args.host, port=args.port).bind_socket()
+    workers = args.workers or multiprocessing.cpu_count()
+    options = {
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests_jitter,
+        "max_memory_mb": args.max_memory_mb,
+        "graceful_timeout": args.graceful_timeout,
+        "log_level": args.log_level,
+    }
+    logger.info(f"监听 http://{args.host}:{args.port}，{workers} 个工作进程")
+
+    # 配额计数不跨进程共享，按工作进程数平分每个配置的 max_requests
+    os.environ["QUOTA_WORKERS"] = str(workers)
+
+    # 各工作进程映射同一组令牌桶文件，登录限流按全部工作进程合计
+    rate_limit_dir = None
+    if not os.getenv("RATE_LIMIT_SHARED_FILE"):
+        rate_limit_dir = tempfile.mkdtemp(prefix="allsmart-ratelimit-")
+        os.environ["RATE_LIMIT_SHARED_FILE"] = os.path.join(rate_limit_dir, "buckets")
+
+    # 各工作进程把指标写入同一目录，/metrics 汇总全部工作进程
+    metrics_dir = os.getenv("METRICS_DIR")
+    created_metrics_dir = metrics_dir is None
+    if created_metrics_dir:
+        metrics_dir = tempfile.mkdtemp(prefix="allsmart-metrics-")
+        os.environ["METRICS_DIR"] = metrics_dir
+    else:
+        # 运维指定的目录可能还有其他文件，只清除上次运行留下的指标文件
+        import metrics
+        os.makedirs(metrics_dir, exist_ok=True)
+        metrics.clear_directory(metrics_dir)
+
+    supervisor = Supervisor(sock, workers, options)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    try:
+        supervisor.run()
+    finally:
+        sock.close()
+        if created_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        if rate_limit_dir is not None:
+            shutil.rmtree(rate_limit_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+静态资源模块
+
+public/ 目录的静态文件在启动时（或用 python static_assets.py 在构建时）预处理：
+    - 文本类文件（html/js/css/json/svg等）预先压缩为 gzip，安装了 brotli 时同时生成 br，
+      按请求的 Accept-Encoding 直接返回压缩后的内容，不在每次请求时压缩；
+    - 其中非HTML的资源额外以带内容哈希的文件名提供（例如 admin.3f2a1b9c.js），
+      响应带 Cache-Control: immutable，可长期缓存；HTML中对本地资源的引用会改写为带哈希的文件名；
+    - HTML入口页面的地址保持不变，使用 no-cache 加强 ETag，未变化时返回 304；
+      各编码的内容不同，ETag 带编码后缀（例如 "3f2a...-gzip"）。
+
+预处理后的内容保存在内存中，一次发送即可完成响应，不在每次请求时读取磁盘；
+不可压缩或过大的文件仍按原方式从磁盘发送。源文件修改后在下一次请求时自动重新处理，
+检查文件变化和重新处理都在线程池中进行，不阻塞事件循环。
+构建时生成的 .gz/.br 文件写入 STATIC_BUILD_DIR，可供 nginx 的 gzip_static/brotli_static 直接使用。
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli 是可选依赖
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_PRECOMPRESS = os.getenv("STATIC_PRECOMPRESS", "true").lower() == "true"
+STATIC_MAX_MEMORY_BYTES = int(os.getenv("STATIC_MAX_MEMORY_BYTES", 5 * 1024 * 1024))
+STATIC_IMMUTABLE_MAX_AGE = int(os.getenv("STATIC_IMMUTABLE_MAX_AGE", 31536000))
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", ".static_build")
+
+COMPRESSIBLE_EXTENSIONS = {".html", ".htm", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".xml", ".map"}
+HTML_EXTENSIONS = {".html", ".htm"}
+MIN_COMPRESS_BYTES = 256
+FINGERPRINT_LENGTH = 8
+
+# HTML中对本地资源的引用
+_REFERENCE_PATTERN = re.compile(r'(\b(?:src|href)\s*=\s*)(["\'])([^"\'#?:]+)\2', re.IGNORECASE)
+
+
+def _fingerprinted_name(relative_path: str, digest: str) -> str:
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{digest[:FINGERPRINT_LENGTH]}{ext}"
+
+
+def _accepted_encodings(scope: Scope) -> Dict[str, float]:
+    header = Headers(scope=scope).get("accept-encoding", "")
+    accepted = {}
+    for item in header.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class Asset:
+    """
+    一个预处理后的静态文件
+    """
+    __slots__ = ("path", "relative_path", "media_type", "etag", "fingerprinted", "bodies", "signature", "deps")
+
+    def __init__(self, path: str, relative_path: str, media_type: str, etag: str, fingerprinted: Optional[str],
+                 bodies: Dict[str, bytes], signature: Tuple[int, int], deps: List[Tuple[str, Tuple[int, int]]]):
+        self.path = path
+        self.relative_path = relative_path
+        self.media_type = media_type
+        self.etag = etag
+        self.fingerprinted = fingerprinted
+        self.bodies = bodies                  # 编码 -> 内容；identity 为原始（或改写后的）内容
+        self.signature = signature            # 源文件 (mtime_ns, size)
+        self.deps = deps                      # HTML 引用的资源及其签名
+
+    def choose_encoding(self, scope: Scope) -> str:
+        accepted = _accepted_encodings(scope)
+        wildcard = accepted.get("*", 0.0)
+        best, best_q = "identity", 0.0
+        for coding in ("br", "gzip"):
+            q = accepted.get(coding, wildcard)
+            if coding in self.bodies and q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def etag_for(self, encoding: str) -> str:
+        """
+        各编码的内容不同，强ETag也必须不同
+        """
+        return self.etag if encoding == "identity" else f'{self.etag[:-1]}-{encoding}"'
+
+    def response(self, scope: Scope, immutable: bool, status_code: int = 200) -> Response:
+        """
+        按 Accept-Encoding 返回预压缩内容；If-None-Match 匹配时返回 304
+        """
+        encoding = self.choose_encoding(scope)
+        etag = self.etag_for(encoding)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": (f"public, max-age={STATIC_IMMUTABLE_MAX_AGE}, immutable" if immutable else "no-cache"),
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        # If-None-Match 使用弱比较，代理可能把 ETag 改为弱ETag
+        if status_code == 200 and if_none_match and (
+            if_none_match.strip() == "*"
+            or not {etag, f"W/{etag}"}.isdisjoint(tag.strip() for tag in if_none_match.split(","))
+        ):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        body = self.bodies[encoding]
+        if scope["method"] == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(body, status_code=status_code, headers=headers, media_type=self.media_type)
+
+
+def _signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class AssetPipeline:
+    """
+    静态文件预处理：压缩、内容哈希、HTML引用改写
+    """
+    def __init__(self, directory: str, precompress: bool = STATIC_PRECOMPRESS):
+        self.directory = os.path.realpath(directory)
+        self.precompress = precompress
+        self._assets: Dict[str, Asset] = {}        # 源文件绝对路径 -> Asset
+        self._fingerprints: Dict[str, str] = {}    # 带哈希的相对路径 -> 源文件绝对路径
+        self._lock = threading.Lock()
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.directory).replace(os.sep, "/")
+
+    def _compress(self, data: bytes) -> Dict[str, bytes]:
+        bodies = {"identity": data}
+        if not self.precompress or len(data) < MIN_COMPRESS_BYTES:
+            return bodies
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) < len(data):
+            bodies["gzip"] = gz
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data):
+                bodies["br"] = br
+        return bodies
+
+    def _rewrite_html(self, path: str, data: bytes) -> Tuple[bytes, List[Tuple[str, Tuple[int, int]]]]:
+        # 把对本地资源的引用改写为带哈希的文件名
+        text = data.decode("utf-8", errors="surrogateescape")
+        base = os.path.dirname(path)
+        deps = []
+
+        def replace(match):
+            reference = match.group(3)
+            if reference.startswith("//"):
+                return match.group(0)
+            target = os.path.normpath(os.path.join(self.directory, reference.lstrip("/")) if reference.startswith("/")
+                                      else os.path.join(base, reference))
+            asset = self._load(target) if target.startswith(self.directory + os.sep) else None
+            if asset is None or asset.fingerprinted is None:
+                return match.group(0)
+            deps.append((target, asset.signature))
+            prefix = reference[:reference.rfind("/") + 1]
+            new_name = os.path.basename(asset.fingerprinted)
+            return f"{match.group(1)}{match.group(2)}{prefix}{new_name}{match.group(2)}"
+
+        text = _REFERENCE_PATTERN.sub(replace, text)
+        return text.encode("utf-8", errors="surrogateescape"), deps
+
+    def _build(self, path: str, signature: Tuple[int, int]) -> Optional[Asset]:
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in COMPRESSIBLE_EXTENSIONS or signature[1] > STATIC_MAX_MEMORY_BYTES:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        deps = []
+        if ext in HTML_EXTENSIONS:
+            data, deps = self._rewrite_html(path, data)
+        digest = hashlib.sha256(data).hexdigest()
+        relative_path = self._relative(path)
+        fingerprinted = None if ext in HTML_EXTENSIONS else _fingerprinted_name(relative_path, digest)
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return Asset(path, relative_path, media_type, f'"{digest[:32]}"', fingerprinted,
+                     self._compress(data), signature, deps)
+
+    def _load(self, path: str) -> Optional[Asset]:
+        signature = _signature(path)
+        if signature is None:
+            return None
+        asset = self._assets.get(path)
+        if asset is not None and asset.signature == signature and all(
+            _signature(dep) == dep_signature for dep, dep_signature in asset.deps
+        ):
+            return asset
+        asset = self._build(path, signature)
+        if asset is not None:
+            old = self._assets.get(path)
+            if old is not None and old.fingerprinted and old.fingerprinted != asset.fingerprinted:
+                # 旧的哈希文件名继续可用，指向当前内容
+                self._fingerprints[old.fingerprinted] = path
+            self._assets[path] = asset
+            if asset.fingerprinted:
+                self._fingerprints[asset.fingerprinted] = path
+        return asset
+
+    def get(self, path: str) -> Optional[Asset]:
+        """
+        返回源文件对应的资源（源文件或其引用的资源变化时重新处理）；不适合预处理的文件返回None
+        """
+        with self._lock:
+            return self._load(os.path.realpath(path))
+
+    def cached(self, path: str) -> Optional[Asset]:
+        """
+        返回已处理的资源，不检查源文件是否变化（path 须为 realpath，不访问磁盘）
+        """
+        return self._assets.get(path)
+
+    def resolve_fingerprint(self, relative_path: str) -> Optional[Asset]:
+        """
+        按带哈希的文件名查找资源
+        """
+        path = self._fingerprints.get(relative_path)
+        return self.get(path) if path is not None else None
+
+    def build_all(self) -> List[Asset]:
+        """
+        预处理目录下的全部文件
+        """
+        assets = []
+        for root, _, files in os.walk(self.directory):
+            for name in sorted(files):
+                asset = self.get(os.path.join(root, name))
+                if asset is not None:
+                    assets.append(asset)
+        return assets
+
+    def manifest(self) -> Dict[str, str]:
+        """
+        原文件名 -> 带哈希的文件名
+        """
+        with self._lock:
+            return {asset.relative_path: asset.fingerprinted for asset in self._assets.values() if asset.fingerprinted}
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    使用 AssetPipeline 的 StaticFiles：预压缩、带哈希文件名的长期缓存和 ETag/304
+    """
+    def __init__(self, *, directory: str, precompress: bool = STATIC_PRECOMPRESS, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.pipeline = AssetPipeline(directory, precompress=precompress)
+        self.pipeline.build_all()
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            asset = await run_in_threadpool(self.pipeline.resolve_fingerprint, path.replace(os.sep, "/"))
+            if asset is not None:
+                return asset.response(scope, immutable=True)
+        return await super().get_response(path, scope)
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        # StaticFiles 在线程池中调用 lookup_path，顺便检查源文件及其引用的资源并在需要时重新处理
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            self.pipeline.get(full_path)
+        return full_path, stat_result
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        # 在事件循环中执行，只取 lookup_path 已处理好的资源
+        full_path = str(full_path)
+        asset = self.pipeline.cached(os.path.realpath(full_path) if self.follow_symlink else full_path)
+        if asset is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        return asset.response(scope, immutable=False, status_code=status_code)
+
+
+def build(directory: str, output: str) -> List[Asset]:
+    """
+    构建时预处理：把带哈希的文件及其 .gz/.br 写入 output 目录
+    """
+    pipeline = AssetPipeline(directory, precompress=True)
+    assets = pipeline.build_all()
+    for asset in assets:
+        names = [asset.relative_path] + ([asset.fingerprinted] if asset.fingerprinted else [])
+        for name in names:
+            target = os.path.join(output, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            for encoding, suffix in (("identity", ""), ("gzip", ".gz"), ("br", ".br")):
+                if encoding in asset.bodies:
+                    with open(target + suffix, "wb") as f:
+                        f.write(asset.bodies[encoding])
+    return assets
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="预压缩并为 public/ 中的静态文件生成带哈希的文件名")
+    parser.add_argument("--directory", default="public")
+    parser.add_argument("--output", default=STATIC_BUILD_DIR)
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("未安装 brotli，只生成 gzip")
+    total = compressed = 0
+    for asset in build(args.directory, args.output):
+        identity = len(asset.bodies["identity"])
+        best = min(len(body) for body in asset.bodies.values())
+        total += identity
+        compressed += best
+        print(f"{asset.relative_path:<24} {identity:>9} -> {best:>8}  {asset.fingerprinted or ''}")
+    print(f"合计 {total} -> {compressed} 字节，输出到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+令牌吊销模块
+
+该模块负责维护已吊销的JWT令牌列表。
+吊销记录持久化在 revoked_tokens 表中，运行时加载到内存：
+先用布隆过滤器快速排除绝大多数未吊销的令牌，命中时再查精确集合确认，
+因此正常请求的令牌校验不需要访问数据库。
+其他工作进程写入的吊销记录由后台线程定期增量同步，不在请求处理中查询。
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, run_after_commit
+from models import Admin, RevokedToken
+
+logger = logging.getLogger(__name__)
+
+# 布隆过滤器容量与误判率，以及多进程部署时从数据库增量同步的间隔（秒）
+BLOOM_CAPACITY = int(os.getenv("TOKEN_REVOCATION_BLOOM_CAPACITY", 100000))
+BLOOM_ERROR_RATE = float(os.getenv("TOKEN_REVOCATION_BLOOM_ERROR_RATE", 0.001))
+SYNC_INTERVAL_SECONDS = float(os.getenv("TOKEN_REVOCATION_SYNC_SECONDS", 30))
+
+
+class BloomFilter:
+    """
+    基于 bytearray 的布隆过滤器
+
+    使用 blake2b 摘要做双重哈希生成 k 个位置，只会误判“可能存在”，不会漏判。
+    """
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class TokenRevocationStore:
+    """
+    令牌吊销存储
+
+    支持两种吊销方式：
+    1. 按 jti 吊销单个令牌（登出、刷新令牌轮换）
+    2. 按主体吊销全部令牌：记录主体的最低有效 token_version，版本更低的令牌全部失效
+    """
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._revoked: Dict[str, float] = {}                 # jti -> 过期时间戳
+        self._min_versions: Dict[Tuple[str, int], int] = {}  # (主体类型, 主体ID) -> 最低有效版本
+        self._last_id = 0
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
+        self._syncer: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _subject(kind: str, subject_id: int) -> str:
+        return f"{kind}:{subject_id}"
+
+    def _apply(self, row: RevokedToken):
+        if row.jti:
+            expires = row.expires_at.replace(tzinfo=timezone.utc).timestamp() if row.expires_at else float("inf")
+            self._revoked[row.jti] = expires
+            self._bloom.add(row.jti)
+        elif row.subject:
+            kind, _, subject_id = row.subject.partition(":")
+            key = (kind, int(subject_id))
+            self._min_versions[key] = max(self._min_versions.get(key, 0), row.token_version or 0)
+        self._last_id = max(self._last_id, row.id)
+
+    def _apply_committed(self, row: RevokedToken):
+        with self._lock:
+            self._apply(row)
+
+    def load(self, db: Session):
+        """
+        启动时清理过期记录并加载全部吊销记录
+        """
+        db.query(RevokedToken).filter(
+            RevokedToken.jti.isnot(None),
+            RevokedToken.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        with self._lock:
+            self._bloom = BloomFilter(self._capacity, self._error_rate)
+            self._revoked.clear()
+            self._min_versions.clear()
+            self._last_id = 0
+            for row in db.query(RevokedToken).order_by(RevokedToken.id).all():
+                self._apply(row)
+            self._last_sync = time.monotonic()
+
+    def sync(self, db: Session):
+        """
+        增量加载其他工作进程写入的吊销记录
+        """
+        rows = db.query(RevokedToken).filter(RevokedToken.id > self._last_id).order_by(RevokedToken.id).all()
+        with self._lock:
+            for row in rows:
+                self._apply(row)
+            self._last_sync = time.monotonic()
+
+    def maybe_sync(self):
+        """
+        距上次同步超过 SYNC_INTERVAL_SECONDS 时执行一次增量同步
+        """
+        if time.monotonic() - self._last_sync < SYNC_INTERVAL_SECONDS:
+            return
+        db = SessionLocal()
+        try:
+            self.sync(db)
+        finally:
+            db.close()
+
+    def prune(self) -> int:
+        """
+        从内存中移除已过期的吊销记录，并用剩余记录重建布隆过滤器
+
+        Returns:
+            int: 移除的记录数
+        """
+        now = time.time()
+        with self._lock:
+            expired = [jti for jti, expires in self._revoked.items() if expires <= now]
+            if not expired:
+                return 0
+            for jti in expired:
+                del self._revoked[jti]
+            bloom = BloomFilter(self._capacity, self._error_rate)
+            for jti in self._revoked:
+                bloom.add(jti)
+            self._bloom = bloom
+        return len(expired)
+
+    def _sync_loop(self):
+        while not self._stop.wait(SYNC_INTERVAL_SECONDS):
+            try:
+                self.maybe_sync()
+            except Exception as e:
+                logger.error(f"同步令牌吊销记录失败: {e}")
+            # 登出和刷新令牌轮换不断新增记录，过期后不再需要
+            self.prune()
+
+    def start_syncing(self):
+        """
+        启动定期增量同步的后台线程（应用启动时调用）
+        """
+        if self._syncer is None:
+            self._stop.clear()
+            self._syncer = threading.Thread(target=self._sync_loop, name="token-revocation-sync", daemon=True)
+            self._syncer.start()
+
+    def stop_syncing(self):
+        self._stop.set()
+        self._syncer = None
+
+    def revoke(self, db: Session, jti: str, expires_at: Optional[datetime]):
+        """
+        吊销单个令牌
+        """
+        row = RevokedToken(jti=jti, expires_at=expires_at)
+        db.add(row)
+        db.commit()
+        db.refresh(row)
+        run_after_commit(db, self._apply_committed, row)
+
+    def revoke_subject(self, db: Session, kind: str, subject_id: int, min_version: int):
+        """
+        吊销主体在 min_version 之前签发的全部令牌
+
+        调用方负责在同一会话中更新主体的 token_version，此处一并提交。
+        """
+        row = RevokedToken(subject=self._subject(kind, subject_id), token_version=min_version)
+        db.add(row)
+        db.commit()
+        db.refresh(row)
+        run_after_commit(db, self._apply_committed, row)
+
+    def is_revoked(self, jti: str) -> bool:
+        """
+        检查令牌是否已被吊销：布隆过滤器未命中直接返回，命中再查精确集合
+        """
+        if jti not in self._bloom:
+            return False
+        expires = self._revoked.get(jti)
+        return expires is not None and expires > time.time()
+
+    def is_version_valid(self, kind: str, subject_id: int, version: int) -> bool:
+        return version >= self._min_versions.get((kind, subject_id), 0)
+
+
+# 创建全局实例
+token_revocation_store = TokenRevocationStore()
+
+
+def revoke_all_tokens(db: Session, principal):
+    """
+    递增主体的令牌版本，使其此前签发的全部令牌失效
+
+    在禁用账户、修改密码、修改角色或删除账户时调用。
+
+    Args:
+        db (Session): 数据库会话
+        principal: User或Admin对象
+    """
+    principal.token_version = (principal.token_version or 0) + 1
+    kind = "admin" if isinstance(principal, Admin) else "user"
+    token_revocation_store.revoke_subject(db, kind, principal.id, principal.token_version)
@@ -0,0 +1,280 @@
+"""
+单写线程写队列模块（SQLite 组提交）
+
+SQLite 同一时刻只允许一个写事务，crude 中的每个修改各自提交：并发写入时请求之间争抢写锁
+（超时后报 "database is locked"），每次提交还要单独 fsync 一次。
+
+写请求改为提交到写队列，由一个专用写线程执行：
+    - 写线程取出队列中已有的写请求，最多再等待 WRITE_BATCH_WINDOW_MS 毫秒收集后续请求
+      （每组不超过 WRITE_BATCH_MAX 个），在同一个事务中依次执行，最后只提交一次；
+    - 每个写请求在各自的 SAVEPOINT 中执行，失败时只回滚它自己的修改，异常交给调用方，同组其他请求照常提交；
+    - 写请求中的 db.commit() 只把修改刷新到当前事务，db.rollback() 回滚到该请求的 SAVEPOINT；
+    - 整组提交成功后才把结果交给各调用方。返回的ORM对象已与会话分离，属性保持提交时的值；
+    - 写请求通过 database.run_after_commit 登记的内存状态更新（权限位图、令牌吊销列表）
+      在整组提交成功后才执行，请求失败或提交失败时丢弃，内存状态不会领先于数据库。
+
+写吞吐量因此随每组的大小增长，而不是受 fsync 次数限制。
+
+    db_user = write_queue.write(db, crude.update_user, user_id=1, user_data={...})
+    db_user = await write_queue.awrite(db, crude.update_user, user_id=1, user_data={...})
+
+批量请求（/api/batch）的写操作共用一个会话并自行提交或回滚，此时直接在该会话中执行。
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+import batch
+from database import SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE_ENABLED", "true").lower() == "true"
+WRITE_BATCH_WINDOW_MS = float(os.getenv("WRITE_BATCH_WINDOW_MS", 2))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", 64))
+# 其他进程持有写锁时等待的秒数
+WRITE_LOCK_TIMEOUT = float(os.getenv("WRITE_LOCK_TIMEOUT", 30))
+
+
+def _create_writer_engine():
+    # pysqlite 默认在第一条DML语句前才隐式开始事务，SAVEPOINT 的释放会直接提交外层事务；
+    # 关闭驱动的隐式事务，由 SQLAlchemy 显式发出 BEGIN IMMEDIATE，开始时即取得写锁
+    writer_engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": WRITE_LOCK_TIMEOUT},
+    )
+
+    @event.listens_for(writer_engine, "connect")
+    def _disable_implicit_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer_engine, "begin")
+    def _begin_immediate(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return writer_engine
+
+
+class _GroupSession(Session):
+    """
+    写线程使用的会话：写请求执行期间 commit() 只刷新，rollback() 只回滚到该请求的 SAVEPOINT
+    """
+
+    savepoint = None
+    hook_mark = 0  # 当前写请求开始时 info["after_commit"] 的长度
+
+    def commit(self):
+        if self.savepoint is None:
+            return super().commit()
+        self.flush()
+
+    def rollback(self):
+        if self.savepoint is None:
+            return super().rollback()
+        if self.savepoint.is_active:
+            self.savepoint.rollback()
+        del self.info["after_commit"][self.hook_mark:]
+        self.savepoint = self.begin_nested()
+
+
+class _Write:
+    __slots__ = ("fn", "args", "kwargs", "future", "context")
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        # 在提交者的上下文中执行，查询统计等按请求记录的状态计入发起写请求的请求
+        self.context = contextvars.copy_context()
+
+    def run(self, session: Session) -> Any:
+        result = self.fn(session, *self.args, **self.kwargs)
+        session.flush()
+        return result
+
+
+class WriteQueue:
+    """
+    单写线程写队列
+    """
+
+    def __init__(self, window_ms: float = WRITE_BATCH_WINDOW_MS, max_batch: int = WRITE_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[_Write]]" = queue.Queue()
+        self._session_factory = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"writes": 0, "failed": 0, "groups": 0, "largest_group": 0, "commit_seconds": 0.0}
+
+    def start(self):
+        """
+        启动写线程（首次提交写请求时自动调用）
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._session_factory is None:
+                self._session_factory = sessionmaker(
+                    bind=_create_writer_engine(), class_=_GroupSession,
+                    autoflush=False, expire_on_commit=False,
+                )
+            self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """
+        执行完队列中已有的写请求后停止写线程
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        提交写请求，由写线程以 fn(session, *args, **kwargs) 执行
+
+        Returns:
+            Future: 所在的组提交成功后得到 fn 的返回值；fn 抛出异常或提交失败时得到该异常
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        write = _Write(fn, args, kwargs)
+        self._queue.put(write)
+        return write.future
+
+    def _bypass(self, db: Session) -> bool:
+        # 批量请求共用的会话由 batch.run_batch 提交；写线程中再次提交写请求会互相等待
+        return (not WRITE_QUEUE_ENABLED or db is batch.shared_session()
+                or threading.current_thread() is self._thread)
+
+    def write(self, db: Session, fn: Callable, *args, **kwargs) -> Any:
+        """
+        通过写队列执行 fn 并等待结果（同步端点中使用）
+
+        Args:
+            db (Session): 请求的会话；写队列未启用或处于批量请求中时直接在该会话中执行
+            fn (Callable): 写操作，第一个参数为会话，例如 crude.update_user
+
+        Returns:
+            Any: fn 的返回值
+
+        Raises:
+            Exception: fn 抛出的异常（如 HTTPException）或提交失败的异常
+        """
+        if self._bypass(db):
+            return fn(db, *args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def awrite(self, db: Session, fn: Callable, *args, **kwargs) -> Any:
+        """
+        write 的异步版本，等待期间不阻塞事件循环
+        """
+        if self._bypass(db):
+            return fn(db, *args, **kwargs)
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _collect(self, first: _Write) -> List[_Write]:
+        group = [first]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                write = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if write is None:
+                # 停止信号：先处理完这一组
+                self._queue.put(None)
+                break
+            group.append(write)
+        return group
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            group = self._collect(first)
+            try:
+                self._commit_group(group)
+            except Exception:
+                logger.exception("写队列处理失败")
+
+    def _commit_group(self, group: List[_Write]):
+        session = self._session_factory()
+        hooks = session.info["after_commit"] = []
+        done = []  # (write, result)
+        try:
+            for write in group:
+                if not write.future.set_running_or_notify_cancel():
+                    continue
+                session.savepoint = session.begin_nested()
+                session.hook_mark = mark = len(hooks)
+                try:
+                    result = write.context.run(write.run, session)
+                    if session.savepoint.is_active:
+                        session.savepoint.commit()
+                    done.append((write, result))
+                except BaseException as e:
+                    if session.savepoint.is_active:
+                        session.savepoint.rollback()
+                    # 已回滚的写请求登记的内存状态更新一并丢弃
+                    del hooks[mark:]
+                    write.future.set_exception(e)
+                    self.stats["failed"] += 1
+                finally:
+                    session.savepoint = None
+
+            started = time.perf_counter()
+            try:
+                session.commit()
+            except Exception as e:
+                logger.error(f"写队列提交失败，{len(done)} 个写请求未生效: {e}")
+                session.rollback()
+                for write, _ in done:
+                    write.future.set_exception(e)
+                self.stats["failed"] += len(done)
+                return
+            self.stats["commit_seconds"] += time.perf_counter() - started
+
+            for fn, args in hooks:
+                try:
+                    fn(*args)
+                except Exception:
+                    logger.exception("提交后更新内存状态失败")
+        finally:
+            # 关闭会话后返回的ORM对象与会话分离，保留已加载的属性
+            session.close()
+
+        self.stats["writes"] += len(done)
+        self.stats["groups"] += 1
+        self.stats["largest_group"] = max(self.stats["largest_group"], len(group))
+        for write, result in done:
+            write.future.set_result(result)
+
+    def snapshot(self) -> dict:
+        groups = self.stats["groups"]
+        return dict(
+            self.stats,
+            enabled=WRITE_QUEUE_ENABLED,
+            pending=self._queue.qsize(),
+            average_group=round(self.stats["writes"] / groups, 2) if groups else 0,
+        )
+
+
+# 创建全局实例
+write_queue = WriteQueue()